@@ -0,0 +1,206 @@
+# Batch (headless) runner for the toolbox: AddInitFlds -> MergeData -> GrpOcc, for many species.
+# Usage:
+#   python tbx_batch.py manifest.csv output_folder [--workers 4] [--tool-workers 2] [--reprocess]
+#
+# The manifest is a csv file with one row per species, and columns:
+#   species = species ELCODE (used to select rows from sources having an ELCODE column, and to get the species code)
+#   sources = source feature classes (polygons), separated by semicolons
+#   sep_dist = separation distance for grouping (e.g. "1000 Meters"). If empty, groups are taken from src_grpid.
+#      Several distances separated by semicolons (e.g. "500 Meters;1000 Meters") add a group ID field for each.
+#   network = (optional) network dataset, for network grouping
+# Optional columns: fld_date, fld_ra, fld_eo, fld_sf (source fields, defaults as in the AddInitFlds tool),
+#   barriers, tolerance, erase, method (GrpOcc parameters)
+#
+# Progress is saved (checkpointed) for each species and stage in output_folder/_batch, so a run that stops can be
+# re-run with the same arguments, and will continue where it stopped.
+# --tool-workers sets the tools' own workers parameter (AddInitFlds, MergeData and GrpOcc), and --reprocess runs all
+# species and stages again, ignoring checkpoints and the tools' unchanged-input checks.
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+toolbox = os.path.join(curr_dir, 'SDM-PresencePreProcessing.pyt')
+stages = ['AddInitFlds', 'MergeData', 'GrpOcc']
+defaultFields = {'fld_date': 'clean_date', 'fld_ra': 'clean_ra', 'fld_eo': 'SF_EOID', 'fld_sf': 'SFID'}
+
+
+def readManifest(manifest):
+   """Reads a batch manifest (csv). Returns a list of dictionaries, one for each species."""
+   jobs = []
+   with open(manifest, newline='') as f:
+      for r in csv.DictReader(f):
+         r = dict([(k.strip().lower(), (v or '').strip()) for k, v in r.items() if k])
+         if not r.get('species'):
+            continue
+         r['sources'] = [a.strip() for a in r.get('sources', '').split(';') if a.strip()]
+         for k, v in defaultFields.items():
+            if not r.get(k):
+               r[k] = v
+         jobs.append(r)
+   return jobs
+
+
+def checkpointFile(outFold, species):
+   return os.path.join(outFold, '_batch', species + '.json')
+
+
+def readCheckpoint(outFold, species):
+   """Returns saved stage outputs for a species ({stage: outputs}), or an empty dictionary."""
+   f = checkpointFile(outFold, species)
+   if os.path.exists(f):
+      with open(f) as cp:
+         return json.load(cp)
+   return {}
+
+
+def writeCheckpoint(outFold, species, done):
+   """Saves stage outputs for a species (written to a temporary file first, so a crash cannot corrupt it)."""
+   f = checkpointFile(outFold, species)
+   if not os.path.exists(os.path.dirname(f)):
+      os.makedirs(os.path.dirname(f))
+   with open(f + '.tmp', 'w') as cp:
+      json.dump(done, cp, indent=1)
+   os.replace(f + '.tmp', f)
+
+
+def schedule(jobs, sizes):
+   """Orders jobs largest first, so large species start early and small species fill in the remaining time
+   (longest-processing-time-first scheduling)."""
+   return [j for s, i, j in sorted(zip(sizes, range(len(jobs)), jobs), key=lambda a: (-a[0], a[1]))]
+
+
+_tbx = []
+
+
+def importToolbox():
+   """Imports the toolbox once per process. Returns the arcpy module."""
+   import arcpy
+   if not _tbx:
+      arcpy.ImportToolbox(toolbox)
+      _tbx.append(toolbox)
+   return arcpy
+
+
+def speciesSize(job):
+   """Number of source features for a species (used for scheduling)."""
+   import arcpy
+   n = 0
+   for src in job['sources']:
+      try:
+         n += int(arcpy.GetCount_management(sourceLayer(src, job['species']))[0])
+      except:
+         pass
+   return n
+
+
+def sourceLayer(src, species):
+   """Source features for a species: a layer selecting the species, if the source has an ELCODE column. The layer name
+   is the same in every run (AddInitFlds takes the source table name from the layer's dataset, not the layer)."""
+   import arcpy
+   from tbx_helper import sqlValues
+   if 'ELCODE' in [f.name for f in arcpy.ListFields(src)]:
+      name = 'src_' + hashlib.md5((os.path.normpath(src).lower() + '|' + species).encode('utf-8')).hexdigest()[:12]
+      return arcpy.MakeFeatureLayer_management(src, name, sqlValues(arcpy.AddFieldDelimiters(src, 'ELCODE'),
+                                                                    [species])).getOutput(0)
+   return src
+
+
+def runSpecies(job, outFold, toolWorkers=1, reprocess=False):
+   """Runs all stages for one species, skipping stages already completed (checkpointed), unless reprocess is True.
+   toolWorkers = workers parameter of the tools
+   reprocess = re-run all stages, even if completed or if the tools find their inputs unchanged
+   Returns a tuple: (species, status, message)"""
+   species = job['species']
+   t0 = time.time()
+   done = {} if reprocess else readCheckpoint(outFold, species)
+   try:
+      arcpy = importToolbox()
+      arcpy.env.overwriteOutput = True
+      if 'AddInitFlds' not in done:
+         outs = []
+         for src in job['sources']:
+            res = arcpy.AddInitFlds_sdmPresencePreProc(sourceLayer(src, species), species, outFold, job['fld_date'],
+                                                       job['fld_ra'], job['fld_eo'], job['fld_sf'], toolWorkers,
+                                                       reprocess)
+            outs.extend(res.getOutput(0).split(';'))
+         done['AddInitFlds'] = outs
+         writeCheckpoint(outFold, species, done)
+      if 'MergeData' not in done:
+         outs = done['AddInitFlds']
+         gdbs = sorted(set([os.path.normpath(os.path.dirname(a)) for a in outs]))
+         if len(gdbs) != 1:
+            raise Exception('AddInitFlds outputs for ' + species + ' are in ' + str(len(gdbs)) + ' geodatabases (' +
+                            ', '.join(gdbs) + '); MergeData needs them in one geodatabase.')
+         res = arcpy.MergeData_sdmPresencePreProc(gdbs[0], ';'.join([os.path.basename(a) for a in outs]), '#', '#',
+                                                  '#', reprocess, toolWorkers)
+         done['MergeData'] = [res.getOutput(0)]
+         writeCheckpoint(outFold, species, done)
+      if 'GrpOcc' not in done:
+         res = arcpy.GrpOcc_sdmPresencePreProc(done['MergeData'][0], job.get('sep_dist') or '', 'sdm_grpid',
+                                               job.get('network') or '', job.get('barriers') or '',
+                                               job.get('tolerance') or '100', job.get('erase') or '',
+                                               job.get('method') or 'Geoprocessing', reprocess, toolWorkers)
+         done['GrpOcc'] = res.getOutput(0).split(';')
+         writeCheckpoint(outFold, species, done)
+   except Exception:
+      return species, 'failed', traceback.format_exc()
+   return species, 'done', 'Completed in ' + str(round(time.time() - t0, 1)) + ' seconds.'
+
+
+def _runSpecies(args):
+   return runSpecies(*args)
+
+
+def runBatch(manifest, outFold, workers=1, toolWorkers=1, reprocess=False):
+   """Runs the full pipeline for all species in a manifest, on a pool of worker processes.
+   Species and stages already completed (see checkpoints in outFold/_batch) are skipped, unless reprocess is True.
+   toolWorkers = workers parameter of the tools (see runSpecies)
+   Returns a list of (species, status, message) tuples."""
+   jobs = readManifest(manifest)
+   todo = [j for j in jobs if reprocess or not all([s in readCheckpoint(outFold, j['species']) for s in stages])]
+   print(str(len(jobs) - len(todo)) + ' of ' + str(len(jobs)) + ' species already completed.')
+   if not todo:
+      return []
+   if workers > 1 and len(todo) > 1:
+      todo = schedule(todo, [speciesSize(j) for j in todo])
+   results = []
+   if workers > 1 and len(todo) > 1:
+      from tbx_helper import newPool
+      with newPool(min(workers, len(todo))) as pool:
+         for r in pool.imap_unordered(_runSpecies, [(j, outFold, toolWorkers, reprocess) for j in todo],
+                                      chunksize=1):
+            print(r[0] + ': ' + r[1] + '. ' + r[2])
+            results.append(r)
+   else:
+      for j in todo:
+         r = runSpecies(j, outFold, toolWorkers, reprocess)
+         print(r[0] + ': ' + r[1] + '. ' + r[2])
+         results.append(r)
+   failed = [r[0] for r in results if r[1] == 'failed']
+   if failed:
+      print(str(len(failed)) + ' species failed: ' + ', '.join(failed) + '. Re-run to retry them.')
+   return results
+
+
+def main(args):
+   parser = argparse.ArgumentParser(description='Run the SDM presence pre-processing tools for many species.')
+   parser.add_argument('manifest', help='csv file with one row per species')
+   parser.add_argument('outFold', help='output folder for species geodatabases')
+   parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+   parser.add_argument('--tool-workers', type=int, default=1, help='workers parameter of each tool')
+   parser.add_argument('--reprocess', action='store_true', help='re-run all species and stages')
+   a = parser.parse_args(args)
+   results = runBatch(a.manifest, a.outFold, a.workers, a.tool_workers, a.reprocess)
+   return 1 if [r for r in results if r[1] == 'failed'] else 0
+
+
+if __name__ == '__main__':
+   sys.exit(main(sys.argv[1:]))
+
+# end
@@ -0,0 +1,1409 @@
+# Benchmarks for toolbox helper functions. Run from the repository folder:
+#   python tbx_bench.py [--save results.json] [--compare baseline.json] [--tolerance 0.25]
+# Functions using arcpy run on the local arcpy stand-in (tbx_localarcpy) when ArcGIS is not installed.
+# --save records the results; --compare reports cases more than tolerance (fraction) slower than a saved baseline,
+# and exits with status 1 if there are any.
+# Tests are in tests/ (python -m pytest tests), and use the reference implementations here.
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime as datetime
+
+from tbx_core import *
+
+# recorded benchmark results (see record)
+results = []
+
+
+def timeit(fn, *args, **kwargs):
+   """Runs fn once, returning (seconds elapsed, result)."""
+   t0 = time.perf_counter()
+   res = fn(*args, **kwargs)
+   return time.perf_counter() - t0, res
+
+
+def record(name, n, seconds, old=None):
+   results.append({'name': name, 'n': n, 'seconds': round(seconds, 5),
+                   'old_seconds': None if old is None else round(old, 5)})
+
+
+def printBench(name, n, t_old, t_new):
+   record(name, n, t_new, t_old)
+   print('%-28s n=%-9s old: %8.3fs   new: %8.3fs   speedup: %6.1fx' %
+         (name, n, t_old, t_new, t_old / t_new if t_new > 0 else float('inf')))
+
+
+def printTime(name, n, t):
+   record(name, n, t)
+   print('%-28s n=%-9s time: %8.3fs' % (name, n, t))
+
+
+# Date formats for synthetic dates (see makeDates)
+dateFormats = ['datetime', 'ymd', 'ym', 'y', 'mdy', 'text-y', 'null', 'no date', 'number']
+
+
+def makeDates(n, nUnique=500, seed=1, formats=None):
+   """Generates a column of n raw date values with a mix of formats, drawn from nUnique distinct values.
+   formats = Optional dictionary of {format (see dateFormats): weight}. By default all formats are equally likely."""
+   rnd = random.Random(seed)
+   pool = []
+   if formats:
+      fNames = list(formats)
+      fWeights = [formats[f] for f in fNames]
+   for i in range(nUnique):
+      y, m, d = rnd.randint(1850, 2025), rnd.randint(1, 12), rnd.randint(1, 28)
+      if formats:
+         fmt = dateFormats.index(rnd.choices(fNames, fWeights)[0])
+      else:
+         fmt = rnd.randint(0, 8)
+      if fmt == 0:
+         v = datetime(y, m, d)
+      elif fmt == 1:
+         v = '%04d-%02d-%02d' % (y, m, d)
+      elif fmt == 2:
+         v = '%04d-%02d' % (y, m)
+      elif fmt == 3:
+         v = str(y) + rnd.choice(['', '-'])
+      elif fmt == 4:
+         v = '%d/%d/%04d' % (m, d, y)
+      elif fmt == 5:
+         v = 'pre-%04d?' % y
+      elif fmt == 6:
+         v = None
+      elif fmt == 7:
+         v = rnd.choice(['', 'unknown', 'no date', '19??'])
+      else:
+         v = y
+      pool.append(v)
+   return [rnd.choice(pool) for i in range(n)]
+
+
+# RA values for synthetic occurrences: allowed values, plus some which are flagged for editing
+raDefaultMix = {'Very High': 2, 'High': 4, 'Medium': 3, 'Low': 2, 'Very Low': 1, 'Unknown': 1, None: 1}
+
+
+def makeOccurrences(n, overlap=0.3, dateMix=None, raMix=None, nElcodes=1, extent=None, size=(20.0, 300.0),
+                    seed=1):
+   """Generates synthetic occurrence polygons (as from a source dataset for AddInitFlds).
+   n = number of polygons
+   overlap = fraction of polygons placed to overlap a previous polygon
+   dateMix = dictionary of {date format (see dateFormats): weight}
+   raMix = dictionary of {RA value: weight} (default raDefaultMix)
+   nElcodes = number of distinct species ELCODEs
+   extent = width of the square extent (default: scaled so density is constant)
+   Returns a dictionary of columns: rings (list of rings for each polygon), ELCODE, obsdate, RA, EO_ID, SF_ID"""
+   import math
+   rnd = random.Random(seed)
+   if extent is None:
+      extent = 1000.0 * n ** 0.5
+   raMix = raMix or raDefaultMix
+   raVals, raWeights = list(raMix), list(raMix.values())
+   occ = {'rings': [], 'ELCODE': [], 'obsdate': makeDates(n, max(n // 4, 1), seed, dateMix), 'RA': [],
+          'EO_ID': [], 'SF_ID': []}
+   centers = []
+   elcodes = ['ELCODE%04d' % i for i in range(nElcodes)]
+   for i in range(n):
+      r = rnd.uniform(*size)
+      if centers and rnd.random() < overlap:
+         k = rnd.randrange(len(centers))
+         cx, cy, r0 = centers[k]
+         a = rnd.uniform(0, 2 * math.pi)
+         cx, cy = cx + r0 * 0.8 * math.cos(a), cy + r0 * 0.8 * math.sin(a)
+         eo = occ['EO_ID'][k]
+         el = occ['ELCODE'][k]
+      else:
+         cx, cy = rnd.uniform(0, extent), rnd.uniform(0, extent)
+         eo = len(centers) + 1
+         el = rnd.choice(elcodes)
+      nv = rnd.randint(6, 30)
+      ang = sorted([rnd.uniform(0, 2 * math.pi) for k in range(nv)])
+      ring = [(cx + rr * math.cos(a), cy + rr * math.sin(a)) for a, rr in
+              zip(ang, [rnd.uniform(0.4 * r, r) for k in range(nv)])]
+      occ['rings'].append([ring + ring[:1]])
+      occ['ELCODE'].append(el)
+      occ['RA'].append(rnd.choices(raVals, raWeights)[0])
+      occ['EO_ID'].append(eo)
+      occ['SF_ID'].append(i + 1)
+      centers.append((cx, cy, r))
+   return occ
+
+
+def useArcpy():
+   """Imports arcpy, installing the local stand-in (tbx_localarcpy) if ArcGIS is not available."""
+   import tbx_localarcpy
+   tbx_localarcpy.install()
+   import arcpy
+   arcpy.env.overwriteOutput = True
+   return arcpy
+
+
+def benchGDB():
+   """Geodatabase for benchmark datasets (the stand-in keeps these in memory)."""
+   arcpy = useArcpy()
+   gdb = os.path.join(arcpy.env.scratchFolder, 'tbx_bench.gdb')
+   if not arcpy.Exists(gdb):
+      arcpy.CreateFileGDB_management(os.path.dirname(gdb), os.path.basename(gdb))
+   return gdb
+
+
+def loadOccurrences(fc, occ):
+   """Writes synthetic occurrences (see makeOccurrences) to a new polygon feature class."""
+   arcpy = useArcpy()
+   arcpy.CreateFeatureclass_management(os.path.dirname(fc), os.path.basename(fc), 'POLYGON')
+   arcpy.AddFields_management(fc, [['ELCODE', 'TEXT', 'ELCODE', 20], ['obsdate', 'TEXT', 'obsdate', 50],
+                                   ['RA', 'TEXT', 'RA', 20], ['EO_ID', 'LONG'], ['SF_ID', 'LONG']])
+   flds = ['ELCODE', 'obsdate', 'RA', 'EO_ID', 'SF_ID']
+   with arcpy.da.InsertCursor(fc, ['SHAPE@'] + flds) as ic:
+      for i, rings in enumerate(occ['rings']):
+         geom = arcpy.Polygon(arcpy.Array([arcpy.Array([arcpy.Point(*xy) for xy in r]) for r in rings]))
+         d = occ['obsdate'][i]
+         ic.insertRow([geom] + [occ['ELCODE'][i], None if d is None else str(d)] + [occ[f][i] for f in flds[2:]])
+   return fc
+
+
+def loadLines(fc, ids, lines, idField='NHDPlusID'):
+   """Writes flowlines (see makeNetwork) to a new line feature class."""
+   arcpy = useArcpy()
+   arcpy.CreateFeatureclass_management(os.path.dirname(fc), os.path.basename(fc), 'POLYLINE')
+   arcpy.AddField_management(fc, idField, 'DOUBLE')
+   with arcpy.da.InsertCursor(fc, ['SHAPE@', idField]) as ic:
+      for fid, ln in zip(ids, lines):
+         ic.insertRow([arcpy.Polyline(arcpy.Array([arcpy.Point(float(x), float(y)) for x, y in ln])), fid])
+   return fc
+
+
+def makeCatchments(extent, cell=500.0, seed=1):
+   """Generates synthetic catchments (a grid of square cells over a square extent), each with one meandering flowline
+   crossing it. Returns a tuple: (list of flowline IDs, list of catchment rings, list of flowline vertex arrays)"""
+   import numpy as np
+   rnd = np.random.default_rng(seed)
+   ids, rings, lines = [], [], []
+   n = int(np.ceil(extent / cell))
+   for i in range(n):
+      for j in range(n):
+         x0, y0 = i * cell, j * cell
+         ids.append(len(ids) + 1)
+         rings.append([(x0, y0), (x0, y0 + cell), (x0 + cell, y0 + cell), (x0 + cell, y0), (x0, y0)])
+         xs = x0 + np.linspace(0, cell, 6)
+         ys = y0 + cell / 2 + rnd.uniform(-cell / 4, cell / 4, 6)
+         lines.append(np.column_stack([xs, ys]))
+   return ids, rings, lines
+
+
+def loadPolygons(fc, ids, rings, idField='NHDPlusID'):
+   """Writes polygons (one ring each) with an ID field to a new polygon feature class."""
+   arcpy = useArcpy()
+   arcpy.CreateFeatureclass_management(os.path.dirname(fc), os.path.basename(fc), 'POLYGON')
+   arcpy.AddField_management(fc, idField, 'DOUBLE')
+   with arcpy.da.InsertCursor(fc, ['SHAPE@', idField]) as ic:
+      for fid, r in zip(ids, rings):
+         ic.insertRow([arcpy.Polygon(arcpy.Array([arcpy.Point(float(x), float(y)) for x, y in r])), fid])
+   return fc
+
+
+def loadPoints(fc, pts):
+   """Writes points to a new point feature class."""
+   arcpy = useArcpy()
+   arcpy.CreateFeatureclass_management(os.path.dirname(fc), os.path.basename(fc), 'POINT')
+   with arcpy.da.InsertCursor(fc, ['SHAPE@XY']) as ic:
+      for x, y in pts:
+         ic.insertRow([(float(x), float(y))])
+   return fc
+
+
+def bench_getStdDate(sizes=(10000, 100000, 500000)):
+   """Compares per-row getStdDate with batch getStdDates."""
+   getStdDates([])  # warm up (numpy import)
+   for n in sizes:
+      dates = makeDates(n)
+      t_old = timeit(lambda: [getStdDate(d) for d in dates])[0]
+      t_new = timeit(getStdDates, dates)[0]
+      printBench('getStdDate', n, t_old, t_new)
+
+
+def makePolys(n, extent=50000.0, size=(20.0, 300.0), seed=1):
+   """Generates n random (star-shaped) tbx_geom.Poly polygons within a square extent."""
+   import numpy as np
+   import tbx_geom
+   rnd = np.random.default_rng(seed)
+   polys = []
+   for i in range(n):
+      cx, cy = rnd.uniform(0, extent, 2)
+      r = rnd.uniform(*size)
+      nv = int(rnd.integers(6, 30))
+      ang = np.sort(rnd.uniform(0, 2 * np.pi, nv))
+      rr = rnd.uniform(0.4 * r, r, nv)
+      polys.append(tbx_geom.Poly([np.column_stack([cx + rr * np.cos(ang), cy + rr * np.sin(ang)])]))
+   return polys
+
+
+def clusterBrute(polys, sepDist):
+   """All-pairs clustering (no spatial index), for comparison with tbx_geom.clusterPolygons."""
+   import tbx_geom
+   ds = DisjointSet(len(polys))
+   for i in range(len(polys)):
+      for j in range(i + 1, len(polys)):
+         if tbx_geom.polyDistance(polys[i], polys[j], sepDist) <= sepDist:
+            ds.union(i, j)
+   return ds.labels()
+
+
+def bench_SpatialCluster(sizes=(500, 2000), sepDist=500.0):
+   """Compares in-memory clustering (grid index) with all-pairs distance clustering."""
+   import tbx_geom
+   for n in sizes:
+      polys = makePolys(n, extent=2000.0 * n ** 0.5)
+      t_old = timeit(clusterBrute, polys, sepDist)[0]
+      t_new = timeit(tbx_geom.clusterPolygons, polys, sepDist)[0]
+      printBench('SpatialCluster (index)', n, t_old, t_new)
+
+
+def bench_ClusterTree(sizes=(500, 2000), dists=(250.0, 500.0, 1000.0, 2000.0)):
+   """Compares grouping at several distances from one cluster hierarchy (ClusterTree) with clustering separately at
+   each distance (clusterPolygons)."""
+   import tbx_geom
+
+   def multiTree(polys):
+      tree = tbx_geom.ClusterTree.build(polys, max(dists))
+      return [tree.groups(d) for d in dists]
+
+   for n in sizes:
+      polys = makePolys(n, extent=2000.0 * n ** 0.5)
+      t_old = timeit(lambda: [tbx_geom.clusterPolygons(polys, d) for d in dists])[0]
+      t_new = timeit(multiTree, polys)[0]
+      printBench('ClusterTree (%d distances)' % len(dists), n, t_old, t_new)
+
+
+def makeNetwork(nLines, seed=1):
+   """Generates a synthetic dendritic stream network (a tree of 3-vertex flowlines).
+   Returns a tuple: (list of flowline IDs, list of flowline vertex arrays)"""
+   import numpy as np
+   rnd = np.random.default_rng(seed)
+   nodes = [(0.0, 0.0)]
+   lines = []
+   for i in range(nLines):
+      p = nodes[rnd.integers(0, len(nodes))]
+      ang = rnd.uniform(0, 2 * np.pi)
+      ln = rnd.uniform(100, 800)
+      q = (p[0] + ln * np.cos(ang), p[1] + ln * np.sin(ang))
+      mid = ((p[0] + q[0]) / 2 + rnd.uniform(-30, 30), (p[1] + q[1]) / 2 + rnd.uniform(-30, 30))
+      lines.append(np.array([q, mid, p]))
+      nodes.append(q)
+   return list(range(1, nLines + 1)), lines
+
+
+def makeNetworkPoints(lines, n, noise=3.0, seed=1):
+   """Generates n points near random locations along flowlines."""
+   import numpy as np
+   rnd = np.random.default_rng(seed)
+   pts = []
+   for i in range(n):
+      ln = lines[rnd.integers(0, len(lines))]
+      k = rnd.integers(0, len(ln) - 1)
+      pts.append(ln[k] + (ln[k + 1] - ln[k]) * rnd.uniform() + rnd.normal(0, noise, 2))
+   return np.array(pts)
+
+
+def networkBrute(graph, occEdge, occOffset, maxDist, cutEdge, cutOffset):
+   """Network grouping by a separate bounded search from every occurrence, for comparison with
+   tbx_network.networkClusters."""
+   import heapq
+   adj = {}
+
+   def add(u, v, w):
+      adj.setdefault(u, []).append((v, w))
+      adj.setdefault(v, []).append((u, w))
+
+   ev = {}
+   for i, (e, o) in enumerate(zip(occEdge, occOffset)):
+      if e >= 0:
+         ev.setdefault(e, []).append((o, 0, i))
+   for e, o in zip(cutEdge, cutOffset):
+      if e >= 0:
+         ev.setdefault(e, []).append((o, 1, -1))
+   for e in range(graph.nEdges):
+      prev, po = ('n', int(graph.edgeFrom[e])), 0.0
+      for o, kind, i in sorted(ev.get(e, [])):
+         if kind == 0 and prev is not None:
+            add(prev, ('o', i), o - po)
+         prev, po = (('o', i) if kind == 0 else None), o
+      if prev is not None:
+         add(prev, ('n', int(graph.edgeTo[e])), graph.edgeLen[e] - po)
+   ds = DisjointSet(len(occEdge))
+   for i in range(len(occEdge)):
+      if occEdge[i] < 0:
+         continue
+      dist = {('o', i): 0.0}
+      h = [(0.0, ('o', i))]
+      while h:
+         d, u = heapq.heappop(h)
+         if d > dist[u]:
+            continue
+         for v, w in adj.get(u, []):
+            if d + w <= maxDist and d + w < dist.get(v, float('inf')):
+               dist[v] = d + w
+               heapq.heappush(h, (d + w, v))
+      for u in dist:
+         if u[0] == 'o':
+            ds.union(i, u[1])
+   lab = {}
+   return [lab.setdefault(ds.find(i), len(lab) + 1) if occEdge[i] >= 0 else None for i in range(len(occEdge))]
+
+
+def bench_networkClusters(sizes=((1000, 200), (5000, 1000)), sepDist=2000.0):
+   """Compares multi-source network grouping with a separate search from every occurrence."""
+   import tbx_network
+   for nLines, nPts in sizes:
+      ids, lines = makeNetwork(nLines)
+      graph = tbx_network.FlowGraph.fromLines(ids, lines)
+      occEdge, occOffset = graph.snap(makeNetworkPoints(lines, nPts), 20.0)
+      cutEdge, cutOffset = graph.snap(makeNetworkPoints(lines, nPts // 10, noise=0.0, seed=2), 2.1)
+      t_old = timeit(networkBrute, graph, occEdge, occOffset, sepDist, cutEdge, cutOffset)[0]
+      t_new = timeit(tbx_network.networkClusters, graph, occEdge, occOffset, sepDist, cutEdge, cutOffset)[0]
+      printBench('networkClusters', nPts, t_old, t_new)
+
+
+def snapOld(graph, pts, snapDist):
+   """Point-by-point snapping (FlowGraph.snap before it was vectorized), for comparison."""
+   import numpy as np
+   import tbx_geom
+   pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+   edge = np.full(len(pts), -1, dtype=np.int64)
+   offset = np.zeros(len(pts))
+   idx = tbx_geom.GridIndex(graph.edgeIndex().bboxes)
+   for i, (x, y) in enumerate(pts):
+      best = snapDist
+      for e in idx.query((x, y, x, y), snapDist):
+         v = graph.xy[graph.xyptr[e]:graph.xyptr[e + 1]]
+         segs = np.hstack([v[:-1], v[1:]])
+         d = tbx_geom.pointSegDist(np.array([[x, y]]), segs)[0]
+         k = int(d.argmin())
+         if d[k] <= best:
+            best = d[k]
+            sl = np.hypot(*np.diff(v, axis=0).T)
+            s = segs[k]
+            ln = sl[k] if sl[k] > 0 else 1.0
+            t = min(max(((x - s[0]) * (s[2] - s[0]) + (y - s[1]) * (s[3] - s[1])) / ln ** 2, 0.0), 1.0)
+            edge[i] = e
+            offset[i] = sl[:k].sum() + t * sl[k]
+   return edge, offset
+
+
+def bench_snap(sizes=((5000, 10000), (10000, 10000)), snapDist=20.0):
+   """Compares vectorized snapping of points to flowlines (FlowGraph.snap) with point-by-point snapping."""
+   import tbx_network
+   for nLines, nPts in sizes:
+      ids, lines = makeNetwork(nLines)
+      graph = tbx_network.FlowGraph.fromLines(ids, lines)
+      pts = makeNetworkPoints(lines, nPts, noise=10.0)
+      graph.edgeIndex()
+      t_old = timeit(snapOld, graph, pts, snapDist)[0]
+      t_new = timeit(graph.snap, pts, snapDist)[0]
+      printBench('FlowGraph.snap', nPts, t_old, t_new)
+
+
+def joinEval(fromRows, toRows, nFlds):
+   """The original (eval-based) JoinFields lookup, on in-memory rows, for comparison with JoinTable."""
+   def getFldVal(srcID, fldDict):
+      try:
+         fldVal = fldDict[srcID]
+      except:
+         fldVal = None
+      return fldVal
+   codeDict = {}
+   text = "sc[" + ("], sc[").join([str(n) for n in range(1, nFlds + 1)]) + "]"
+   for sc in fromRows:
+      codeDict[sc[0]] = eval(text)
+   out = []
+   for row in toRows:
+      row = list(row)
+      vals = getFldVal(row[0], codeDict)
+      if vals:
+         row[1:] = list(vals)
+      out.append(row)
+   return out
+
+
+def joinTable(fromRows, toRows, nFlds):
+   """JoinFields lookup (JoinTable), on in-memory rows."""
+   cols = [list(c) for c in zip(*fromRows)]
+   jt = JoinTable(cols[0], cols[1:])
+   out = []
+   for row in toRows:
+      vals = jt.get(row[0])
+      if vals is not None:
+         row = (row[0],) + vals
+      out.append(list(row))
+   return out
+
+
+def bench_JoinFields(sizes=(100000, 500000), nFlds=5):
+   """Compares the JoinFields hash index with the original eval-based lookup (in memory, no arcpy)."""
+   rnd = random.Random(1)
+   for n in sizes:
+      fromRows = [(i,) + tuple(rnd.random() for f in range(nFlds)) for i in range(n)]
+      toRows = [(rnd.randint(0, n * 2),) + (None,) * nFlds for i in range(n)]
+      t_old, old = timeit(joinEval, fromRows, toRows, nFlds)
+      t_new, new = timeit(joinTable, fromRows, toRows, nFlds)
+      if old != new:
+         raise Exception('JoinTable output does not match original JoinFields.')
+      printBench('JoinFields (in memory)', n, t_old, t_new)
+
+
+def bench_JoinFields_arcpy(sizes=(100000, 1000000), nFlds=5):
+   """Compares JoinFields with arcpy.JoinField_management, on tables in the scratch geodatabase (requires arcpy)."""
+   import arcpy
+   import numpy as np
+   from tbx_helper import JoinFields
+   arcpy.env.overwriteOutput = True
+   gdb = arcpy.env.scratchGDB
+   rnd = np.random.default_rng(1)
+   flds = ['val' + str(f) for f in range(nFlds)]
+   for n in sizes:
+      fromArr = np.zeros(n, dtype=[('key', 'i4')] + [(f, 'f8') for f in flds])
+      fromArr['key'] = np.arange(n)
+      for f in flds:
+         fromArr[f] = rnd.random(n)
+      toArr = np.zeros(n, dtype=[('tokey', 'i4')])
+      toArr['tokey'] = rnd.integers(0, n * 2, n)
+      fromTab = gdb + '/bench_from'
+      arcpy.da.NumPyArrayToTable(fromArr, fromTab)
+      times = []
+      for fn in [arcpy.JoinField_management, JoinFields]:
+         toTab = gdb + '/bench_to'
+         if arcpy.Exists(toTab):
+            arcpy.Delete_management(toTab)
+         arcpy.da.NumPyArrayToTable(toArr, toTab)
+         times.append(timeit(fn, toTab, 'tokey', fromTab, 'key', flds)[0])
+      printBench('JoinFields (vs JoinField)', n, times[0], times[1])
+      arcpy.Delete_management(fromTab)
+      arcpy.Delete_management(toTab)
+
+
+# Rectangle-set regions (lists of disjoint (xmin, ymin, xmax, ymax) boxes): exact overlay operations without a
+# geometry library, for testing tbx_geom.overlayFaces.
+def rectIntersect(a, b):
+   out = []
+   for r in a:
+      for s in b:
+         x1, y1, x2, y2 = max(r[0], s[0]), max(r[1], s[1]), min(r[2], s[2]), min(r[3], s[3])
+         if x1 < x2 and y1 < y2:
+            out.append((x1, y1, x2, y2))
+   return out
+
+
+def rectDifference(a, b):
+   out = list(a)
+   for s in b:
+      nxt = []
+      for r in out:
+         if s[0] >= r[2] or s[2] <= r[0] or s[1] >= r[3] or s[3] <= r[1]:
+            nxt.append(r)
+            continue
+         if r[1] < s[1]:
+            nxt.append((r[0], r[1], r[2], s[1]))
+         if s[3] < r[3]:
+            nxt.append((r[0], s[3], r[2], r[3]))
+         y1, y2 = max(r[1], s[1]), min(r[3], s[3])
+         if r[0] < s[0]:
+            nxt.append((r[0], y1, s[0], y2))
+         if s[2] < r[2]:
+            nxt.append((s[2], y1, r[2], y2))
+      out = nxt
+   return out
+
+
+def rectBbox(a):
+   return (min(r[0] for r in a), min(r[1] for r in a), max(r[2] for r in a), max(r[3] for r in a))
+
+
+def makeRects(n, extent=10000.0, size=(20.0, 400.0), seed=1):
+   """Generates n random rectangle regions."""
+   rnd = random.Random(seed)
+   out = []
+   for i in range(n):
+      x, y = rnd.uniform(0, extent), rnd.uniform(0, extent)
+      out.append([(x, y, x + rnd.uniform(*size), y + rnd.uniform(*size))])
+   return out
+
+
+def checkFaces(polys, faces, nPts=2000, seed=1):
+   """Checks overlay faces against point sampling: each point must be in exactly one face, whose polygon list is
+   the list of polygons containing the point."""
+   rnd = random.Random(seed)
+   bb = rectBbox([r for p in polys for r in p])
+   inside = lambda x, y, reg: any(r[0] < x < r[2] and r[1] < y < r[3] for r in reg)
+   for k in range(nPts):
+      x, y = rnd.uniform(bb[0], bb[2]), rnd.uniform(bb[1], bb[3])
+      cover = sorted(i for i, p in enumerate(polys) if inside(x, y, p))
+      fc = [sorted(ids) for f, ids in faces if inside(x, y, f)]
+      if (cover and fc != [cover]) or (not cover and fc):
+         return False
+   return True
+
+
+def bench_GetOverlapping(sizes=(500, 1000)):
+   """Compares overlay faces computed within bounding-box groups (spatial index) with a single incremental
+   overlay of all polygons."""
+   import tbx_geom
+   for n in sizes:
+      polys = makeRects(n, extent=250.0 * n ** 0.5)
+      bboxes = [rectBbox(p) for p in polys]
+      ext = rectBbox([r for p in polys for r in p])
+      args = (rectIntersect, rectDifference, lambda a: len(a) == 0, rectBbox)
+      t_old = timeit(tbx_geom.overlayFaces, polys, [ext] * n, *args)[0]
+      t_new = timeit(tbx_geom.overlayFaces, polys, bboxes, *args)[0]
+      printBench('GetOverlapping (faces)', n, t_old, t_new)
+
+
+def makeDuplicates(n, nGroups, seed=1):
+   """Generates columns (oids, uniqID_poly, sdm_ra, sdm_date) of n overlapping polygon rows in nGroups overlap areas."""
+   rnd = random.Random(seed)
+   oids = list(range(1, n + 1))
+   grp = [rnd.randint(1, nGroups) for i in oids]
+   ra = [rnd.randint(0, 5) for i in oids]
+   dates = [rnd.choice(['%04d-%02d-%02d' % (rnd.randint(1950, 2020), rnd.randint(0, 12), rnd.randint(0, 28)),
+                        '0000-00-00', None]) for i in oids]
+   return oids, grp, ra, dates
+
+
+def duplicatesPandas(oids, grp, ra, dates):
+   """The original MergeData ranking (pandas sort and drop_duplicates), for comparison with spatialDuplicates. As in
+   MergeData, only overlap areas with more than one polygon are ranked, and rows with nulls are dropped (fc2df)."""
+   from pandas import DataFrame
+   df = DataFrame({'OBJECTID': oids, 'uniqID_poly': grp, 'sdm_ra': ra, 'sdm_date': dates})
+   df = df[df.groupby('uniqID_poly')['OBJECTID'].transform('size') > 1]
+   dfmax = df.dropna().sort_values(['sdm_ra', 'sdm_date', 'OBJECTID'], ascending=False).drop_duplicates('uniqID_poly')
+   return set(df.OBJECTID) - set(dfmax.OBJECTID)
+
+
+def duplicatesSort(oids, grp, ra, dates):
+   """MergeData ranking with a Python sort (used when pandas is not available)."""
+   best = {}
+   for k in sorted([r for r in zip(grp, ra, dates, oids) if None not in r], reverse=True):
+      best.setdefault(k[0], k[3])
+   n = Counter(grp)
+   return set([o for g, o in zip(grp, oids) if n[g] > 1]) - set(best.values())
+
+
+def bench_spatialDuplicates(sizes=(100000, 1000000)):
+   """Compares spatialDuplicates (NumPy lexsort) with the original MergeData ranking."""
+   try:
+      import pandas
+      old_fn = duplicatesPandas
+   except ImportError:
+      old_fn = duplicatesSort
+   for n in sizes:
+      oids, grp, ra, dates = makeDuplicates(n, n // 3)
+      t_old = timeit(old_fn, oids, grp, ra, dates)[0]
+      t_new = timeit(spatialDuplicates, oids, grp, [ra, dates])[0]
+      printBench('MergeData duplicates', n, t_old, t_new)
+
+
+def partitionOld(inFeats, fld, outDict):
+   """Splits features into one feature class per value of a field (the AddInitFlds copy step, before
+   tbx_helper.writeInitFlds)."""
+   arcpy = useArcpy()
+   sr = arcpy.Describe(inFeats).spatialReference
+   for out in outDict.values():
+      arcpy.CreateFeatureclass_management(os.path.dirname(out), os.path.basename(out), template=inFeats,
+                                          has_m='SAME_AS_TEMPLATE', has_z='SAME_AS_TEMPLATE', spatial_reference=sr)
+   ls = ['SHAPE@'] + [f.name for f in arcpy.ListFields(inFeats) if f.type not in ['OID', 'Geometry'] and f.editable]
+   ix = ls.index(fld)
+   rowDict = {}
+   with arcpy.da.SearchCursor(inFeats, ls) as sc:
+      for row in sc:
+         if row[ix] in outDict:
+            rowDict.setdefault(row[ix], []).append(row)
+   for val, rows in rowDict.items():
+      with arcpy.da.InsertCursor(outDict[val], ls) as ic:
+         for row in rows:
+            ic.insertRow(row)
+
+
+def prepInitFldsOld(outPolys, srcTab, spCode, fldDate, fldSFRA, fldEO, fldSF):
+   """Adds and calculates the initial fields on a copy of the input, then counts flagged rows (the AddInitFlds field
+   step, before tbx_helper.writeInitFlds)."""
+   arcpy = useArcpy()
+   from tbx_helper import initFieldsFull, fldSrcFID, fldSrcTab, fldSpCode, fldUse, fldEOID, fldSFID, fldSFRACalc, \
+      fldRAFlag, fldDateCalc, fldDateFlag
+   existFld = [f.name for f in arcpy.ListFields(outPolys)]
+   arcpy.AddFields_management(outPolys, [a for a in initFieldsFull if a[0] not in existFld])
+   fldID = [f.name for f in arcpy.Describe(outPolys).fields if f.type == 'OID'][0]
+   dateOIDs, dateVals = [], []
+   for row in arcpy.da.SearchCursor(outPolys, [fldID, fldDate]):
+      dateOIDs.append(row[0])
+      dateVals.append(row[1])
+   stdDates, dateFlags = getStdDates(dateVals)
+   dateIdx = dict(zip(dateOIDs, range(len(dateOIDs))))
+   fldlist = [fldID, fldSrcFID.Name, fldSrcTab.Name, fldSpCode.Name, fldUse.Name, fldEO, fldEOID.Name, fldSF,
+              fldSFID.Name, fldSFRA, fldSFRACalc.Name, fldRAFlag.Name, fldDate, fldDateCalc.Name, fldDateFlag.Name]
+   with arcpy.da.UpdateCursor(outPolys, fldlist) as curs:
+      for row in curs:
+         row[1:5] = [row[0], srcTab, spCode, 1]
+         row[6] = row[5]
+         row[8] = row[7]
+         row[10] = row[9]
+         if row[9] not in ['Very High', 'High', 'Medium', 'Low', 'Very Low']:
+            row[11] = 1
+         i = dateIdx[row[0]]
+         row[13] = str(stdDates[i])
+         if dateFlags[i] == 1:
+            row[14] = 1
+         curs.updateRow(row)
+   nRA = len([a[0] for a in arcpy.da.SearchCursor(outPolys, fldRAFlag.Name) if a[0] == 1])
+   nDate = len([a[0] for a in arcpy.da.SearchCursor(outPolys, fldDateFlag.Name) if a[0] == 1])
+   return nRA, nDate
+
+
+def bench_AddInitFlds(sizes=(5000, 50000), nElcodes=(1, 50)):
+   """Times the AddInitFlds data preparation (copy or split by species, and initial fields), as separate copy,
+   update and count passes, and in one pass (writeInitFlds), on synthetic occurrences with mixed date formats and
+   RA values (uses arcpy, or the local stand-in)."""
+   arcpy = useArcpy()
+   from tbx_helper import writeInitFlds
+   getStdDates([])  # warm up (numpy import)
+   gdb = benchGDB()
+   check = ['sp_code', 'src_table', 'src_grpid', 'src_featid', 'sdm_use', 'tempSFRACalc', 'sdm_ra_flag', 'sdm_date',
+            'sdm_date_flag']
+   for n in sizes:
+      for ne in nElcodes:
+         src = loadOccurrences(gdb + '/bench_occ', makeOccurrences(n, nElcodes=ne))
+         els = ['ELCODE%04d' % i for i in range(ne)]
+         times, outs, counts = [], [], []
+         for k in range(2):
+            outDict = dict([(el, gdb + '/bench_occ_' + str(i) + '_' + str(k)) for i, el in enumerate(els)])
+            t0 = time.perf_counter()
+            if k == 0:
+               partitionOld(src, 'ELCODE', outDict)
+               c = sorted([(el, prepInitFldsOld(out, 'bench', 'spcode', 'obsdate', 'RA', 'EO_ID', 'SF_ID'))
+                           for el, out in outDict.items()])
+            else:
+               res = writeInitFlds(src, dict([(el, (out, 'spcode')) for el, out in outDict.items()]), 'bench',
+                                   'obsdate', 'RA', 'EO_ID', 'SF_ID', 'ELCODE')
+               c = sorted([(el, (r.count('RA'), r.count('date'))) for o, r, el, fp in res])
+            times.append(time.perf_counter() - t0)
+            counts.append(c)
+            outs.append([[list(r) for r in arcpy.da.SearchCursor(out, check)] for out in outDict.values()])
+         if outs[0] != outs[1] or counts[0] != counts[1]:
+            raise Exception('AddInitFlds output from writeInitFlds does not match the original.')
+         printBench('AddInitFlds (' + str(ne) + ' spp)', n, times[0], times[1])
+
+
+def bench_partitionMerged(sizes=(10000, 50000), nParts=8):
+   """Times splitting merged polygons into partitions for parallel MergeData (partitionMerged), and checks that no
+   overlapping polygons or parts of one source feature are split between partitions (arcpy or the local stand-in)."""
+   arcpy = useArcpy()
+   import tbx_geom
+   from tbx_helper import ScratchWorkspace, writeInitFlds, partitionMerged
+   gdb = benchGDB()
+   for n in sizes:
+      src = loadOccurrences(gdb + '/bench_occ', makeOccurrences(n, overlap=0.3))
+      occ = gdb + '/bench_occ_init'
+      writeInitFlds(src, {None: (occ, 'spcode')}, 'bench', 'obsdate', 'RA', 'EO_ID', 'SF_ID')
+      with ScratchWorkspace() as scratch:
+         t, parts = timeit(partitionMerged, occ, nParts)
+         where, bboxes = {}, []
+         for k, part in enumerate(parts):
+            for g, fid in arcpy.da.SearchCursor(part, ['SHAPE@', 'src_fid']):
+               where.setdefault(fid, set()).add(k)
+               bboxes.append((g.extent.XMin, g.extent.YMin, g.extent.XMax, g.extent.YMax, k))
+         counts = [len([b for b in bboxes if b[4] == k]) for k in range(len(parts))]
+      if len(bboxes) != n or [f for f, ks in where.items() if len(ks) > 1]:
+         raise Exception('Partitions do not contain each source feature exactly once.')
+      pairs = tbx_geom.GridIndex([b[:4] for b in bboxes]).pairs(0.2)
+      if len([1 for i, j in pairs.tolist() if bboxes[i][4] != bboxes[j][4]]) > 0:
+         raise Exception('Overlapping polygons are split between partitions.')
+      printTime('partitionMerged', n, t)
+      print('   ' + str(len(parts)) + ' partitions, largest has ' + str(round(100.0 * max(counts) / n, 1)) +
+            '% of polygons')
+
+
+def pointGroups(pts, flowlines, dams, sepDist, snapDist):
+   """Network groups of points as in SpatialClusterNetwork (GRAPH method): groups along flowlines, merged when they
+   share a catchment reach. Returns a set of groups, each a frozenset of SF_ID values, and a dictionary of
+   {SF_ID: {group: number of sampled points}}, from which SpatialClusterNetwork picks each polygon's group."""
+   arcpy = useArcpy()
+   from tbx_helper import networkGroupsGraph
+   r = sepDist / 2 - 2
+   num = networkGroupsGraph(pts, flowlines, dams, 2 * r + 2, snapDist, 'sdm_grpid') + 1
+   rows = [r for r in arcpy.da.SearchCursor(pts, ['SF_ID', 'sdm_grpid', 'NHDPlusID', 'sample_pts'])]
+   newIDs = mergeGroups([a[1] for a in rows], [a[2] for a in rows], num)[0]
+   grps = {}
+   for sf, g, fid, w in rows:
+      grps.setdefault(newIDs.get(g, g), set()).add(sf)
+   grps = dict([(g, frozenset(a)) for g, a in grps.items()])
+   counts = {}
+   for sf, g, fid, w in rows:
+      c = counts.setdefault(sf, {})
+      g = grps[newIDs.get(g, g)]
+      c[g] = c.get(g, 0) + w
+   return set(grps.values()), counts
+
+
+def bench_polySnapPoints(sizes=(1000, 5000), spacing=30.0, snapDist=100.0, sepDist=500.0):
+   """Times sampling network facility points in polygons by catchment (polySnapPoints), with and without dropping
+   points which cannot change groups, on synthetic catchments with dams (arcpy or the local stand-in)."""
+   arcpy = useArcpy()
+   from tbx_helper import polySnapPoints
+   gdb = benchGDB()
+   for n in sizes:
+      occ = makeOccurrences(n, overlap=0.0, size=(20.0, 600.0))
+      polys = loadOccurrences(gdb + '/bench_occ', occ)
+      ext = max([max([max(x, y) for x, y in r[0]]) for r in occ['rings']])
+      ids, rings, lines = makeCatchments(ext)
+      cats = loadPolygons(gdb + '/bench_cats', ids, rings)
+      flowlines = loadLines(gdb + '/bench_flowlines', ids, lines)
+      dams = loadPoints(gdb + '/bench_dams', makeNetworkPoints(lines, len(lines) // 4, noise=0.0, seed=2))
+      counts, times = [], []
+      for maxGap in [None, sepDist / 2 - 2]:
+         out = gdb + '/bench_facilities'
+         times.append(timeit(polySnapPoints, polys, cats, flowlines, out, spacing, snapDist, maxGap, dams)[0])
+         counts.append(int(arcpy.GetCount_management(out)[0]))
+      printBench('polySnapPoints (capped)', n, times[0], times[1])
+      print('   points: ' + str(counts[0]) + ' sampled, ' + str(counts[1]) + ' kept')
+
+
+def locateOld(catchments, pts, flowID='NHDPlusID'):
+   """Catchment flowline IDs for points, reading all catchments into memory with a grid index (the catchment step of
+   polySnapPoints, before tbx_helper.catchmentIndex)."""
+   arcpy = useArcpy()
+   import tbx_geom
+   from tbx_helper import geom2rings
+   ids, polys = [], []
+   for fid, geom in arcpy.da.SearchCursor(catchments, [flowID, 'SHAPE@']):
+      ids.append(fid)
+      polys.append(tbx_geom.Poly(geom2rings(geom)))
+   idx = tbx_geom.GridIndex([p.bbox for p in polys])
+   out = []
+   for xy in pts:
+      fid = None
+      for k in idx.query((xy[0], xy[1], xy[0], xy[1])).tolist():
+         if polys[k].contains([xy])[0]:
+            fid = ids[k]
+            break
+      out.append(fid)
+   return out
+
+
+def bench_catchmentIndex(sizes=(10000, 40000), nPts=2000, nLines=500):
+   """Times assigning occurrence points to catchments by reading all catchments (old), and with the catchment
+   index, built (cold) or re-used from disk (warm)."""
+   arcpy = useArcpy()
+   import numpy as np
+   import tbx_helper
+   from tbx_helper import ScratchWorkspace, catchmentPoints
+   gdb = benchGDB()
+   # catchments in their own geodatabase, since writing to a geodatabase invalidates indexes built from it
+   nhd = gdb[:-4] + '_nhd.gdb'
+   arcpy.CreateFileGDB_management(os.path.dirname(nhd), os.path.basename(nhd))
+   rnd = np.random.default_rng(1)
+   with ScratchWorkspace():
+      for nCats in sizes:
+         ext = 500.0 * nCats ** 0.5
+         ids, rings, lines = makeCatchments(ext)
+         cats = loadPolygons(nhd + '/bench_cats', ids, rings)
+         pts = loadPoints(gdb + '/bench_pts', rnd.uniform(0.4 * ext, 0.6 * ext, (nPts, 2)))
+         xy = [row[0] for row in arcpy.da.SearchCursor(pts, ['SHAPE@XY'])]
+         t_old, old = timeit(locateOld, cats, xy)
+         times = []
+         for k in range(2):
+            tbx_helper._datasetCaches.clear()
+            times.append(timeit(catchmentPoints, pts, cats, gdb + '/bench_ptcats')[0])
+            new = [row[0] for row in arcpy.da.SearchCursor(gdb + '/bench_ptcats', ['NHDPlusID'])]
+            if new != old:
+               raise Exception('Catchment index assignments do not match.')
+         printBench('catchmentIndex (cold)', nCats, t_old, times[0])
+         printBench('catchmentIndex (warm)', nCats, t_old, times[1])
+      # lines crossing several catchments
+      starts = rnd.uniform(0, ext, (nLines, 2))
+      paths = [s + np.cumsum(rnd.uniform(-400, 400, (6, 2)), axis=0) for s in starts]
+      lns = loadLines(gdb + '/bench_lines', list(range(nLines)), paths)
+      t, out = timeit(catchmentPoints, lns, cats, gdb + '/bench_lncats')
+      box = dict([(i, (min([x for x, y in r]), min([y for x, y in r]), max([x for x, y in r]), max([y for x, y in r])))
+                  for i, r in zip(ids, rings)])
+      rows = [row for row in arcpy.da.SearchCursor(out, ['SHAPE@XY', 'NHDPlusID'])]
+      for (x, y), fid in rows:
+         b = box.get(fid)
+         if fid is not None and not (b[0] - 1e-6 <= x <= b[2] + 1e-6 and b[1] - 1e-6 <= y <= b[3] + 1e-6):
+            raise Exception('Line piece end point is not in its catchment.')
+      printTime('catchmentPoints (lines)', nLines, t)
+      print('   ' + str(len(rows)) + ' end points of line pieces')
+
+
+def flowlinesOld(flowlines, occPts, outLines, flowFields, occFields, flowID='NHDPlusID'):
+   """Presence flowline export as in SpatialClusterNetwork before presenceFlowlines: a flowline layer with an IN
+   clause listing every reach, a copy of the layer with occurrence attributes joined (AddJoin and CopyFeatures;
+   emulated with CopyFeatures and JoinFields), and a copy with the reduced fields (FeatureClassToFeatureClass)."""
+   arcpy = useArcpy()
+   from tbx_helper import JoinFields, fieldDef
+   ids = sorted(set([r[0] for r in arcpy.da.SearchCursor(occPts, [flowID]) if r[0] is not None]))
+   lyr = arcpy.MakeFeatureLayer_management(flowlines, 'flowlines_lyr',
+                                           flowID + ' IN ({0})'.format(','.join(str(x) for x in ids))).getOutput(0)
+   tmp = os.path.join(os.path.dirname(outLines), 'flowlines_lyr')
+   arcpy.CopyFeatures_management(lyr, tmp)
+   arcpy.Delete_management(lyr)
+   JoinFields(tmp, flowID, occPts, flowID, occFields)
+   flds = [f for f in arcpy.ListFields(tmp) if f.name in [flowID] + flowFields + occFields]
+   arcpy.CreateFeatureclass_management(os.path.dirname(outLines), os.path.basename(outLines), 'POLYLINE')
+   arcpy.AddFields_management(outLines, [fieldDef(f) for f in flds])
+   with arcpy.da.InsertCursor(outLines, ['SHAPE@'] + [f.name for f in flds]) as ic:
+      for row in arcpy.da.SearchCursor(tmp, ['SHAPE@'] + [f.name for f in flds]):
+         ic.insertRow(row)
+   return outLines
+
+
+def bench_presenceFlowlines(sizes=((50000, 2000), (200000, 20000)), reps=3):
+   """Compares the presence flowline export with an IN clause and a join (old) with presenceFlowlines (flowline
+   index and in-memory join), for occurrences on a number of reaches (arcpy or the local stand-in). The flowline
+   index is built on the first run; the time shown is the best of the later runs."""
+   arcpy = useArcpy()
+   import tbx_helper
+   from tbx_helper import ScratchWorkspace, presenceFlowlines
+   gdb = benchGDB()
+   nhd = gdb[:-4] + '_nhd.gdb'
+   arcpy.CreateFileGDB_management(os.path.dirname(nhd), os.path.basename(nhd))
+   rnd = random.Random(1)
+   flowFields, occFields = ['StreamOrde', 'Permanent_Identifier'], ['sp_code', 'sdm_grpid']
+   with ScratchWorkspace():
+      for nLines, nReaches in sizes:
+         ids, lines = makeNetwork(nLines)
+         ids = [55000100000000.0 + i for i in ids]
+         fl = loadLines(nhd + '/bench_flowlines', ids, lines)
+         arcpy.AddFields_management(fl, [['StreamOrde', 'SHORT'], ['Permanent_Identifier', 'TEXT', '', 40]])
+         with arcpy.da.UpdateCursor(fl, ['NHDPlusID', 'StreamOrde', 'Permanent_Identifier']) as uc:
+            for row in uc:
+               uc.updateRow([row[0], rnd.randint(1, 6), '{%d}' % row[0]])
+         occ = gdb + '/bench_sp_join'
+         arcpy.CreateTable_management(os.path.dirname(occ), os.path.basename(occ))
+         arcpy.AddFields_management(occ, [['NHDPlusID', 'DOUBLE'], ['sp_code', 'TEXT', '', 20],
+                                          ['sdm_grpid', 'TEXT', '', 50]])
+         reaches = rnd.sample(ids, nReaches)
+         with arcpy.da.InsertCursor(occ, ['NHDPlusID', 'sp_code', 'sdm_grpid']) as ic:
+            for i, r in enumerate(reaches):
+               for k in range(rnd.randint(1, 3)):
+                  ic.insertRow([r, 'spcode', str(i // 10 + 1)])
+         t_old = timeit(flowlinesOld, fl, occ, gdb + '/bench_flow_old', flowFields, occFields)[0]
+         times = []
+         tbx_helper._datasetCaches.clear()
+         for k in range(reps):
+            times.append(timeit(presenceFlowlines, fl, occ, gdb + '/bench_flow_new', flowFields, occFields)[0])
+         check = ['NHDPlusID'] + flowFields + occFields
+         old = sorted([list(r) for r in arcpy.da.SearchCursor(gdb + '/bench_flow_old', check)])
+         new = sorted([list(r) for r in arcpy.da.SearchCursor(gdb + '/bench_flow_new', check)])
+         if old != new or len(new) != nReaches:
+            raise Exception('presenceFlowlines output does not match the original export.')
+         printBench('presenceFlowlines', nReaches, t_old, min(times[1:]))
+         print('   ' + str(nLines) + ' flowlines; first run (building the index): ' + str(round(times[0], 3)) + 's')
+
+
+def bench_flowGraph(sizes=(50000, 200000), nPts=500, sepDist=500.0):
+   """Times getting the flowline graph for a network grouping run: reading the flowlines (old), compiling the graph
+   cache (cold), and opening the cache memory-mapped (warm). Checks that network groups of nPts points on the cached
+   graph match those on the graph read from the flowlines (arcpy or the local stand-in)."""
+   arcpy = useArcpy()
+   import tbx_helper
+   import tbx_network
+   from tbx_helper import ScratchWorkspace, readFlowGraph, flowGraph
+   gdb = benchGDB()
+   nhd = gdb[:-4] + '_nhd.gdb'
+   arcpy.CreateFileGDB_management(os.path.dirname(nhd), os.path.basename(nhd))
+
+   def group(graph):
+      occEdge, occOffset = graph.snap(pts, 20.0)
+      return tbx_network.networkClusters(graph, occEdge, occOffset, sepDist)
+
+   with ScratchWorkspace():
+      for nLines in sizes:
+         ids, lines = makeNetwork(nLines)
+         fl = loadLines(nhd + '/bench_flowlines', ids, lines)
+         arcpy.AddField_management(fl, 'StreamOrde', 'SHORT')
+         pts = makeNetworkPoints(lines, nPts)
+         t_old, graph = timeit(readFlowGraph, fl)
+         old = group(graph)
+         times = []
+         for k in range(2):
+            tbx_helper._datasetCaches.clear()
+            t, graph = timeit(flowGraph, fl)
+            times.append(t)
+            if group(graph) != old:
+               raise Exception('Network groups from the cached graph do not match.')
+         printBench('flowGraph (cold)', nLines, t_old, times[0])
+         printBench('flowGraph (warm)', nLines, t_old, times[1])
+
+
+def eraseOld(eraseFc, occ, args):
+   """Erase overlaying the whole erase dataset (as Erase_analysis): all erase features are read and indexed, and each
+   occurrence is clipped by those whose bounding boxes overlap it."""
+   import tbx_geom
+   erase, boxes = {}, []
+   arcpy = useArcpy()
+   for oid, g in arcpy.da.SearchCursor(eraseFc, ['OID@', 'SHAPE@']):
+      e = g.extent
+      boxes.append((e.XMin, e.YMin, e.XMax, e.YMax))
+      erase[oid] = ([boxes[-1]], boxes[-1])
+   keys = list(erase)
+   idx = tbx_geom.GridIndex(boxes)
+   pairs = [(i, keys[k]) for i, p in enumerate(occ) for k in idx.query(rectBbox(p)).tolist()]
+   return tbx_geom.eraseGeoms(occ, [rectBbox(p) for p in occ], ([a[0] for a in pairs], [a[1] for a in pairs]),
+                              erase, *args)
+
+
+def eraseNew(eraseFc, occ, args):
+   """Indexed erase (as in tbx_helper.eraseFeatures): candidates from the cached erase feature index, read by OID."""
+   import tbx_geom
+   from tbx_helper import eraseIndex, readByOID
+   grid, oids = eraseIndex(eraseFc)
+   i, k = grid.boxPairs([rectBbox(p) for p in occ])
+   k = oids[k]
+   erase = {}
+   for oid, g in readByOID(eraseFc, set(k.tolist()), ['SHAPE@']):
+      e = g.extent
+      erase[oid] = ([(e.XMin, e.YMin, e.XMax, e.YMax)], (e.XMin, e.YMin, e.XMax, e.YMax))
+   return tbx_geom.eraseGeoms(occ, [rectBbox(p) for p in occ], (i, k), erase, *args)
+
+
+def bench_eraseFeatures(sizes=(50000, 200000), nOcc=500, workers=4):
+   """Times erasing occurrences with a statewide erase dataset: overlaying the whole dataset (old), and the indexed
+   erase, building the index (cold) or opening it from the cache (warm)."""
+   arcpy = useArcpy()
+   import tbx_geom
+   import tbx_helper
+   from tbx_helper import ScratchWorkspace
+   gdb = benchGDB()
+   state = gdb[:-4] + '_erase.gdb'
+   arcpy.CreateFileGDB_management(os.path.dirname(state), os.path.basename(state))
+   args = (rectDifference, lambda a: len(a) == 0, rectBbox)
+   with ScratchWorkspace():
+      for n in sizes:
+         extent = 250.0 * n ** 0.5
+         rects = makeRects(n, extent=extent, seed=2)
+         fc = loadPolygons(state + '/bench_erase', range(1, n + 1), [
+            [(r[0], r[1]), (r[0], r[3]), (r[2], r[3]), (r[2], r[1]), (r[0], r[1])] for [r] in rects])
+         occ = makeRects(nOcc, extent=extent / 10, size=(200.0, 1000.0), seed=3)
+         t_old, old = timeit(eraseOld, fc, occ, args)
+         times = []
+         for k in range(2):
+            tbx_helper._datasetCaches.clear()
+            t, new = timeit(eraseNew, fc, occ, args)
+            times.append(t)
+            if set(new) != set(old) or any(sorted(new[i] or []) != sorted(old[i] or []) for i in old):
+               raise Exception('Indexed erase output does not match.')
+         printBench('eraseFeatures (cold)', n, t_old, times[0])
+         printBench('eraseFeatures (warm)', n, t_old, times[1])
+         grid, oids = tbx_helper.eraseIndex(fc)
+         i, k = grid.boxPairs([rectBbox(p) for p in occ])
+         part = tbx_geom.partitionPairs(i, k, workers * 2)
+         first = {}
+         if any(first.setdefault(b, part[a]) != part[a] for a, b in zip(i.tolist(), k.tolist())):
+            raise Exception('partitionPairs split occurrences sharing an erase feature.')
+
+
+def makeColumns(n, nullFrac=0.05, seed=1):
+   """Generates typed columns with nulls (masked arrays): integer, big integer, float, text and date."""
+   import numpy as np
+   rnd = np.random.default_rng(seed)
+   cols = {'cnt': rnd.integers(-10 ** 6, 10 ** 6, n).astype(np.int32),
+           'big': rnd.integers(-2 ** 40, 2 ** 40, n),
+           'val': rnd.normal(0, 100, n),
+           'name': np.array(['ELCODE%05d' % i for i in range(1000)])[rnd.integers(0, 1000, n)],
+           'obsdate': (np.datetime64('1950-01-01T00:00:00', 'us') +
+                       rnd.integers(0, 70 * 365, n).astype('timedelta64[D]'))}
+   return dict([(f, np.ma.MaskedArray(a, rnd.random(n) < nullFrac)) for f, a in cols.items()])
+
+
+def recordsOld(rows):
+   """The original df2tab conversion: records of Python objects (np.rec.fromrecords)."""
+   import numpy as np
+   return np.array(np.rec.fromrecords(rows))
+
+
+def bench_tableArrays(sizes=(200000, 1000000), chunkSize=100000):
+   """Round trip and throughput of the columnar table bridge (writeArrays, readArrays and columnChunks), compared with
+   converting rows through Python object records (as the original df2tab and fc2df did). Also reports peak memory
+   while streaming a table in chunks, compared with reading it whole."""
+   import tracemalloc
+   import numpy as np
+   arcpy = useArcpy()
+   from tbx_helper import ScratchWorkspace, writeArrays, readArrays, columnChunks, readColumns
+   gdb = benchGDB()
+   with ScratchWorkspace():
+      for n in sizes:
+         cols = makeColumns(n)
+         names = list(cols)
+
+         def writeOld(tab):
+            rows = list(zip(*[[None if m else v for v, m in zip(a.data.tolist(), a.mask.tolist())]
+                              for a in cols.values()]))
+            x = recordsOld(rows)
+            arcpy.CreateTable_management(gdb, os.path.basename(tab))
+            arcpy.AddFields_management(tab, [[f, 'TEXT'] for f in names])
+            with arcpy.da.InsertCursor(tab, names) as ic:
+               for row in x.tolist():
+                  ic.insertRow(row)
+
+         t_old = timeit(writeOld, gdb + '/bench_old')[0]
+         t_write = timeit(writeArrays, cols, gdb + '/bench_arrays', chunkSize)[0]
+         printBench('writeArrays', n, t_old, t_write)
+         t_old = timeit(lambda: recordsOld(list(arcpy.da.SearchCursor(gdb + '/bench_arrays', names))))[0]
+         t_new, back = timeit(readArrays, gdb + '/bench_arrays', names, None, chunkSize)
+         printBench('readArrays', n, t_old, t_new)
+         for f in names:
+            a, b = cols[f], back[f]
+            if a.dtype.kind != b.dtype.kind or (a.dtype.kind != 'U' and a.dtype != b.dtype) or \
+                  not np.array_equal(a.mask, b.mask) or not np.array_equal(a.data[~a.mask], b.data[~b.mask]):
+               raise Exception('Column ' + f + ' changed in the round trip.')
+         print('   %.0f rows/s read, %.0f rows/s written' % (n / t_new, n / t_write))
+         arcpy.Delete_management(gdb + '/bench_old')
+         if n == sizes[0]:
+            peaks = []
+            for fn in [lambda: readColumns(gdb + '/bench_arrays', names),
+                       lambda: sum([len(c[names[0]]) for c in columnChunks(gdb + '/bench_arrays', names, None,
+                                                                          chunkSize // 10)])]:
+               tracemalloc.start()
+               fn()
+               peaks.append(tracemalloc.get_traced_memory()[1] / 2 ** 20)
+               tracemalloc.stop()
+            print('   peak memory: %.1f MB reading whole rows, %.1f MB streaming chunks of %d rows' %
+                  (peaks[0], peaks[1], chunkSize // 10))
+         arcpy.Delete_management(gdb + '/bench_arrays')
+
+
+def validateOld(inPolys):
+   """Original AddInitFlds input validation: list fields, and read all ELCODEs."""
+   arcpy = useArcpy()
+   f1 = [f.name for f in arcpy.ListFields(inPolys)]
+   uval = list(set([a[0] for a in arcpy.da.SearchCursor(inPolys, 'ELCODE') if a[0] is not None]))
+   return f1, len(uval) > 1
+
+
+def validateMeta(inPolys):
+   """AddInitFlds input validation with the metadata cache (datasetMeta)."""
+   from tbx_helper import datasetMeta
+   m = datasetMeta(inPolys)
+   return list(m.fieldNames), len(m.distinct(inPolys, 'ELCODE', limit=2)) > 1
+
+
+def bench_validation(sizes=(50000, 200000), nElcodes=(1, 20), passes=5):
+   """Times repeated AddInitFlds input validation (passes times, as when a tool dialog is validated), with and
+   without the dataset metadata cache (arcpy or the local stand-in)."""
+   useArcpy()
+   from tbx_helper import forgetMeta
+   gdb = benchGDB()
+   for n in sizes:
+      for ne in nElcodes:
+         src = loadOccurrences(gdb + '/bench_occ', makeOccurrences(n, nElcodes=ne))
+         forgetMeta(src)
+         times, outs = [], []
+         for fn in [validateOld, validateMeta]:
+            t0 = time.perf_counter()
+            for i in range(passes):
+               out = fn(src)
+            times.append(time.perf_counter() - t0)
+            outs.append(out)
+         if outs[0] != outs[1]:
+            raise Exception('Validation with the metadata cache does not match original validation.')
+         printBench('Validation (' + str(ne) + ' spp)', n, times[0], times[1])
+
+
+def bench_validationStamps(sizes=(20, 100), passes=20):
+   """Times validation passes which check the modification stamps of several datasets in one geodatabase (as when
+   metadata is older than metaCacheAge), scanning the geodatabase folder for each dataset or once per pass (see
+   tbx_helper.datasetStamp). Uses arcpy or the local stand-in."""
+   arcpy = useArcpy()
+   import tbx_helper
+   for n in sizes:
+      folder = os.path.join(arcpy.env.scratchFolder, 'tbx_bench_stamps')
+      os.makedirs(folder, exist_ok=True)
+      gdb = os.path.join(folder, 'stamps_' + str(n) + '.gdb')
+      if not arcpy.Exists(gdb):
+         arcpy.CreateFileGDB_management(folder, os.path.basename(gdb))
+      occ = makeOccurrences(10)
+      fcs = [loadOccurrences(gdb + '/occ_' + str(i), occ) for i in range(n)]
+      times = []
+      keep = tbx_helper.stampScanAge
+      for age in [0.0, keep]:
+         tbx_helper.stampScanAge = age
+         t0 = time.perf_counter()
+         for i in range(passes):
+            tbx_helper._stampScan['time'] = 0.0
+            for m in tbx_helper._metaCache.values():
+               m.checked = 0
+            for fc in fcs:
+               tbx_helper.datasetMeta(fc)
+         times.append(time.perf_counter() - t0)
+      tbx_helper.stampScanAge = keep
+      printBench('Validation stamps (datasets)', n, times[0], times[1])
+
+
+def JoinFieldsEval(ToTab, fldToJoin, FromTab, fldFromJoin, addFields):
+   """The original (eval-based) JoinFields, for comparison with tbx_helper.JoinFields."""
+   arcpy = useArcpy()
+
+   def getFldVal(srcID, fldDict):
+      try:
+         fldVal = fldDict[srcID]
+      except:
+         fldVal = None
+      return fldVal
+
+   codeDict = {}
+   num = list(range(1, len(addFields) + 1))
+   text = "sc[" + ("], sc[").join([str(n) for n in num]) + "]"
+   with arcpy.da.SearchCursor(FromTab, [fldFromJoin] + addFields) as sc:
+      for row in sc:
+         sc = row
+         codeDict[row[0]] = eval(text)
+   existFld = [f.name for f in arcpy.ListFields(ToTab)]
+   for f in [a for a in arcpy.ListFields(FromTab) if a.name in addFields and a.name not in existFld]:
+      arcpy.AddField_management(ToTab, f.name, {'String': 'TEXT', 'Double': 'DOUBLE'}.get(f.type, 'LONG'), '', '',
+                                f.length)
+   with arcpy.da.UpdateCursor(ToTab, [fldToJoin] + addFields) as cursor:
+      for row in cursor:
+         vals = getFldVal(row[0], codeDict)
+         if vals:
+            vals2 = list(vals)
+            for n in num:
+               row[n] = vals2[n - 1]
+            cursor.updateRow(row)
+   return ToTab
+
+
+def bench_JoinFields_local(sizes=(20000, 200000), nFlds=5):
+   """Compares JoinFields with the original eval-based JoinFields, through arcpy cursors (arcpy or the local
+   stand-in)."""
+   arcpy = useArcpy()
+   from tbx_helper import JoinFields, readColumns
+   gdb = benchGDB()
+   rnd = random.Random(1)
+   flds = ['val' + str(f) for f in range(nFlds)]
+   for n in sizes:
+      fromTab = gdb + '/bench_from'
+      arcpy.CreateTable_management(gdb, 'bench_from')
+      arcpy.AddFields_management(fromTab, [['key', 'LONG']] + [[f, 'DOUBLE'] for f in flds])
+      with arcpy.da.InsertCursor(fromTab, ['key'] + flds) as ic:
+         for i in range(n):
+            ic.insertRow([i] + [rnd.random() for f in flds])
+      keys = [rnd.randint(0, n * 2) for i in range(n)]
+      times, outs = [], []
+      for fn in [JoinFieldsEval, JoinFields]:
+         toTab = gdb + '/bench_to'
+         arcpy.CreateTable_management(gdb, 'bench_to')
+         arcpy.AddField_management(toTab, 'tokey', 'LONG')
+         with arcpy.da.InsertCursor(toTab, ['tokey']) as ic:
+            for k in keys:
+               ic.insertRow([k])
+         times.append(timeit(fn, toTab, 'tokey', fromTab, 'key', flds)[0])
+         outs.append(readColumns(toTab, ['tokey'] + flds))
+      if outs[0] != outs[1]:
+         raise Exception('JoinFields output does not match original JoinFields.')
+      printBench('JoinFields (cursors)', n, times[0], times[1])
+
+
+def bench_SpatialCluster_local(sizes=(2000, 10000), sepDist='500 Meters'):
+   """Times SpatialCluster (in-memory method) end to end, including reading and writing features (arcpy or the
+   local stand-in)."""
+   useArcpy()
+   from tbx_helper import SpatialCluster
+   gdb = benchGDB()
+   for n in sizes:
+      fc = loadOccurrences(gdb + '/bench_occ', makeOccurrences(n, overlap=0.3))
+      printTime('SpatialCluster (INDEX)', n, timeit(SpatialCluster, fc, sepDist, 'grpID', 'INDEX')[0])
+
+
+def bench_SpatialClusterMulti_local(sizes=(2000, 10000), sepDists=('250 Meters', '500 Meters', '1 Kilometers')):
+   """Times SpatialClusterMulti end to end, compared with running SpatialCluster (in-memory method) once for each
+   distance (arcpy or the local stand-in)."""
+   useArcpy()
+   from tbx_helper import SpatialCluster, SpatialClusterMulti, readColumns
+   gdb = benchGDB()
+   for n in sizes:
+      fc = loadOccurrences(gdb + '/bench_occ', makeOccurrences(n, overlap=0.3))
+      old = []
+
+      def each():
+         for d in sepDists:
+            SpatialCluster(fc, d, 'grpID', 'INDEX')
+            old.append(readColumns(fc, ['grpID'])[0])
+
+      t_old = timeit(each)[0]
+      t_new, flds = timeit(SpatialClusterMulti, fc, list(sepDists), 'grpID')
+      if readColumns(fc, flds) != old or readColumns(fc, ['grpID'])[0] != old[0]:
+         raise Exception('SpatialClusterMulti groups do not match SpatialCluster.')
+      printBench('SpatialClusterMulti', n, t_old, t_new)
+
+
+def bench_networkGroups_local(sizes=((2000, 500), (10000, 2500)), sepDist=2000.0):
+   """Times network grouping with the in-memory flowline graph end to end (networkGroupsGraph), on a synthetic
+   dendritic network (arcpy or the local stand-in)."""
+   useArcpy()
+   from tbx_helper import networkGroupsGraph
+   gdb = benchGDB()
+   for nLines, nPts in sizes:
+      ids, lines = makeNetwork(nLines)
+      flowlines = loadLines(gdb + '/bench_flowlines', ids, lines)
+      pts = loadPoints(gdb + '/bench_pts', makeNetworkPoints(lines, nPts))
+      dams = loadPoints(gdb + '/bench_dams', makeNetworkPoints(lines, nPts // 10, noise=0.0, seed=2))
+      t = timeit(networkGroupsGraph, pts, flowlines, dams, sepDist, 20.0, 'sdm_grpid')[0]
+      printTime('Network grouping (GRAPH)', nPts, t)
+
+
+def bench_MergeData_ranking(sizes=(100000, 500000), overlap=3):
+   """Times the MergeData RA scoring and spatial duplicate stage (markSpatialDuplicates) end to end, on polygons
+   with an average of overlap polygons per unique polygon area (arcpy or the local stand-in)."""
+   arcpy = useArcpy()
+   from tbx_helper import markSpatialDuplicates, fldSFRACalc, fldDateCalc, fldRA, fldUse, fldUseWhy
+   gdb = benchGDB()
+   raNames = dict([(v, k) for k, v in raScores.items()])
+   for n in sizes:
+      oids, grp, ra, dates = makeDuplicates(n, n // overlap)
+      tab = gdb + '/bench_merged'
+      arcpy.CreateTable_management(gdb, 'bench_merged')
+      arcpy.AddFields_management(tab, [['uniqID_poly', 'LONG'], [fldSFRACalc.Name, 'TEXT', '', 20],
+                                       [fldDateCalc.Name, 'TEXT', '', 10], [fldRA.Name, 'SHORT'],
+                                       [fldUse.Name, 'SHORT'], [fldUseWhy.Name, 'TEXT', '', 1000]])
+      with arcpy.da.InsertCursor(tab, ['uniqID_poly', fldSFRACalc.Name, fldDateCalc.Name, fldUse.Name]) as ic:
+         for g, r, d in zip(grp, ra, dates):
+            ic.insertRow([g, raNames.get(r), d, 1])
+      printTime('MergeData ranking', n, timeit(markSpatialDuplicates, tab)[0])
+
+
+# Time budget (seconds) for importing tbx_helper, loading the toolbox and getting tool parameters (excluding the
+# arcpy import). ArcGIS does this every time the toolbox is opened, or a tool dialog is opened or validated.
+startupBudget = 0.5
+
+
+def startupTimes():
+   """Times toolbox startup steps in this (fresh) process. Returns a dictionary of times (seconds), the heavy modules
+   imported, and the extensions checked out (stand-in only). Run in a subprocess by bench_startup."""
+   import importlib.machinery
+   import importlib.util
+   t = [time.perf_counter()]
+   arcpy = useArcpy()
+   t.append(time.perf_counter())
+   import tbx_helper
+   t.append(time.perf_counter())
+   pyt = os.path.join(tbx_helper.curr_dir, 'SDM-PresencePreProcessing.pyt')
+   loader = importlib.machinery.SourceFileLoader('sdm_presence_tbx', pyt)
+   mod = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+   loader.exec_module(mod)
+   t.append(time.perf_counter())
+   tbx = mod.Toolbox()
+   for tool in tbx.tools:
+      tool().getParameterInfo()
+   t.append(time.perf_counter())
+   return {'import arcpy': t[1] - t[0], 'import tbx_helper': t[2] - t[1], 'load toolbox': t[3] - t[2],
+           'getParameterInfo': t[4] - t[3],
+           'heavy modules': [m for m in ('numpy', 'pandas', 'tbx_geom', 'tbx_network') if m in sys.modules],
+           'extensions': list(getattr(arcpy, 'checkedOut', []))}
+
+
+def bench_startup(repeat=3):
+   """Times toolbox startup (import tbx_helper, load the .pyt and get tool parameters) in fresh Python processes,
+   taking the fastest of repeat runs. Checks that heavy modules are not imported and no extensions are checked
+   out on startup. Returns False if startup is over the time budget (startupBudget)."""
+   import subprocess
+   runs = []
+   for i in range(repeat):
+      out = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-child'], capture_output=True,
+                           text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+      runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+   best = min(runs, key=lambda r: r['import tbx_helper'] + r['load toolbox'] + r['getParameterInfo'])
+   if best['heavy modules']:
+      raise Exception('Modules imported on startup: ' + ', '.join(best['heavy modules']) + '.')
+   if best['extensions']:
+      raise Exception('Extensions checked out on startup: ' + ', '.join(best['extensions']) + '.')
+   for k in ['import arcpy', 'import tbx_helper', 'load toolbox', 'getParameterInfo']:
+      printTime('Startup: ' + k, 1, best[k])
+   total = best['import tbx_helper'] + best['load toolbox'] + best['getParameterInfo']
+   printTime('Startup (total)', 1, total)
+   if total > startupBudget:
+      print('OVER BUDGET: toolbox startup %.3fs (budget %.3fs)' % (total, startupBudget))
+      return False
+   return True
+
+
+def saveResults(path):
+   """Saves recorded results (with the platform, and whether the local arcpy stand-in was used) as JSON."""
+   arcpy = sys.modules.get('arcpy')
+   out = {'date': datetime.now().isoformat(), 'platform': platform.platform(), 'python': platform.python_version(),
+          'arcpy': 'local' if arcpy is not None and arcpy.__name__ == 'tbx_localarcpy' else 'arcgis',
+          'results': results}
+   with open(path, 'w') as f:
+      json.dump(out, f, indent=1)
+   print('Results saved to ' + path)
+
+
+def compareResults(path, tolerance=0.25):
+   """Compares recorded results with saved baseline results. Returns the list of regressions: cases which are
+   more than tolerance (fraction) slower than the baseline."""
+   with open(path) as f:
+      base = dict([((r['name'], r['n']), r['seconds']) for r in json.load(f)['results']])
+   slow = []
+   for r in results:
+      b = base.get((r['name'], r['n']))
+      if b and r['seconds'] > b * (1 + tolerance):
+         slow.append(r)
+         print('REGRESSION: %-28s n=%-9s %8.3fs (baseline %8.3fs)' % (r['name'], r['n'], r['seconds'], b))
+   if not slow:
+      print('No regressions compared to ' + path + '.')
+   return slow
+
+
+def main(args):
+   parser = argparse.ArgumentParser(description='Benchmarks for toolbox helper functions.')
+   parser.add_argument('--save', help='save results to this JSON file')
+   parser.add_argument('--compare', help='compare results with this baseline JSON file')
+   parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown compared to the baseline')
+   parser.add_argument('--startup-child', action='store_true', help=argparse.SUPPRESS)
+   a = parser.parse_args(args)
+   if a.startup_child:
+      print(json.dumps(startupTimes()))
+      return 0
+   ok = bench_startup()
+   bench_getStdDate()
+   bench_SpatialCluster()
+   bench_ClusterTree()
+   bench_networkClusters()
+   bench_snap()
+   bench_JoinFields()
+   bench_GetOverlapping()
+   bench_spatialDuplicates()
+   try:
+      import arcpy
+   except ImportError:
+      print('arcpy not available; using the local arcpy stand-in.')
+   else:
+      bench_JoinFields_arcpy()
+   bench_AddInitFlds()
+   bench_JoinFields_local()
+   bench_SpatialCluster_local()
+   bench_SpatialClusterMulti_local()
+   bench_networkGroups_local()
+   bench_MergeData_ranking()
+   bench_validation()
+   bench_validationStamps()
+   bench_partitionMerged()
+   bench_polySnapPoints()
+   bench_catchmentIndex()
+   bench_presenceFlowlines()
+   bench_flowGraph()
+   bench_eraseFeatures()
+   bench_tableArrays()
+   if a.save:
+      saveResults(a.save)
+   if a.compare:
+      if compareResults(a.compare, a.tolerance):
+         return 1
+   return 0 if ok else 1
+
+
+if __name__ == '__main__':
+   sys.exit(main(sys.argv[1:]))
+
+# end
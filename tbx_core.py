@@ -0,0 +1,558 @@
+# Core (arcpy-free) helper functions for python toolbox
+# Everything here can be imported and run without ArcGIS, and is re-exported by tbx_helper.
+import contextlib
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from datetime import datetime as datetime
+from datetime import timedelta
+
+# Regular expressions for pattern matching dates (compiled once, on import)
+pDate_ymd = re.compile(r'^[1-2][0-9][0-9][0-9]-[0-1][0-9]-[0-9][0-9]$')  # yyyy-mm-dd
+pDate_ym = re.compile(r'^[1-2][0-9][0-9][0-9]-[0-1][0-9]$')  # yyyy-mm
+pDate_y = re.compile(r'^[1-2][0-9][0-9][0-9]-?$')  # yyyy or yyyy-
+pDate_mdy = re.compile(r'^[0-9][0-9]?/[0-9][0-9]?/[1-2][0-9][0-9][0-9]$')  # m/d/yyyy or mm/dd/yyyy
+pDate_mdy_m = re.compile(r'^[0-9][0-9]?/')  # to extract month
+pDate_mdy_d = re.compile(r'/[0-9][0-9]?/')  # to extract day
+pDate_any_y = re.compile(r'(?<!\d)\d{4}(?!\d)')  # any four digits in a row
+noDate = '0000-00-00'
+
+
+def _parseDate(Date):
+   """Parses a date string into yyyy-mm-dd. Used by getStdDate and getStdDates."""
+   default_y = '0000'
+   default_m_d = '00'
+
+   m = pDate_ymd.match(Date)
+   if m:
+      m = m.group()
+      return m[:4] + '-' + m[5:7] + '-' + m[8:10]
+   m = pDate_ym.match(Date)
+   if m:
+      m = m.group()
+      return m[:4] + '-' + m[5:7] + '-' + default_m_d
+   m = pDate_y.match(Date)
+   if m:
+      return m.group()[:4] + '-' + default_m_d + '-' + default_m_d
+   m = pDate_mdy.match(Date)
+   if m:
+      yyyy = m.group()[-4:]
+      mm = pDate_mdy_m.search(Date).group().replace('/', '').zfill(2)
+      dd = pDate_mdy_d.search(Date).group().replace('/', '').zfill(2)
+      return yyyy + '-' + mm + '-' + dd
+   # Try to get any four digits in a row
+   y0 = pDate_any_y.search(Date)
+   if y0 is None:
+      yyyy = default_y
+   else:
+      yyyy = y0.group()
+   return yyyy + '-' + default_m_d + '-' + default_m_d
+
+
+def _dateStr(Date):
+   if type(Date) == datetime:
+      # arcgis date fields are datetime types
+      return str(Date.date())
+   else:
+      return str(Date)
+
+
+def getStdDate(Date):
+   # Date calculation logic. Used in AddInitFields
+   return _parseDate(_dateStr(Date))
+
+
+def getStdDates(Dates):
+   """Batch version of getStdDate for a column of raw date values. Each unique value is parsed once.
+   Returns a tuple of numpy arrays: standardized dates (yyyy-mm-dd), and date flags (1 = no date)."""
+   import numpy as np
+   # key on type as well as value, since e.g. 1 == 1.0 == True but their strings differ
+   uniq = {}
+   inv = np.empty(len(Dates), dtype=np.int64)
+   for i, d in enumerate(Dates):
+      try:
+         inv[i] = uniq.setdefault((type(d), d), len(uniq))
+      except TypeError:
+         # unhashable value; give it its own slot
+         inv[i] = uniq.setdefault((id(d), i), len(uniq))
+   std = np.empty(len(uniq), dtype='<U10')
+   for (t, d), j in uniq.items():
+      if isinstance(t, type):
+         std[j] = _parseDate(_dateStr(d))
+      else:
+         std[j] = _parseDate(_dateStr(Dates[d]))
+   std = std[inv]
+   flags = (std == noDate).astype(np.int16)
+   return std, flags
+
+
+# ELCODE -> sp_code lookup (codes.csv), loaded once per process and re-loaded if the file changes.
+# Cache holds {path: (mtime, {ELCODE: sp_code})}
+_spCodeCache = {}
+
+
+def spCodeIndex(lookup):
+   """Returns the ELCODE -> sp_code dictionary for a lookup table (csv with columns ELCODE_BCD and sp_code_calc).
+   The index is built once and cached, and only rebuilt if the file's modification time changes."""
+   lookup = os.path.abspath(lookup)
+   mtime = os.stat(lookup).st_mtime_ns
+   cached = _spCodeCache.get(lookup)
+   if cached is not None and cached[0] == mtime:
+      return cached[1]
+   index = {}
+   with open(lookup, newline='') as f:
+      for r in csv.DictReader(f):
+         # first match wins, as in the original linear scan
+         index.setdefault(sys.intern(r['ELCODE_BCD']), sys.intern(r['sp_code_calc']))
+   _spCodeCache[lookup] = (mtime, index)
+   return index
+
+
+def getSpCodes(elcodes, lookup):
+   """Resolves a list of ELCODEs to species codes in one call.
+   ELCODEs not found in the lookup table get the code 'unk_' + ELCODE.
+   Returns a tuple: (dictionary of {ELCODE: sp_code}, list of unknown ELCODEs)"""
+   index = spCodeIndex(lookup)
+   codes = {}
+   unknown = []
+   for el in elcodes:
+      if el in codes:
+         continue
+      sp = index.get(el)
+      if sp is None:
+         sp = 'unk_' + el
+         unknown.append(el)
+      codes[el] = sp
+   return codes, unknown
+
+
+# Linear unit conversions to meters, for distance strings like "500 Meters"
+linearUnits = {'meters': 1.0, 'kilometers': 1000.0, 'decimeters': 0.1, 'centimeters': 0.01, 'millimeters': 0.001,
+               'feet': 0.3048, 'usfeet': 1200.0 / 3937.0, 'yards': 0.9144, 'miles': 1609.344, 'inches': 0.0254,
+               'nauticalmiles': 1852.0}
+
+
+def parseDist(dist, metersPerUnit=1.0):
+   """Converts a linear distance string (e.g. "500 Meters", or "500" in data units) to a number in data units.
+   metersPerUnit = Meters per unit of the dataset's coordinate system"""
+   d0 = str(dist).split(" ")
+   val = float(d0[0])
+   if len(d0) < 2 or d0[1] == '' or d0[1].lower() == 'unknown':
+      return val
+   unit = d0[1].lower().replace('_', '').replace(' ', '')
+   if not unit.endswith('s'):
+      unit = unit + 's'
+   if unit not in linearUnits:
+      raise ValueError('Unknown linear unit: ' + d0[1])
+   if not metersPerUnit:
+      raise ValueError('Cannot convert ' + str(dist) + ' to data units. Use a projected coordinate system.')
+   return val * linearUnits[unit] / metersPerUnit
+
+
+class DisjointSet:
+   """Union-find (disjoint set) structure over items 0..n-1, with path compression and union by size."""
+   def __init__(self, n):
+      self.parent = list(range(n))
+      self.size = [1] * n
+
+   def find(self, i):
+      parent = self.parent
+      root = i
+      while parent[root] != root:
+         root = parent[root]
+      while parent[i] != root:
+         parent[i], i = root, parent[i]
+      return root
+
+   def union(self, i, j):
+      """Merges the sets containing i and j. Returns True if they were in different sets."""
+      ri, rj = self.find(i), self.find(j)
+      if ri == rj:
+         return False
+      if self.size[ri] < self.size[rj]:
+         ri, rj = rj, ri
+      self.parent[rj] = ri
+      self.size[ri] += self.size[rj]
+      return True
+
+   def labels(self, start=1):
+      """Returns a list of set labels for all items, numbered (from start) in order of first appearance."""
+      lab = {}
+      return [lab.setdefault(self.find(i), len(lab) + start) for i in range(len(self.parent))]
+
+
+def mergeGroups(grpIDs, keys, nextID):
+   """Merges groups which share a key value (e.g. groups assigned to the same reach), including chains of groups
+   linked through several keys.
+   grpIDs, keys = paired lists of group ID and key, one pair per feature
+   nextID = first new group ID to assign to merged groups
+   Returns a tuple: (dictionary of {old group ID: new group ID}, for merged groups only; next unused group ID)"""
+   gix = {}
+   for g in grpIDs:
+      gix.setdefault(g, len(gix))
+   ds = DisjointSet(len(gix))
+   first = {}
+   for g, k in zip(grpIDs, keys):
+      f = first.setdefault(k, g)
+      if f != g:
+         ds.union(gix[f], gix[g])
+   newIDs = {}
+   rootID = {}
+   for g, i in gix.items():
+      r = ds.find(i)
+      if ds.size[r] > 1:
+         if r not in rootID:
+            rootID[r] = nextID
+            nextID += 1
+         newIDs[g] = rootID[r]
+   return newIDs, nextID
+
+
+class JoinTable:
+   """Hash index over key and value columns, for table joins. For duplicate keys, the last row wins.
+   keys = key column values
+   valCols = list of value columns (same length as keys)"""
+   def __init__(self, keys, valCols):
+      self.index = dict(zip(keys, range(len(keys))))
+      self.rows = list(zip(*valCols)) if valCols else [()] * len(keys)
+
+   def __len__(self):
+      return len(self.index)
+
+   def get(self, key):
+      """Returns the tuple of values for a key, or None if the key is not in the table."""
+      i = self.index.get(key)
+      if i is None:
+         return None
+      return self.rows[i]
+
+
+def summarize(vals, stat):
+   """Summary statistic of a list of values (as in Statistics_analysis; null values are ignored).
+   stat = one of SUM, MEAN, MIN, MAX, RANGE, COUNT, FIRST, LAST"""
+   stat = stat.upper()
+   v = [a for a in vals if a is not None]
+   if stat == 'COUNT':
+      return len(v)
+   if len(v) == 0:
+      return None
+   if stat == 'SUM':
+      return sum(v)
+   elif stat == 'MEAN':
+      return sum(v) / float(len(v))
+   elif stat == 'MIN':
+      return min(v)
+   elif stat == 'MAX':
+      return max(v)
+   elif stat == 'RANGE':
+      return max(v) - min(v)
+   elif stat == 'FIRST':
+      return v[0]
+   elif stat == 'LAST':
+      return v[-1]
+   else:
+      raise ValueError('Unsupported statistic: ' + stat)
+
+
+# Representation accuracy (RA) values, and their sdm_ra scores. Other values get a score of 0.
+raScores = {'Very High': 5, 'High': 4, 'Medium': 3, 'Low': 2, 'Very Low': 1}
+
+
+def spatialDuplicates(oids, grpIDs, rankCols):
+   """Finds rows which are not the best row in their group (e.g. the polygons covering one overlap area).
+   Rows are ranked in decreasing order of each column in rankCols (in priority order), then by decreasing OID. Rows
+   with a null rank value are never the best row of a group with more than one row.
+   oids = row IDs
+   grpIDs = group ID for each row
+   rankCols = list of columns (one value for each row) to rank by
+   Returns a set of OIDs of rows which are not the best in their group."""
+   import numpy as np
+   if len(oids) == 0:
+      return set()
+
+   def ordinal(col):
+      # integer rank of each value, so strings can be sorted in descending order
+      return np.unique(np.array(col), return_inverse=True)[1].reshape(-1)
+
+   oidArr = np.asarray(oids)
+   grp = ordinal(grpIDs)
+   hasNull = np.zeros(len(oidArr), dtype=bool)
+   for c in rankCols:
+      hasNull |= np.array([v is None for v in c], dtype=bool)
+   shared = np.bincount(grp)[grp] > 1
+   dups = oidArr[hasNull & shared].tolist()
+   ok = ~hasNull
+   if ok.any():
+      grp = grp[ok]
+      # np.lexsort sorts by the last key first
+      keys = [-oidArr[ok]] + [-ordinal([v for v, k in zip(c, ok) if k]) for c in reversed(rankCols)] + [grp]
+      order = np.lexsort(keys)
+      g = grp[order]
+      best = np.ones(len(g), dtype=bool)
+      best[1:] = g[1:] != g[:-1]
+      dups = dups + oidArr[ok][order][~best].tolist()
+   return set(dups)
+
+
+# Version of the stage logic, included in all fingerprints. Increase when a change to a tool should cause all
+# existing outputs to be re-processed.
+fingerprintVersion = 1
+
+
+class Fingerprint:
+   """Content hash of a stage's inputs: data rows and named parameters.
+   Rows are hashed one at a time, and the sorted row hashes are combined, so the order of rows does not matter."""
+   def __init__(self):
+      self.rows = []
+      self.params = {'version': str(fingerprintVersion)}
+
+   def addRow(self, row):
+      h = hashlib.blake2b(digest_size=16)
+      for v in row:
+         if isinstance(v, (bytes, bytearray, memoryview)):
+            b = b'b' + bytes(v)
+         else:
+            b = repr(v).encode('utf-8')
+         h.update(len(b).to_bytes(8, 'little'))
+         h.update(b)
+      self.rows.append(h.digest())
+
+   def addParam(self, name, value):
+      """Adds a named parameter (any value with a stable str(), or another Fingerprint)."""
+      if isinstance(value, Fingerprint):
+         value = value.hexdigest()
+      self.params[name] = str(value)
+
+   def hexdigest(self):
+      h = hashlib.blake2b(digest_size=20)
+      for k in sorted(self.params):
+         h.update(repr((k, self.params[k])).encode('utf-8'))
+      h.update(len(self.rows).to_bytes(8, 'little'))
+      for r in sorted(self.rows):
+         h.update(r)
+      return h.hexdigest()
+
+
+def pathStamp(path, scanned=None):
+   """Modification stamp for a dataset path, for fingerprints of large inputs which are not hashed row by row (e.g.
+   a network dataset). For datasets in a file geodatabase, this is the latest modification time of any file in the
+   geodatabase folder.
+   scanned = Optional dictionary of {geodatabase or file: modification time}, filled in as paths are stamped, so
+      several datasets in one geodatabase share one scan of its folder"""
+   p = path
+   while p and not p.lower().endswith('.gdb') and os.path.dirname(p) != p:
+      p = os.path.dirname(p)
+   if not p.lower().endswith('.gdb'):
+      p = path
+   if scanned is not None and p in scanned:
+      m = scanned[p]
+   elif not os.path.exists(p):
+      m = None
+   elif os.path.isdir(p):
+      m = max([e.stat().st_mtime_ns for e in os.scandir(p) if e.is_file()] + [os.stat(p).st_mtime_ns])
+   else:
+      m = os.stat(p).st_mtime_ns
+   if scanned is not None:
+      scanned[p] = m
+   if m is None:
+      return path
+   return path + '@' + str(m)
+
+
+class DiskCache:
+   """Folder of items built from a source dataset and kept between runs (e.g. indexes for an NHDPlus HR geodatabase).
+   Each item is a sub-folder named for the source modification stamp (see pathStamp) and the item format version, so
+   an item is rebuilt when its source or the format changes. Use:
+      cache = DiskCache(folder, version)
+      item = cache.get(stamp)
+      if item is None:
+         with cache.write(stamp) as tmp:
+            (write files to tmp)
+         item = cache.get(stamp)"""
+   def __init__(self, folder, version):
+      self.folder = folder
+      self.version = version
+
+   def path(self, stamp):
+      key = hashlib.md5((str(self.version) + '|' + str(stamp)).encode('utf-8')).hexdigest()[:16]
+      return os.path.join(self.folder, 'v' + str(self.version) + '_' + key)
+
+   def get(self, stamp):
+      """Returns the item folder for a stamp, or None if it has not been built."""
+      p = self.path(stamp)
+      return p if os.path.isdir(p) else None
+
+   @contextlib.contextmanager
+   def write(self, stamp):
+      """Yields a new temporary folder to write an item to. When the block completes, the folder becomes the item for
+      the stamp (unless another process finished it first), and items for other stamps are deleted. Items still
+      open in other processes may not be deleted; they are tried again when the next item is written."""
+      p = self.path(stamp)
+      tmp = p + '.tmp_' + uuid.uuid4().hex[:8]
+      os.makedirs(tmp)
+      try:
+         yield tmp
+         try:
+            os.rename(tmp, p)
+         except OSError:
+            if not os.path.isdir(p):
+               raise
+      finally:
+         if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+      for e in os.scandir(self.folder):
+         if e.is_dir() and e.path != p and '.tmp_' not in e.name:
+            shutil.rmtree(e.path, ignore_errors=True)
+
+
+def GetElapsedTime(t1, t2):
+   """Gets the time elapsed between the start time (t1) and the finish time (t2), as datetimes or as seconds."""
+   delta = t2 - t1
+   if not isinstance(delta, timedelta):
+      delta = timedelta(seconds=delta)
+   (d, m, s) = (delta.days, delta.seconds // 60, delta.seconds % 60)
+   (h, m) = (m // 60, m % 60)
+   deltaString = '%s days, %s hours, %s minutes, %s seconds' % (str(d), str(h), str(m), str(s))
+   return deltaString
+
+
+class Trace:
+   """Timing and counters for one tool run: nested stages (see stage), and counters for the run and each active
+   stage (see count and peak). Written as JSON or CSV."""
+   def __init__(self, name):
+      self.name = name
+      self.started = datetime.now()
+      self.t0 = time.perf_counter()
+      self.seconds = None
+      self.counters = {}
+      self.stages = []
+      self.error = None
+      self.folder = None
+      self._stack = []
+
+   @contextlib.contextmanager
+   def stage(self, name):
+      """Times a block of code as a stage, nested within the currently active stage."""
+      rec = {'stage': '/'.join([a['name'] for a in self._stack] + [name]), 'name': name, 'depth': len(self._stack),
+             'start': round(time.perf_counter() - self.t0, 4), 'seconds': None, 'counters': {}}
+      self.stages.append(rec)
+      self._stack.append(rec)
+      t = time.perf_counter()
+      try:
+         yield rec
+      finally:
+         rec['seconds'] = round(time.perf_counter() - t, 4)
+         self._stack.remove(rec)
+
+   def count(self, name, n=1):
+      """Adds n to a counter (e.g. 'rows read')."""
+      self.counters[name] = self.counters.get(name, 0) + n
+      for rec in self._stack:
+         rec['counters'][name] = rec['counters'].get(name, 0) + n
+
+   def peak(self, name, value):
+      """Updates a maximum-value counter (e.g. 'scratch bytes')."""
+      self.counters[name] = max(self.counters.get(name, 0), value)
+      for rec in self._stack:
+         rec['counters'][name] = max(rec['counters'].get(name, 0), value)
+
+   def finish(self):
+      self.seconds = round(time.perf_counter() - self.t0, 4)
+
+   def summary(self, n=10):
+      """Returns the n slowest stages, totalled over repeated calls: list of (stage, calls, seconds)."""
+      tot = {}
+      for rec in self.stages:
+         c, s = tot.get(rec['stage'], (0, 0.0))
+         tot[rec['stage']] = (c + 1, s + (rec['seconds'] or 0.0))
+      return sorted([(k, c, round(s, 2)) for k, (c, s) in tot.items()], key=lambda a: -a[2])[:n]
+
+   def toDict(self):
+      return {'tool': self.name, 'started': self.started.isoformat(), 'seconds': self.seconds, 'error': self.error,
+              'counters': self.counters, 'stages': [dict([(k, v) for k, v in r.items() if k != 'name'])
+                                                    for r in self.stages]}
+
+   def writeJSON(self, path):
+      with open(path, 'w') as f:
+         json.dump(self.toDict(), f, indent=1, default=str)
+      return path
+
+   def writeCSV(self, path):
+      cnames = sorted(set([k for r in self.stages for k in r['counters']]))
+      with open(path, 'w', newline='') as f:
+         w = csv.writer(f)
+         w.writerow(['stage', 'depth', 'start', 'seconds'] + cnames)
+         for r in self.stages:
+            w.writerow([r['stage'], r['depth'], r['start'], r['seconds']] + [r['counters'].get(c, '') for c in cnames])
+      return path
+
+
+# active traces (see startTrace). Stages and counters go to the most recent one.
+_traces = []
+
+
+def startTrace(name):
+   """Starts a new trace, which receives all stages and counters until endTrace is called."""
+   tr = Trace(name)
+   _traces.append(tr)
+   return tr
+
+
+def endTrace(tr):
+   tr.finish()
+   if tr in _traces:
+      _traces.remove(tr)
+   return tr
+
+
+def currentTrace():
+   """Returns the active Trace, or None."""
+   if _traces:
+      return _traces[-1]
+   return None
+
+
+def stage(name):
+   """Times a block of code as a stage of the active trace. Does nothing if no trace is active. Use as:
+      with stage('Buffer'):
+         ..."""
+   if _traces:
+      return _traces[-1].stage(name)
+   return contextlib.nullcontext()
+
+
+def addCount(name, n=1):
+   """Adds n to a counter of the active trace (if any)."""
+   if _traces:
+      _traces[-1].count(name, n)
+
+
+def traced(fn):
+   """Decorator: times each call of a function as a stage (named for the function) of the active trace."""
+   import functools
+
+   @functools.wraps(fn)
+   def wrapper(*args, **kwargs):
+      with stage(fn.__name__):
+         return fn(*args, **kwargs)
+   return wrapper
+
+
+def countRows(rows, name='rows read'):
+   """Passes through rows from an iterable (e.g. a cursor), counting them in the active trace."""
+   n = 0
+   try:
+      for row in rows:
+         n += 1
+         yield row
+   finally:
+      addCount(name, n)
+
+
+# end
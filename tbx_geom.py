@@ -0,0 +1,792 @@
+# Geometry helper functions for python toolbox
+# In-memory (arcpy-free) geometry processing, using NumPy only. Geometries are read from/written to
+# feature classes in tbx_helper.
+import collections
+import json
+import os
+
+import numpy as np
+
+from tbx_core import *
+
+
+class Poly:
+   """Polygon for in-memory processing: a list of closed rings (exterior and interior rings, from all parts).
+   Point-in-polygon tests use the even-odd rule over all rings, so holes and multiple parts are handled."""
+   def __init__(self, rings):
+      self.rings = []
+      for r in rings:
+         r = np.asarray(r, dtype=float).reshape(-1, 2)
+         if len(r) < 3:
+            continue
+         if not np.array_equal(r[0], r[-1]):
+            r = np.vstack([r, r[:1]])
+         self.rings.append(r)
+      if self.rings:
+         self.segs = np.vstack([np.hstack([r[:-1], r[1:]]) for r in self.rings])
+         xy = np.vstack(self.rings)
+         self.bbox = (xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+      else:
+         self.segs = np.empty((0, 4))
+         self.bbox = (np.nan, np.nan, np.nan, np.nan)
+
+   def segsNear(self, bbox, dist=0.0):
+      """Returns segments with bounding boxes within dist of bbox."""
+      s = self.segs
+      keep = ((np.minimum(s[:, 0], s[:, 2]) <= bbox[2] + dist) & (np.maximum(s[:, 0], s[:, 2]) >= bbox[0] - dist) &
+              (np.minimum(s[:, 1], s[:, 3]) <= bbox[3] + dist) & (np.maximum(s[:, 1], s[:, 3]) >= bbox[1] - dist))
+      return s[keep]
+
+   def contains(self, pts):
+      """Even-odd point-in-polygon test for an (n, 2) array of points. Returns a boolean array."""
+      return pointsInSegs(pts, self.segs)
+
+
+def pointsInSegs(pts, segs, chunk=1000000):
+   """Even-odd point-in-polygon test of points against the (closed) ring segments of a polygon."""
+   pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+   inside = np.zeros(len(pts), dtype=bool)
+   if len(segs) == 0:
+      return inside
+   x1, y1, x2, y2 = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+   step = max(1, chunk // len(segs))
+   for i in range(0, len(pts), step):
+      px = pts[i:i + step, 0:1]
+      py = pts[i:i + step, 1:2]
+      crosses = (y1 > py) != (y2 > py)
+      with np.errstate(divide='ignore', invalid='ignore'):
+         xint = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+      inside[i:i + step] = (np.count_nonzero(crosses & (px < xint), axis=1) % 2) == 1
+   return inside
+
+
+def pointSegDist(pts, segs):
+   """Distance matrix between an (n, 2) array of points and an (m, 4) array of segments."""
+   x1, y1, x2, y2 = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+   dx = x2 - x1
+   dy = y2 - y1
+   ln = dx * dx + dy * dy
+   ln[ln == 0] = 1.0
+   px = pts[:, 0:1]
+   py = pts[:, 1:2]
+   t = np.clip(((px - x1) * dx + (py - y1) * dy) / ln, 0.0, 1.0)
+   return np.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
+
+
+def segsCross(sa, sb):
+   """Boolean matrix: True where segments in sa properly cross segments in sb."""
+   ax1, ay1, ax2, ay2 = [sa[:, i:i + 1] for i in range(4)]
+   bx1, by1, bx2, by2 = sb[:, 0], sb[:, 1], sb[:, 2], sb[:, 3]
+   d1 = (bx2 - bx1) * (ay1 - by1) - (by2 - by1) * (ax1 - bx1)
+   d2 = (bx2 - bx1) * (ay2 - by1) - (by2 - by1) * (ax2 - bx1)
+   d3 = (ax2 - ax1) * (by1 - ay1) - (ay2 - ay1) * (bx1 - ax1)
+   d4 = (ax2 - ax1) * (by2 - ay1) - (ay2 - ay1) * (bx2 - ax1)
+   return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+
+def segsDistance(sa, sb, chunk=1000000):
+   """Minimum distance between two sets of segments (0 if any cross)."""
+   if len(sa) == 0 or len(sb) == 0:
+      return np.inf
+   dmin = np.inf
+   step = max(1, chunk // len(sb))
+   for i in range(0, len(sa), step):
+      s = sa[i:i + step]
+      if segsCross(s, sb).any():
+         return 0.0
+      dmin = min(dmin, pointSegDist(np.vstack([s[:, :2], s[:, 2:]]), sb).min())
+   step = max(1, chunk // len(sa))
+   for i in range(0, len(sb), step):
+      s = sb[i:i + step]
+      dmin = min(dmin, pointSegDist(np.vstack([s[:, :2], s[:, 2:]]), sa).min())
+   return dmin
+
+
+def bboxDist(a, b):
+   """Distance between two bounding boxes (xmin, ymin, xmax, ymax); 0 if they intersect."""
+   dx = max(a[0] - b[2], b[0] - a[2], 0.0)
+   dy = max(a[1] - b[3], b[1] - a[3], 0.0)
+   return (dx * dx + dy * dy) ** 0.5
+
+
+def polyDistance(a, b, maxDist=np.inf):
+   """Distance between two polygons (0 if they intersect or one contains the other).
+   If the distance is greater than maxDist, returns inf (only segments near the other polygon are compared)."""
+   if bboxDist(a.bbox, b.bbox) > maxDist:
+      return np.inf
+   # containment: test one vertex of each ring
+   if b.contains([r[0] for r in a.rings]).any():
+      return 0.0
+   if a.contains([r[0] for r in b.rings]).any():
+      return 0.0
+   if np.isinf(maxDist):
+      return segsDistance(a.segs, b.segs)
+   d = segsDistance(a.segsNear(b.bbox, maxDist), b.segsNear(a.bbox, maxDist))
+   return d if d <= maxDist else np.inf
+
+
+class GridIndex:
+   """Uniform grid spatial index over bounding boxes (xmin, ymin, xmax, ymax).
+   bboxes = (n, 4) array-like of bounding boxes. Rows with NaN are not indexed.
+   cellSize = Grid cell size. If not given, the median bounding box extent is used."""
+   def __init__(self, bboxes, cellSize=None):
+      self.bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+      valid = ~np.isnan(self.bboxes).any(axis=1)
+      self.ids = np.nonzero(valid)[0]
+      b = self.bboxes[valid]
+      if cellSize is None:
+         ext = np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]) if len(b) else np.array([1.0])
+         cellSize = float(np.median(ext))
+         if cellSize <= 0:
+            cellSize = float(ext.max()) if ext.max() > 0 else 1.0
+      self.cellSize = cellSize
+      self.origin = (b[:, 0].min(), b[:, 1].min()) if len(b) else (0.0, 0.0)
+      self.cells = {}
+      for k, i1, j1, i2, j2 in zip(self.ids, *self._cellRange(b).T):
+         for i in range(i1, i2 + 1):
+            for j in range(j1, j2 + 1):
+               self.cells.setdefault((i, j), []).append(k)
+
+   def _cellRange(self, b, dist=0.0):
+      c = np.empty((len(b), 4), dtype=np.int64)
+      c[:, 0] = np.floor((b[:, 0] - dist - self.origin[0]) / self.cellSize)
+      c[:, 1] = np.floor((b[:, 1] - dist - self.origin[1]) / self.cellSize)
+      c[:, 2] = np.floor((b[:, 2] + dist - self.origin[0]) / self.cellSize)
+      c[:, 3] = np.floor((b[:, 3] + dist - self.origin[1]) / self.cellSize)
+      return c
+
+   def query(self, bbox, dist=0.0):
+      """Returns ids of indexed boxes within dist of bbox."""
+      i1, j1, i2, j2 = self._cellRange(np.asarray(bbox, dtype=float).reshape(1, 4), dist)[0]
+      cand = set()
+      for i in range(i1, i2 + 1):
+         for j in range(j1, j2 + 1):
+            cand.update(self.cells.get((i, j), ()))
+      if not cand:
+         return np.empty(0, dtype=np.int64)
+      cand = np.fromiter(cand, dtype=np.int64, count=len(cand))
+      cb = self.bboxes[cand]
+      keep = ((cb[:, 0] <= bbox[2] + dist) & (cb[:, 2] >= bbox[0] - dist) &
+              (cb[:, 1] <= bbox[3] + dist) & (cb[:, 3] >= bbox[1] - dist))
+      return np.sort(cand[keep])
+
+   def pairs(self, dist=0.0):
+      """Returns an (n, 2) array of all pairs of ids (i < j) whose boxes are within dist of each other."""
+      if dist > 0:
+         # re-index with boxes grown by half the distance, so nearby boxes share cells
+         grown = self.bboxes + np.array([-dist / 2, -dist / 2, dist / 2, dist / 2])
+         cells = GridIndex(grown, self.cellSize + dist).cells
+      else:
+         cells = self.cells
+      n = len(self.bboxes)
+      keys = set()
+      for members in cells.values():
+         if len(members) > 1:
+            m = np.array(members, dtype=np.int64)
+            i, j = np.triu_indices(len(m), 1)
+            a, b = np.minimum(m[i], m[j]), np.maximum(m[i], m[j])
+            keys.update((a * n + b).tolist())
+      if not keys:
+         return np.empty((0, 2), dtype=np.int64)
+      keys = np.fromiter(keys, dtype=np.int64, count=len(keys))
+      keys.sort()
+      p = np.column_stack([keys // n, keys % n])
+      ba, bb = self.bboxes[p[:, 0]], self.bboxes[p[:, 1]]
+      keep = ((ba[:, 0] <= bb[:, 2] + dist) & (ba[:, 2] >= bb[:, 0] - dist) &
+              (ba[:, 1] <= bb[:, 3] + dist) & (ba[:, 3] >= bb[:, 1] - dist))
+      return p[keep]
+
+
+class BoxGrid:
+   """Uniform grid index over bounding boxes, held as arrays in compressed sparse row form (the sorted keys of the
+   cells in use, and the boxes in each cell), so it can be saved and memory-mapped (see PolyStore and
+   tbx_network.FlowGraph). Queries give the same boxes as GridIndex.query.
+   bboxes = (n, 4) array of boxes (rows with NaN are not indexed)
+   cellKeys, cellStart, members = keys of the cells in use (i * shape[1] + j), and offsets of each cell's boxes into
+      members
+   origin, cellSize, shape = grid origin (x, y), cell size, and number of cells in x and y"""
+   arrays = ['bboxes', 'cellKeys', 'cellStart', 'members']
+
+   def __init__(self, bboxes, cellKeys, cellStart, members, origin, cellSize, shape):
+      self.bboxes = bboxes
+      self.cellKeys = cellKeys
+      self.cellStart = cellStart
+      self.members = members
+      self.origin = tuple(origin)
+      self.cellSize = cellSize
+      self.shape = tuple(shape)
+
+   @classmethod
+   def build(cls, bboxes, cellSize=None):
+      """Indexes bounding boxes. If cellSize is not given, the median bounding box extent is used (as in GridIndex)."""
+      bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+      valid = np.nonzero(~np.isnan(bboxes).any(axis=1))[0]
+      b = bboxes[valid]
+      if cellSize is None:
+         ext = np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]) if len(b) else np.array([1.0])
+         cellSize = float(np.median(ext))
+         if cellSize <= 0:
+            cellSize = float(ext.max()) if ext.max() > 0 else 1.0
+      origin = (float(b[:, 0].min()), float(b[:, 1].min())) if len(b) else (0.0, 0.0)
+      c = np.empty((len(b), 4), dtype=np.int64)
+      for k in range(4):
+         c[:, k] = np.floor((b[:, k] - origin[k % 2]) / cellSize)
+      shape = (int(c[:, 2].max()) + 1, int(c[:, 3].max()) + 1) if len(b) else (0, 0)
+      # one entry for each (cell, box) pair, sorted by cell key
+      item, keys = _cellPairs(c, shape)
+      order = np.argsort(keys, kind='stable')
+      cellKeys, cellStart = np.unique(keys[order], return_index=True)
+      return cls(bboxes, cellKeys.astype(np.int64), np.append(cellStart, len(keys)).astype(np.int64),
+                 valid[item[order]].astype(np.int64), origin, cellSize, shape)
+
+   def save(self, folder):
+      """Writes the grid arrays (.npy) and grid.json (origin, cell size and shape) to a folder."""
+      for a in self.arrays:
+         np.save(os.path.join(folder, a + '.npy'), np.asarray(getattr(self, a)), allow_pickle=False)
+      with open(os.path.join(folder, 'grid.json'), 'w') as f:
+         json.dump({'origin': self.origin, 'cellSize': self.cellSize, 'shape': self.shape}, f)
+
+   @classmethod
+   def load(cls, folder):
+      """Opens a grid saved with save, with the arrays memory-mapped."""
+      with open(os.path.join(folder, 'grid.json')) as f:
+         meta = json.load(f)
+      return cls(*[loadArray(os.path.join(folder, a + '.npy')) for a in cls.arrays],
+                 origin=meta['origin'], cellSize=meta['cellSize'], shape=meta['shape'])
+
+   def _cellPos(self, keys):
+      """Positions of cell keys in cellKeys (-1 for cells not in use)."""
+      pos = np.searchsorted(self.cellKeys, keys)
+      ok = pos < len(self.cellKeys)
+      ok[ok] = self.cellKeys[pos[ok]] == keys[ok]
+      return np.where(ok, pos, -1)
+
+   def _cellRange(self, b, dist=0.0):
+      c = np.empty((len(b), 4), dtype=np.int64)
+      for k in range(4):
+         c[:, k] = np.floor((b[:, k] + (dist if k > 1 else -dist) - self.origin[k % 2]) / self.cellSize)
+      c[:, :2] = np.maximum(c[:, :2], 0)
+      c[:, 2] = np.minimum(c[:, 2], self.shape[0] - 1)
+      c[:, 3] = np.minimum(c[:, 3], self.shape[1] - 1)
+      return c
+
+   def query(self, bbox, dist=0.0):
+      """Returns indices of boxes within dist of bbox, sorted."""
+      b = np.asarray(bbox, dtype=float).reshape(1, 4)
+      i1, j1, i2, j2 = self._cellRange(b, dist)[0]
+      if i1 > i2 or j1 > j2:
+         return np.empty(0, dtype=np.int64)
+      if (i2 - i1 + 1) * (j2 - j1 + 1) > len(self.cellKeys):
+         # box covers more cells than are in use: test all boxes
+         cand = np.nonzero(~np.isnan(self.bboxes[:, 0]))[0]
+      else:
+         keys = (np.arange(i1, i2 + 1)[:, None] * self.shape[1] + np.arange(j1, j2 + 1)[None, :]).ravel()
+         pos = self._cellPos(keys)
+         pos = pos[pos >= 0]
+         if len(pos) == 0:
+            return np.empty(0, dtype=np.int64)
+         cand = np.unique(np.concatenate([self.members[self.cellStart[p]:self.cellStart[p + 1]] for p in pos]))
+      b = b[0]
+      cb = self.bboxes[cand]
+      keep = ((cb[:, 0] <= b[2] + dist) & (cb[:, 2] >= b[0] - dist) &
+              (cb[:, 1] <= b[3] + dist) & (cb[:, 3] >= b[1] - dist))
+      return cand[keep]
+
+   def pointPairs(self, pts, dist=0.0):
+      """Candidate (point, box) pairs for many points at once: the boxes within dist of each point.
+      Returns a tuple of arrays: (point indices, box indices), sorted by point and box."""
+      pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+      return self.boxPairs(np.hstack([pts, pts]), dist)
+
+   def boxPairs(self, boxes, dist=0.0):
+      """Candidate pairs for many query boxes at once: the indexed boxes within dist of each query box.
+      Returns a tuple of arrays: (query box indices, box indices), sorted by query box and box."""
+      q = np.asarray(boxes, dtype=float).reshape(-1, 4)
+      none = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+      if len(q) == 0 or len(self.cellKeys) == 0:
+         return none
+      bad = np.isnan(q).any(axis=1)
+      c = self._cellRange(np.where(bad[:, None], 0.0, q), dist)
+      c[bad] = (0, 0, -1, -1)
+      qi, keys = _cellPairs(c, self.shape)
+      pos = self._cellPos(keys)
+      qi, pos = qi[pos >= 0], pos[pos >= 0]
+      n = self.cellStart[pos + 1] - self.cellStart[pos]
+      qi = np.repeat(qi, n)
+      box = self.members[np.repeat(self.cellStart[pos] - np.cumsum(n) + n, n) + np.arange(n.sum())]
+      b, a = self.bboxes[box], q[qi]
+      keep = ((b[:, 0] <= a[:, 2] + dist) & (b[:, 2] >= a[:, 0] - dist) &
+              (b[:, 1] <= a[:, 3] + dist) & (b[:, 3] >= a[:, 1] - dist))
+      # sort by query box and box, dropping boxes found in several of a query box's cells
+      u = np.sort(qi[keep] * len(self.bboxes) + box[keep])
+      u = u[np.append(True, u[1:] != u[:-1])] if len(u) else u
+      return u // len(self.bboxes), u % len(self.bboxes)
+
+
+def _cellPairs(c, shape):
+   """Expands cell ranges ((n, 4) array of i1, j1, i2, j2) to (item, cell key) pairs."""
+   w = np.maximum(c[:, 3] - c[:, 1] + 1, 0)
+   n = np.maximum(c[:, 2] - c[:, 0] + 1, 0) * w
+   item = np.repeat(np.arange(len(c)), n)
+   off = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+   keys = (c[item, 0] + off // w[item]) * shape[1] + c[item, 1] + off % w[item]
+   return item, keys
+
+
+class PolyStore:
+   """Polygons stored as memory-mapped arrays in a folder, with a grid index (BoxGrid), for indexes built once and
+   used in many runs (e.g. catchments, see tbx_helper.catchmentIndex). Polygons are loaded when first used.
+   folder = store folder, written by PolyStore.write"""
+   maxPolys = 5000
+
+   def __init__(self, folder):
+      self.folder = folder
+      with open(os.path.join(folder, 'meta.json')) as f:
+         self.meta = json.load(f)
+      self.grid = BoxGrid.load(folder)
+      self.bboxes = self.grid.bboxes
+      for a in ['ids', 'polyStart', 'ringStart']:
+         setattr(self, a, loadArray(os.path.join(folder, a + '.npy')))
+      if self.meta['nVertices']:
+         self.xy = np.memmap(os.path.join(folder, 'xy.bin'), dtype=np.float64, mode='r').reshape(-1, 2)
+      else:
+         self.xy = np.empty((0, 2))
+      self._polys = collections.OrderedDict()
+
+   def __len__(self):
+      return len(self.ids)
+
+   @staticmethod
+   def write(folder, ids, polys, cellSize=None):
+      """Writes a store to an (empty) folder. Vertices are written as polygons are read, so the polygons do not need
+      to fit in memory.
+      ids = polygon IDs (numbers or strings)
+      polys = iterable of polygons, each a list of rings ((m, 2) vertex arrays), in the same order as ids
+      cellSize = grid cell size (see BoxGrid.build)
+      Returns the number of polygons written."""
+      bboxes, nRings, ringLen = [], [], []
+      with open(os.path.join(folder, 'xy.bin'), 'wb') as f:
+         for rings in polys:
+            rings = [np.asarray(r, dtype=np.float64) for r in rings]
+            rings = [r[:, :2] if r.ndim == 2 else r.reshape(-1, 2) for r in rings]
+            rings = [r for r in rings if len(r) >= 3]
+            if rings:
+               xy = np.vstack(rings)
+               bboxes.append((xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max()))
+               f.write(xy.tobytes())
+            else:
+               bboxes.append((np.nan, np.nan, np.nan, np.nan))
+            nRings.append(len(rings))
+            ringLen.extend([len(r) for r in rings])
+      ids = np.asarray(ids)
+      if len(ids) != len(bboxes):
+         raise ValueError('Number of polygon IDs does not match the number of polygons.')
+      BoxGrid.build(bboxes, cellSize).save(folder)
+      np.save(os.path.join(folder, 'ids.npy'), ids, allow_pickle=False)
+      np.save(os.path.join(folder, 'polyStart.npy'), np.concatenate([[0], np.cumsum(nRings)]).astype(np.int64))
+      np.save(os.path.join(folder, 'ringStart.npy'), np.concatenate([[0], np.cumsum(ringLen)]).astype(np.int64))
+      with open(os.path.join(folder, 'meta.json'), 'w') as f:
+         json.dump({'nPolys': len(ids), 'nVertices': int(sum(ringLen))}, f)
+      return len(ids)
+
+   def poly(self, k):
+      """Returns polygon k (a Poly), loading it from the store if it is not in memory."""
+      p = self._polys.get(k)
+      if p is not None:
+         self._polys.move_to_end(k)
+         return p
+      rs = self.ringStart[self.polyStart[k]:self.polyStart[k + 1] + 1]
+      p = Poly([np.array(self.xy[rs[i]:rs[i + 1]]) for i in range(len(rs) - 1)])
+      self._polys[k] = p
+      if len(self._polys) > self.maxPolys:
+         self._polys.popitem(last=False)
+      return p
+
+   def query(self, bbox, dist=0.0):
+      """Returns indices of polygons with bounding boxes within dist of bbox (as GridIndex.query)."""
+      return self.grid.query(bbox, dist)
+
+   def locate(self, pts):
+      """Finds the polygon containing each point (the first by index, if polygons overlap).
+      Returns an array of polygon indices (-1 for points not in any polygon)."""
+      pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+      out = np.full(len(pts), -1, dtype=np.int64)
+      pt, k = self.grid.pointPairs(pts)
+      # test the points of each candidate polygon together, in order of polygon index
+      order = np.argsort(k, kind='stable')
+      pt, k = pt[order], k[order]
+      uk, starts = np.unique(k, return_index=True)
+      starts = np.append(starts, len(k))
+      for c, kk in enumerate(uk.tolist()):
+         sel = pt[starts[c]:starts[c + 1]]
+         sel = sel[out[sel] == -1]
+         if len(sel):
+            out[sel[self.poly(kk).contains(pts[sel])]] = kk
+      return out
+
+
+def loadArray(path):
+   """Loads a .npy array memory-mapped, as a read-only ndarray view of the mapping (arrays with no elements cannot be
+   memory-mapped, and are read)."""
+   try:
+      return np.asarray(np.load(path, mmap_mode='r', allow_pickle=False))
+   except ValueError:
+      return np.load(path, allow_pickle=False)
+
+
+def splitPath(path, zones):
+   """Splits a line into pieces by zones (e.g. catchments), as an identity overlay of the line with the zones.
+   path = (m, 2) vertex array
+   zones = list of Poly
+   Returns a list of (zone index, (k, 2) vertex array) tuples, in order along the line (zone index -1 for pieces not in
+   any zone; pieces in overlapping zones go to the first zone)."""
+   path = np.asarray(path, dtype=float).reshape(-1, 2)
+   p, r = path[:-1], path[1:] - path[:-1]
+   # break points (segment index, parameter along the segment) where the line crosses zone boundaries
+   segI, segT = [np.arange(len(p)), np.arange(len(p))], [np.zeros(len(p)), np.ones(len(p))]
+   bb = (path[:, 0].min(), path[:, 1].min(), path[:, 0].max(), path[:, 1].max())
+   for z in zones:
+      zs = z.segsNear(bb)
+      if len(zs) == 0:
+         continue
+      q, s = zs[:, :2], zs[:, 2:] - zs[:, :2]
+      den = r[:, 0:1] * s[:, 1] - r[:, 1:2] * s[:, 0]
+      qp = q[None, :, :] - p[:, None, :]
+      with np.errstate(divide='ignore', invalid='ignore'):
+         t = (qp[:, :, 0] * s[:, 1] - qp[:, :, 1] * s[:, 0]) / den
+         u = (qp[:, :, 0] * r[:, 1:2] - qp[:, :, 1] * r[:, 0:1]) / den
+      i, j = np.nonzero((den != 0) & (t > 0) & (t < 1) & (u >= 0) & (u <= 1))
+      segI.append(i)
+      segT.append(t[i, j])
+   segI, segT = np.concatenate(segI), np.concatenate(segT)
+   order = np.lexsort((segT, segI))
+   segI, segT = segI[order], segT[order]
+   # sub-segments between consecutive break points on the same segment, and the zone of their mid points
+   same = (segI[1:] == segI[:-1]) & (segT[1:] > segT[:-1])
+   si, t1, t2 = segI[:-1][same], segT[:-1][same], segT[1:][same]
+   a = p[si] + r[si] * t1[:, None]
+   b = p[si] + r[si] * t2[:, None]
+   mid = (a + b) / 2
+   zone = np.full(len(mid), -1, dtype=np.int64)
+   for k, z in enumerate(zones):
+      todo = np.nonzero(zone == -1)[0]
+      if len(todo):
+         zone[todo[z.contains(mid[todo])]] = k
+   pieces = []
+   start = 0
+   for e in range(1, len(zone) + 1):
+      if e == len(zone) or zone[e] != zone[start]:
+         pieces.append((int(zone[start]), np.vstack([a[start:start + 1], b[start:e]])))
+         start = e
+   return pieces
+
+
+def clusterPolygons(polys, sepDist):
+   """Groups polygons which are within sepDist of each other (directly, or through other polygons).
+   This gives the same groups as buffering by half of sepDist, dissolving, and exploding (as in SpatialCluster).
+   polys = list of Poly objects (None for empty geometries)
+   sepDist = separation distance, in coordinate system units
+   Returns a list of group IDs (1..n, numbered in order of first appearance; None for empty geometries)."""
+   n = len(polys)
+   valid = [p is not None and len(p.rings) > 0 for p in polys]
+   ds = DisjointSet(n)
+   if n > 1:
+      bboxes = [p.bbox if v else (np.nan,) * 4 for p, v in zip(polys, valid)]
+      idx = GridIndex(bboxes)
+      for i, j in idx.pairs(sepDist).tolist():
+         if ds.find(i) == ds.find(j):
+            # already grouped, no need to measure
+            continue
+         if polyDistance(polys[i], polys[j], sepDist) <= sepDist:
+            ds.union(i, j)
+   grp = {}
+   out = []
+   for i in range(n):
+      if valid[i]:
+         out.append(grp.setdefault(ds.find(i), len(grp) + 1))
+      else:
+         out.append(None)
+   return out
+
+
+class ClusterTree:
+   """Single-linkage hierarchy of polygons: the minimum spanning forest of polygon-to-polygon distances up to a
+   maximum distance. The groups for any separation distance up to that maximum are the sets of polygons linked by
+   tree edges no longer than the distance, so one tree gives the groups for many distances (see groups).
+   n = number of polygons
+   valid = list of booleans (False for empty geometries)
+   edges = list of tree edges (i, j), in order of distance
+   dists = array of tree edge distances (sorted)
+   maxDist = maximum distance measured"""
+   def __init__(self, n, valid, edges, dists, maxDist):
+      self.n = n
+      self.valid = valid
+      self.edges = edges
+      self.dists = np.asarray(dists, dtype=float)
+      self.maxDist = maxDist
+
+   @classmethod
+   def build(cls, polys, maxDist):
+      """Builds the tree for polygons (list of Poly objects, None for empty geometries), measuring distances of pairs
+      within maxDist (grid index). Pairs are taken in order of bounding box distance (a lower bound), and a pair's
+      polygon distance is only measured when it could still join two groups (Kruskal's algorithm)."""
+      import heapq
+      n = len(polys)
+      valid = [p is not None and len(p.rings) > 0 for p in polys]
+      edges, dists = [], []
+      if n > 1:
+         b = np.array([p.bbox if v else (np.nan,) * 4 for p, v in zip(polys, valid)], dtype=float)
+         pairs = GridIndex(b).pairs(maxDist)
+         bi, bj = b[pairs[:, 0]], b[pairs[:, 1]]
+         dx = np.maximum(np.maximum(bi[:, 0] - bj[:, 2], bj[:, 0] - bi[:, 2]), 0.0)
+         dy = np.maximum(np.maximum(bi[:, 1] - bj[:, 3], bj[:, 1] - bi[:, 3]), 0.0)
+         heap = [(d, i, j, False) for d, i, j in zip(np.hypot(dx, dy).tolist(), *pairs.T.tolist())]
+         heapq.heapify(heap)
+         ds = DisjointSet(n)
+         while heap and len(edges) < n - 1:
+            d, i, j, exact = heapq.heappop(heap)
+            if ds.find(i) == ds.find(j):
+               continue
+            if not exact:
+               d = polyDistance(polys[i], polys[j], maxDist)
+               if d <= maxDist:
+                  heapq.heappush(heap, (d, i, j, True))
+               continue
+            ds.union(i, j)
+            edges.append((i, j))
+            dists.append(d)
+      return cls(n, valid, edges, dists, maxDist)
+
+   def groups(self, sepDist):
+      """Group IDs for a separation distance, the same as clusterPolygons(polys, sepDist). The distance can not be
+      greater than the tree's maximum distance.
+      Returns a list of group IDs (1..n, numbered in order of first appearance; None for empty geometries)."""
+      if sepDist > self.maxDist:
+         raise ValueError('Separation distance ' + str(sepDist) + ' is greater than the maximum distance of the '
+                          'cluster tree (' + str(self.maxDist) + ').')
+      ds = DisjointSet(self.n)
+      for i, j in self.edges[:int(np.searchsorted(self.dists, sepDist, side='right'))]:
+         ds.union(i, j)
+      grp = {}
+      return [grp.setdefault(ds.find(i), len(grp) + 1) if v else None for i, v in enumerate(self.valid)]
+
+
+def boxesOverlap(a, b):
+   """True if two bounding boxes (xmin, ymin, xmax, ymax) intersect."""
+   return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def overlayFaces(geoms, bboxes, intersect, difference, isEmpty, bbox):
+   """Computes the unique faces of a planar overlay of polygons (the areas covered by each set of polygons), within
+   groups of overlapping bounding boxes. The geometry operations are passed in, so any geometry type can be used.
+   geoms = list of polygons
+   bboxes = list of bounding boxes (xmin, ymin, xmax, ymax), one for each polygon
+   intersect, difference = functions (a, b) returning the intersection/difference of two polygons
+   isEmpty = function (a) returning True for an empty polygon
+   bbox = function (a) returning the bounding box of a polygon
+   Returns a list of tuples: (face polygon, list of indices of the polygons covering the face)"""
+   n = len(geoms)
+   ds = DisjointSet(n)
+   if n > 1:
+      for i, j in GridIndex(bboxes).pairs(0.0).tolist():
+         ds.union(i, j)
+   groups = {}
+   for i in range(n):
+      groups.setdefault(ds.find(i), []).append(i)
+
+   faces = []
+   for members in groups.values():
+      if len(members) == 1:
+         faces.append((geoms[members[0]], members))
+         continue
+      gf = []  # faces in this group: [polygon, bbox, indices]
+      for i in members:
+         p, bp = geoms[i], bboxes[i]
+         rem = p
+         nf = []
+         for f, bf, ids in gf:
+            if rem is None or not boxesOverlap(bf, bp):
+               nf.append((f, bf, ids))
+               continue
+            inter = intersect(f, p)
+            if isEmpty(inter):
+               nf.append((f, bf, ids))
+               continue
+            nf.append((inter, bbox(inter), ids + [i]))
+            diff = difference(f, p)
+            if not isEmpty(diff):
+               nf.append((diff, bbox(diff), ids))
+            rem = difference(rem, inter)
+            if isEmpty(rem):
+               rem = None
+         if rem is not None:
+            nf.append((rem, bbox(rem), [i]))
+         gf = nf
+      faces.extend([(f, ids) for f, bf, ids in gf])
+   return faces
+
+
+def eraseGeoms(geoms, bboxes, pairs, erase, difference, isEmpty, bbox):
+   """Erases polygons from other polygons (as Erase): each polygon has the erase polygons it is paired with removed in
+   turn, skipping those whose bounding boxes no longer overlap what remains. The geometry operations are passed in (as
+   in overlayFaces).
+   geoms, bboxes = polygons, and their bounding boxes
+   pairs = (polygon indices, erase polygon keys) candidate pairs, e.g. from BoxGrid.boxPairs
+   erase = dictionary of {erase polygon key: (polygon, bounding box)}
+   difference, isEmpty, bbox = geometry functions, as in overlayFaces
+   Returns a dictionary of {polygon index: remaining polygon, or None if nothing remains}, for polygons with
+   candidates. Other polygons are not changed by the erase."""
+   out = {}
+   for i, k in zip(*[np.asarray(a).tolist() for a in pairs]):
+      rem = out.get(i, geoms[i])
+      if rem is None:
+         continue
+      e, be = erase[k]
+      if boxesOverlap(bbox(rem) if i in out else bboxes[i], be):
+         rem = difference(rem, e)
+         if isEmpty(rem):
+            rem = None
+      out[i] = rem
+   return out
+
+
+def partitionBoxes(bboxes, nParts, dist=0.0, keys=None):
+   """Splits features into at most nParts partitions of similar size, which can be processed independently. Features
+   within dist of each other (directly or through other features), or with the same key, are kept together.
+   bboxes = list of bounding boxes (xmin, ymin, xmax, ymax)
+   nParts = maximum number of partitions
+   dist = distance (in coordinate system units) below which features must not be separated
+   keys = optional list of keys (e.g. source feature IDs), one for each feature
+   Returns a list of partition numbers (0..nParts-1), one for each feature."""
+   n = len(bboxes)
+   ds = DisjointSet(n)
+   if n > 1:
+      for i, j in GridIndex(bboxes).pairs(dist).tolist():
+         ds.union(i, j)
+   if keys is not None:
+      first = {}
+      for i, k in enumerate(keys):
+         ds.union(first.setdefault(k, i), i)
+   return _packGroups(ds, n, nParts)
+
+
+def partitionPairs(items, keys, nParts):
+   """Splits items into partitions which can be processed independently: items paired with the same key (directly, or
+   through other items) are always in the same partition, e.g. occurrences overlapping the same erase feature. Groups
+   are packed as in partitionBoxes.
+   items, keys = sequences of (item, key) pairs
+   nParts = maximum number of partitions
+   Returns a dictionary of {item: partition number (0..nParts-1)}."""
+   items = np.asarray(items).tolist()
+   ix = dict([(a, i) for i, a in enumerate(dict.fromkeys(items))])
+   kx = {}
+   ds = DisjointSet(len(ix) + len(set(np.asarray(keys).tolist())))
+   for a, k in zip(items, np.asarray(keys).tolist()):
+      ds.union(ix[a], kx.setdefault(k, len(ix) + len(kx)))
+   part = _packGroups(ds, len(ix), nParts)
+   return dict([(a, part[i]) for a, i in ix.items()])
+
+
+def _packGroups(ds, n, nParts):
+   """Packs the connected groups of items 0..n-1 (a DisjointSet) into at most nParts partitions of similar size
+   (largest groups first, each into the smallest partition so far). Returns a list of partition numbers."""
+   groups = {}
+   for i in range(n):
+      groups.setdefault(ds.find(i), []).append(i)
+   sizes = [0] * max(min(nParts, len(groups)), 1)
+   part = [0] * n
+   for members in sorted(groups.values(), key=lambda a: (-len(a), a[0])):
+      k = sizes.index(min(sizes))
+      sizes[k] += len(members)
+      for i in members:
+         part[i] = k
+   return part
+
+
+def gridPoints(bbox, spacing):
+   """Points at the centers of a regular grid of spacing x spacing cells, centered on a bounding box.
+   Returns an (n, 2) array."""
+   xmin, ymin, xmax, ymax = bbox
+   nx = max(int(np.ceil((xmax - xmin) / spacing)), 1)
+   ny = max(int(np.ceil((ymax - ymin) / spacing)), 1)
+   xs = (xmin + xmax) / 2 + (np.arange(nx) - (nx - 1) / 2) * spacing
+   ys = (ymin + ymax) / 2 + (np.arange(ny) - (ny - 1) / 2) * spacing
+   gx, gy = np.meshgrid(xs, ys)
+   return np.column_stack([gx.ravel(), gy.ravel()])
+
+
+def interiorPoint(a, b=None, sizes=(8, 32, 128)):
+   """A point inside polygon a (and inside polygon b, if given), found on progressively finer grids over the
+   (shared) bounding box. Returns (x, y), or None if no grid point is inside (e.g. slivers)."""
+   bb = a.bbox
+   if b is not None:
+      bb = (max(bb[0], b.bbox[0]), max(bb[1], b.bbox[1]), min(bb[2], b.bbox[2]), min(bb[3], b.bbox[3]))
+      if bb[0] > bb[2] or bb[1] > bb[3]:
+         return None
+   for n in sizes:
+      spacing = max(bb[2] - bb[0], bb[3] - bb[1]) / n
+      if spacing <= 0:
+         return None
+      pts = gridPoints(bb, spacing)
+      inside = a.contains(pts)
+      if b is not None:
+         inside[inside] = b.contains(pts[inside])
+      if inside.any():
+         return tuple(pts[np.argmax(inside)])
+   return None
+
+
+def samplePolygon(poly, spacing, zones):
+   """Sample points inside a polygon on a grid of spacing x spacing cells, assigned to zones (e.g. catchments). Each
+   piece of the polygon in a zone gets at least one point (see interiorPoint).
+   poly = Poly
+   spacing = grid spacing, in coordinate system units
+   zones = list of Poly (zones which may intersect the polygon)
+   Returns a tuple: ((n, 2) array of points, array of zone indices for the points; -1 = not in any zone)"""
+   pts = gridPoints(poly.bbox, spacing)
+   pts = pts[poly.contains(pts)]
+   zone = np.full(len(pts), -1, dtype=np.int64)
+   extra, extraZone = [], []
+   for k, z in enumerate(zones):
+      todo = np.nonzero(zone == -1)[0]
+      if len(todo):
+         zone[todo[z.contains(pts[todo])]] = k
+      if not (zone == k).any():
+         p = interiorPoint(poly, z, (8, 32))
+         if p is not None:
+            extra.append(p)
+            extraZone.append(k)
+   if extra:
+      pts = np.vstack([pts, np.array(extra)])
+      zone = np.concatenate([zone, np.array(extraZone, dtype=np.int64)])
+   if len(pts) == 0:
+      p = interiorPoint(poly)
+      if p is None:
+         p = tuple(poly.rings[0][0])
+      pts = np.array([p])
+      zone = np.array([-1], dtype=np.int64)
+   return pts, zone
+
+
+def lineMeasures(pts, paths):
+   """Position of points along a line (distance from the start of the line to the nearest point on it), and their
+   distance from the line.
+   pts = (n, 2) array of points
+   paths = list of (m, 2) vertex arrays (line parts, measured in order)
+   Returns a tuple of two arrays: (measures, distances)"""
+   segs = np.vstack([np.hstack([p[:-1], p[1:]]) for p in paths if len(p) > 1])
+   x1, y1, x2, y2 = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+   dx, dy = x2 - x1, y2 - y1
+   ln = np.hypot(dx, dy)
+   l2 = ln * ln
+   l2[l2 == 0] = 1.0
+   px, py = pts[:, 0:1], pts[:, 1:2]
+   t = np.clip(((px - x1) * dx + (py - y1) * dy) / l2, 0.0, 1.0)
+   d = np.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
+   k = np.argmin(d, axis=1)
+   r = np.arange(len(pts))
+   start = np.concatenate([[0.0], np.cumsum(ln)[:-1]])
+   return start[k] + t[r, k] * ln[k], d[r, k]
+
+
+# end
@@ -1,18 +1,20 @@
 # Helper functions for python toolbox
 import time
 import arcpy
+import collections
+import contextlib
 import datetime
 import os
 import re
 import sys
 import traceback
 import csv
+import hashlib
+import shutil
+import uuid
 from datetime import datetime as datetime
+from tbx_core import *
 
-arcpy.CheckOutExtension("Spatial")
-scratchGDB = arcpy.env.scratchFolder + os.sep + 'sdmPresencePreProc.gdb'  # r'C:\David\scratch\sdmPresencePreProc.gdb'
-if not os.path.exists(scratchGDB):
-   arcpy.CreateFileGDB_management(os.path.dirname(scratchGDB), os.path.basename(scratchGDB))
 curr_dir = os.path.dirname(os.path.abspath(__file__))
 
 ### Define the fields to add
@@ -25,7 +27,7 @@ class Field:
 # Initial fields for editing
 fldSpCode = Field('sp_code', 'TEXT', 20)  # Code to identify species. Example: 'clemaddi'. If subspecies, use trinomial
 fldSrcTab = Field('src_table', 'TEXT', 50)  # Code to identify source dataset. Example: 'biotics'
-fldSrcFID = Field('src_fid', 'LONG', '')  # original source table FID (auto-populated)
+fldSrcFID = Field('src_fid', 'LONG', '')  # OID of the feature in the source table (auto-populated)
 fldSFID = Field('src_featid', 'LONG', '')  # original feature's SFID or similar (Source feature ID in Biotics)
 fldEOID = Field('src_grpid', 'TEXT', 50)  # original group ID (EO ID in biotics)
 fldUse = Field('sdm_use', 'SHORT', '')  # Binary: Eligible for use in model training (1) or not (0)
@@ -55,66 +57,11 @@ initDissList = [f.Name for f in initFields]
 initFieldsFull = [[f.Name, f.Type, f.Name, f.Length] for f in initFields]
 
 
-def getStdDate(Date):
-   # Date calculation logic. Used in AddInitFields
-   default_y = '0000'
-   default_m_d = '00'
-
-   # Set up some regular expressions for pattern matching dates
-   p1 = re.compile(r'^[1-2][0-9][0-9][0-9]-[0-1][0-9]-[0-9][0-9]$') # yyyy-mm-dd
-   p2 = re.compile(r'^[1-2][0-9][0-9][0-9]-[0-1][0-9]$') # yyyy-mm
-   p3 = re.compile(r'^[1-2][0-9][0-9][0-9]-?$') # yyyy or yyyy-
-   p4 = re.compile(r'^[0-9][0-9]?/[0-9][0-9]?/[1-2][0-9][0-9][0-9]$') # m/d/yyyy or mm/dd/yyyy
-   p4m = re.compile(r'^[0-9][0-9]?/') # to extract month
-   p4d = re.compile(r'/[0-9][0-9]?/') # to extract day
-
-   if type(Date) == datetime:
-      # arcgis date fields are datetime types
-      Date = str(Date.date())
-   else:
-      Date = str(Date)
-
-   if p1.match(Date):
-      yyyy = p1.match(Date).group()[:4]
-      mm = p1.match(Date).group()[5:7]
-      dd = p1.match(Date).group()[8:10]
-   elif p2.match(Date):
-      yyyy = p2.match(Date).group()[:4]
-      mm = p2.match(Date).group()[5:7]
-      dd = default_m_d
-   elif p3.match(Date):
-      yyyy = p3.match(Date).group()[:4]
-      mm = default_m_d
-      dd = default_m_d
-   elif p4.match(Date):
-      # This is a pain in the ass.
-      yyyy = p4.match(Date).group()[-4:]
-      mm = p4m.search(Date).group().replace('/', '').zfill(2)
-      dd = p4d.search(Date).group().replace('/', '').zfill(2)
-   else:
-      # Try to get any four digits in a row
-      y0 = re.findall('(?<!\d)\d{4}(?!\d)', Date)
-      if len(y0) == 0:
-         yyyy = default_y
-      else:
-         yyyy = y0[0]
-      mm = default_m_d
-      dd = default_m_d
-   # set defaults if all zeros
-   if yyyy == '0000':
-      yyyy = default_y
-   if mm == '00':
-      mm = default_m_d
-   if dd == '00':
-      dd = default_m_d
-   yyyymmdd = yyyy + '-' + mm + '-' + dd
-   return yyyymmdd
-
-
+@traced
 def copyFld(lyr, fieldIn, fieldOut):
    """Copy values from one field to another new field"""
    with arcpy.da.UpdateCursor(lyr, [fieldIn, fieldOut]) as cursor:
-      for row in cursor:
+      for row in countRows(cursor, 'rows written'):
          row[1] = row[0]
          cursor.updateRow(row)
 
@@ -125,25 +72,136 @@ def countFeatures(features):
    return count
 
 
-def garbagePickup(trashList):
-   """Deletes Arc files in list, with error handling. Argument must be a list."""
-   for t in trashList:
-      try:
-         arcpy.Delete_management(t)
-         printMsg('File "' + str(t) + '" deleted.')
-      except:
-         printMsg('Could not delete file "' + str(t) + '".')
-         pass
-   return
-
-
-def GetElapsedTime(t1, t2):
-   """Gets the time elapsed between the start time (t1) and the finish time (t2)."""
-   delta = t2 - t1
-   (d, m, s) = (delta.days, delta.seconds / 60, delta.seconds % 60)
-   (h, m) = (m / 60, m % 60)
-   deltaString = '%s days, %s hours, %s minutes, %s seconds' % (str(d), str(h), str(m), str(s))
-   return deltaString
+class ScratchWorkspace:
+   """Uniquely named scratch geodatabase for one tool run (or worker process), for intermediate datasets. Everything
+   is deleted when the run finishes or fails, and peak disk usage is reported. Use as a context manager:
+      with ScratchWorkspace() as scratch:
+         outBuff = scratch.path('outBuff', memory=True)
+   Functions called within the block can get the workspace with getScratch()."""
+   diskCheckEvery = 20
+
+   def __init__(self, prefix='sdmPresencePreProc'):
+      tag = uuid.uuid4().hex[:10]
+      self.gdb = os.path.join(arcpy.env.scratchFolder, prefix + '_' + str(os.getpid()) + '_' + tag + '.gdb')
+      self.memPrefix = 'memory' + os.sep + 'm' + tag + '_'
+      self.items = []
+      self.gdbs = []
+      self.folders = []
+      self.peakBytes = 0
+      self.nPaths = 0
+
+   def __enter__(self):
+      arcpy.CreateFileGDB_management(os.path.dirname(self.gdb), os.path.basename(self.gdb))
+      self._workspace = arcpy.env.workspace
+      _scratchStack.append(self)
+      return self
+
+   def __exit__(self, excType, excValue, tb):
+      if self in _scratchStack:
+         _scratchStack.remove(self)
+      arcpy.env.workspace = self._workspace
+      self.cleanup()
+      return False
+
+   def delete(self, items):
+      """Deletes intermediate datasets before the end of the run (e.g. to free memory)."""
+      self.diskUsage()
+      for t in items:
+         try:
+            arcpy.Delete_management(t)
+         except:
+            printMsg('Could not delete "' + str(t) + '".')
+         if t in self.items:
+            self.items.remove(t)
+
+   def path(self, name, memory=False):
+      """Returns a unique path for an intermediate dataset, and tracks it for clean-up.
+      memory = if True, the dataset is put in the 'memory' workspace instead of the scratch geodatabase"""
+      if memory:
+         p = self.memPrefix + name
+      else:
+         p = self.gdb + os.sep + name
+      if p not in self.items:
+         self.items.append(p)
+      self.nPaths += 1
+      if self.nPaths % self.diskCheckEvery == 0:
+         self.diskUsage()
+      return p
+
+   def workspace(self, name):
+      """Creates an additional scratch geodatabase, deleted with the workspace. Used to give each worker process its
+      own geodatabase to write to, since a file geodatabase should only be edited by one process at a time."""
+      gdb = self.gdb[:-4] + '_' + name + '.gdb'
+      arcpy.CreateFileGDB_management(os.path.dirname(gdb), os.path.basename(gdb))
+      self.gdbs.append(gdb)
+      return gdb
+
+   def folder(self, name):
+      """Returns a scratch folder (created on first use), deleted with the workspace. Used for files which are not
+      datasets (e.g. indexes built for one run)."""
+      p = self.gdb[:-4] + '_' + name
+      if p not in self.folders:
+         os.makedirs(p, exist_ok=True)
+         self.folders.append(p)
+      return p
+
+   def diskUsage(self):
+      """Returns current disk usage of the scratch geodatabase(s) in bytes, and updates the peak usage."""
+      b = 0
+      for gdb in [self.gdb] + self.gdbs + self.folders:
+         for root, dirs, files in os.walk(gdb):
+            for f in files:
+               try:
+                  b += os.path.getsize(os.path.join(root, f))
+               except OSError:
+                  pass
+      self.peakBytes = max(self.peakBytes, b)
+      tr = currentTrace()
+      if tr is not None:
+         tr.peak('scratch bytes', b)
+      return b
+
+   def cleanup(self):
+      """Deletes all tracked intermediate datasets and the scratch geodatabase."""
+      self.diskUsage()
+      for t in self.items:
+         if t.startswith(self.memPrefix):
+            try:
+               arcpy.Delete_management(t)
+            except:
+               printMsg('Could not delete "' + t + '".')
+      for gdb in [self.gdb] + self.gdbs:
+         try:
+            arcpy.Delete_management(gdb)
+         except:
+            pass
+         if os.path.exists(gdb):
+            shutil.rmtree(gdb, ignore_errors=True)
+      for f in self.folders:
+         shutil.rmtree(f, ignore_errors=True)
+      self.items = []
+      self.gdbs = []
+      self.folders = []
+      printMsg('Peak scratch disk usage: ' + str(round(self.peakBytes / 1048576.0, 1)) + ' MB.')
+
+
+# active scratch workspaces (see getScratch), and workspaces created by getScratch in each running tool (see
+# tracedTool)
+_scratchStack = []
+_toolScratch = []
+
+
+def getScratch():
+   """Returns the active ScratchWorkspace. If none is active, one is created, which is deleted when the tool run ends
+   (see tracedTool), or when the process exits if no tool is running (e.g. in worker processes)."""
+   if not _scratchStack:
+      scr = ScratchWorkspace().__enter__()
+      if _toolScratch:
+         _toolScratch[-1].append(scr)
+      else:
+         import atexit
+         atexit.register(scr.__exit__, None, None, None)
+   return _scratchStack[-1]
 
 
 def printMsg(msg):
@@ -164,6 +222,236 @@ def printErr(msg):
    return
 
 
+def step(msg):
+   """Reports a processing step, and times it as a stage of the active trace (see runTrace). Use as:
+      with step('Buffering input features'):
+         ..."""
+   printMsg(msg)
+   return stage(msg)
+
+
+@contextlib.contextmanager
+def runTrace(name, folder=None):
+   """Traces a tool run (see tbx_core.Trace). When the run ends, the slowest stages are reported, and the trace is
+   written to an 'sdm_logs' folder in folder (or currentTrace().folder, SDM_TRACE_DIR, or the scratch folder).
+   If SDM_PROFILE is set, a cProfile dump is written as well."""
+   tr = startTrace(name)
+   tr.folder = folder
+   prof = None
+   if os.environ.get('SDM_PROFILE'):
+      import cProfile
+      prof = cProfile.Profile()
+      prof.enable()
+   try:
+      yield tr
+   except Exception:
+      tr.error = traceback.format_exc()
+      raise
+   finally:
+      if prof is not None:
+         prof.disable()
+      endTrace(tr)
+      writeTrace(tr, prof)
+
+
+def writeTrace(tr, prof=None):
+   """Writes a finished trace (and optional cProfile profile), and reports stage timings. Used in runTrace."""
+   printMsg('Total time: ' + GetElapsedTime(0, tr.seconds) + '. Slowest stages (seconds):')
+   for st, n, sec in tr.summary():
+      printMsg('   ' + str(sec) + ' : ' + st + ('' if n == 1 else ' (' + str(n) + ' calls)'))
+   try:
+      folder = os.environ.get('SDM_TRACE_DIR')
+      if not folder:
+         folder = os.path.join(tr.folder or arcpy.env.scratchFolder, 'sdm_logs')
+      if not os.path.exists(folder):
+         os.makedirs(folder)
+      base = os.path.join(folder, tr.name + '_' + tr.started.strftime('%Y%m%d_%H%M%S'))
+      tr.writeJSON(base + '.json')
+      tr.writeCSV(base + '.csv')
+      if prof is not None:
+         prof.dump_stats(base + '.prof')
+      printMsg('Run trace written to ' + base + '.json')
+   except Exception as e:
+      printWrng('Could not write run trace: ' + str(e))
+
+
+def tracedTool(execute):
+   """Decorator for toolbox execute methods: initializes the run (see initRun), and traces it (see runTrace). Scratch
+   workspaces created by getScratch during the run are deleted when it ends."""
+   import functools
+
+   @functools.wraps(execute)
+   def wrapper(self, params, messages):
+      with runTrace(type(self).__name__):
+         _toolScratch.append([])
+         try:
+            with stage('initRun'):
+               initRun()
+            return execute(self, params, messages)
+         finally:
+            for scr in reversed(_toolScratch.pop()):
+               scr.__exit__(None, None, None)
+            # the run may have changed datasets: check stamps again in the next validation (see datasetMeta)
+            for m in _metaCache.values():
+               m.checked = 0
+            _stampScan['time'] = 0.0
+   return wrapper
+
+
+# ArcGIS extensions checked out in this process (see checkOutExtension)
+_extensions = {}
+
+
+def checkOutExtension(name):
+   """Checks out an ArcGIS extension license (once per process). Returns the checkout status."""
+   if _extensions.get(name) != 'CheckedOut':
+      _extensions[name] = arcpy.CheckOutExtension(name)
+   return _extensions[name]
+
+
+def initRun():
+   """Initialization needed only when a tool runs (not on import, which happens on every tool validation)."""
+   checkOutExtension("Spatial")
+   forgetMeta()
+
+
+# Dataset metadata cache (see datasetMeta): maximum number of datasets kept, and how long (seconds) metadata is kept
+# for datasets without a modification stamp (layers, enterprise and memory datasets)
+metaCacheSize = 32
+metaCacheAge = 30
+_metaCache = collections.OrderedDict()
+# Geodatabase modification times scanned in parameter validation (see datasetStamp), kept for stampScanAge seconds
+stampScanAge = 1.0
+_stampScan = {'time': 0.0, 'scanned': {}}
+
+
+class DatasetMeta:
+   """Metadata for a dataset, read with one Describe (see datasetMeta). indexed = lower-case names of fields with an
+   attribute index; time, checked = when read, and when the stamp was last checked."""
+   def __init__(self, inFeats, stamp):
+      d = arcpy.Describe(inFeats)
+      self.stamp = stamp
+      self.time = self.checked = time.time()
+      self.name = d.name
+      self.path = getattr(d, 'path', '')
+      self.catalogPath = getattr(d, 'catalogPath', str(inFeats))
+      self.dataType = getattr(d, 'dataType', None)
+      self.fields = list(d.fields)
+      self.fieldNames = [f.name for f in self.fields]
+      self.oidField = d.OIDFieldName if getattr(d, 'hasOID', False) else None
+      self.shapeType = getattr(d, 'shapeType', None)
+      self.spatialReference = getattr(d, 'spatialReference', None)
+      self.lengthField = getattr(d, 'lengthFieldName', '')
+      self.areaField = getattr(d, 'areaFieldName', '')
+      try:
+         self.indexed = set([f.name.lower() for i in d.indexes for f in i.fields if len(i.fields) == 1])
+      except:
+         self.indexed = set()
+      self.values = {}
+
+   def hasField(self, field):
+      return field.lower() in [f.lower() for f in self.fieldNames]
+
+   def distinct(self, inFeats, field, limit=None):
+      """Distinct (non-null) values of a field, as a sorted list. If limit is given, reading stops when limit values
+      are found (e.g. limit=2 is enough to tell if a field has one or multiple values). Values are read with a
+      DISTINCT query if the field has an attribute index, otherwise with one pass over the rows."""
+      key = field.lower()
+      if key in self.values:
+         return self.values[key][:limit]
+      if (key, limit) in self.values:
+         return self.values[(key, limit)]
+      vals = None
+      if key in self.indexed:
+         try:
+            with arcpy.da.SearchCursor(inFeats, [field], sql_clause=('DISTINCT', None)) as sc:
+               vals = set([r[0] for r in sc if r[0] is not None])
+         except:
+            vals = None
+      complete = True
+      if vals is None:
+         vals = set()
+         with arcpy.da.SearchCursor(inFeats, [field]) as sc:
+            for r in countRows(sc):
+               if r[0] is not None:
+                  vals.add(r[0])
+                  if limit and len(vals) >= limit:
+                     complete = False
+                     break
+      vals = sorted(vals)
+      if complete:
+         self.values[key] = vals
+         return vals[:limit]
+      self.values[(key, limit)] = vals
+      return vals
+
+
+def datasetStamp(inFeats):
+   """Modification stamp for a dataset (see pathStamp), or None for layers, enterprise and memory datasets.
+   In parameter validation, each geodatabase is scanned at most once per stampScanAge seconds."""
+   p = str(inFeats)
+   if currentTrace() is None:
+      now = time.time()
+      if now - _stampScan['time'] >= stampScanAge:
+         _stampScan['time'] = now
+         _stampScan['scanned'] = {}
+      st = pathStamp(p, _stampScan['scanned'])
+   else:
+      st = pathStamp(p)
+   if st == p:
+      return None
+   return st
+
+
+def inputStamp(inFeats):
+   """Change stamp for a large input used whole (e.g. statewide barriers), for run fingerprints: the dataset
+   modification stamp (see datasetStamp), plus the definition query and selection for layers. Inputs without a stamp
+   (enterprise and memory datasets) are hashed row by row (see fingerprintFeatures)."""
+   m = datasetMeta(inFeats)
+   st = datasetStamp(m.catalogPath)
+   if st is None:
+      return fingerprintFeatures(inFeats).hexdigest()
+   if m.dataType in ['FeatureLayer', 'Layer']:
+      d = arcpy.Describe(inFeats)
+      st += '|' + str(getattr(d, 'whereClause', '')) + '|' + str(getattr(d, 'FIDSet', ''))
+   return st
+
+
+def datasetMeta(inFeats):
+   """Returns cached metadata (DatasetMeta) for a dataset. Metadata is re-read when the dataset stamp changes (checked
+   on every call while a tool runs, and every metaCacheAge seconds in validation), or for datasets without a stamp,
+   when older than metaCacheAge seconds."""
+   key = str(inFeats)
+   m = _metaCache.get(key)
+   now = time.time()
+   if m is not None and currentTrace() is None and now - m.checked < metaCacheAge:
+      _metaCache.move_to_end(key)
+      return m
+   stamp = datasetStamp(inFeats)
+   if m is not None:
+      if m.stamp != stamp or (stamp is None and now - m.time >= metaCacheAge):
+         m = None
+      else:
+         m.checked = now
+         _metaCache.move_to_end(key)
+   if m is None:
+      m = DatasetMeta(inFeats, stamp)
+      _metaCache[key] = m
+      while len(_metaCache) > metaCacheSize:
+         _metaCache.popitem(last=False)
+   return m
+
+
+def forgetMeta(inFeats=None):
+   """Removes a dataset from the metadata cache. If inFeats is None, removes all datasets without a modification
+   stamp (layers may have a new selection, and memory datasets may have been replaced)."""
+   if inFeats is None:
+      for k in [k for k, m in _metaCache.items() if m.stamp is None]:
+         del _metaCache[k]
+   else:
+      _metaCache.pop(str(inFeats), None)
+
+
 def ProjectToMatch(fcTarget, csTemplate):
    """Project a target feature class to match the coordinate system of a template dataset"""
    # Get the spatial reference of your target and template feature classes
@@ -200,68 +488,152 @@ def ProjectToMatch(fcTarget, csTemplate):
       return fcTarget_prj
 
 
+@traced
 def JoinFields(ToTab, fldToJoin, FromTab, fldFromJoin, addFields):
-   """An alternative to arcpy's JoinField_management.
-   Note that this method is best for small 'FromTab' tables and one-two join fields.
+   """An alternative to arcpy's JoinField_management. For duplicate keys in FromTab, the last row is used.
 
    ToTab = The table to which fields will be added
    fldToJoin = The key field in ToTab, used to match records in FromTab
    FromTab = The table from which fields will be copied
    fldFromJoin = the key field in FromTab, used to match records in ToTab
    addFields = the list of fields to be added"""
-
-   def getFldVal(srcID, fldDict):
-      try:
-         fldVal = fldDict[srcID]
-      except:
-         fldVal = None
-      return fldVal
-
-   # set up dictionary
-   codeDict = {}
-   ls = [fldFromJoin] + addFields
-   num = list(range(1, len(addFields)+1))
-   numt = [str(n) for n in num]
-   text = "sc[" + ("], sc[").join(numt) + "]"
-   with arcpy.da.SearchCursor(FromTab, ls) as sc:
-      for row in sc:
-         key = sc[0]
-         codeDict[key] = eval(text)
-
-   fldTypes = [a for a in arcpy.ListFields(FromTab) if a.name in addFields]
-   existFld = [f.name for f in arcpy.ListFields(ToTab)]
-   toAdd = [a for a in fldTypes if a.name not in existFld]
-   # TODO: need to translate field types to get this to work
-   # if len(toAdd) > 0:
-   #   arcpy.AddFields_management(ToTab, [[a.name, a.type, a.name, a.length] for a in toAdd])
-   for f in toAdd:
-      arcpy.AddField_management(ToTab, f.name, f.type, '', '', f.length)
+   if isinstance(addFields, str):
+      addFields = [addFields]
+   cols = readColumns(FromTab, [fldFromJoin] + addFields)
+   jt = JoinTable(cols[0], cols[1:])
+   del cols
+
+   fromFlds = dict([(f.name.lower(), f) for f in arcpy.ListFields(FromTab)])
+   existFld = [f.name.lower() for f in arcpy.ListFields(ToTab)]
+   toAdd = [fieldDef(fromFlds[a.lower()], a) for a in addFields if a.lower() not in existFld]
+   if len(toAdd) > 0:
+      arcpy.AddFields_management(ToTab, toAdd)
 
    # Join fields
-   ls = [fldToJoin] + addFields
-   if len(addFields) > 1:
-      with arcpy.da.UpdateCursor(ToTab, ls) as cursor:
-         for row in cursor:
-            vals = getFldVal(row[0], codeDict)
-            if vals:
-               vals2 = list(vals)
-               for n in num:
-                  row[n] = vals2[n-1]
-               cursor.updateRow(row)
-   else:
-      # one field only
-      with arcpy.da.UpdateCursor(ToTab, ls) as cursor:
-         for row in cursor:
-            row[1] = getFldVal(row[0], codeDict)
-            cursor.updateRow(row)
+   with arcpy.da.UpdateCursor(ToTab, [fldToJoin] + addFields) as cursor:
+      for row in countRows(cursor, 'rows written'):
+         vals = jt.get(row[0])
+         if vals is not None:
+            cursor.updateRow((row[0],) + vals)
    return ToTab
 
 
-def SpatialCluster(inFeats, sepDist, fldGrpID='grpID'):
+def readColumns(table, fields, where=None):
+   """Reads fields from a table in one pass. Returns a list of columns (lists), in the order of fields."""
+   rows = [row for row in arcpy.da.SearchCursor(table, fields, where)]
+   addCount('rows read', len(rows))
+   if len(rows) == 0:
+      return [[] for f in fields]
+   return [list(c) for c in zip(*rows)]
+
+
+# ListFields field types, and their AddField equivalents
+fieldTypes = {'String': 'TEXT', 'Integer': 'LONG', 'SmallInteger': 'SHORT', 'BigInteger': 'BIGINTEGER',
+              'Double': 'DOUBLE', 'Single': 'FLOAT', 'Date': 'DATE', 'DateOnly': 'DATEONLY', 'TimeOnly': 'TIMEONLY',
+              'TimestampOffset': 'TIMESTAMPOFFSET', 'OID': 'LONG', 'GUID': 'GUID', 'GlobalID': 'GUID',
+              'Blob': 'BLOB', 'Raster': 'RASTER'}
+
+
+def fieldDef(field, name=None):
+   """Field definition ([name, type, alias, length]) for AddFields_management, from a ListFields field."""
+   if name is None:
+      name = field.name
+   if field.type == 'String':
+      length = field.length
+   else:
+      length = ''
+   return [name, fieldTypes.get(field.type, 'TEXT'), field.aliasName, length]
+
+
+@traced
+def fingerprintFeatures(inFeats, fields=None, where=None, by=None):
+   """Content hash (Fingerprint) of the geometry and attributes of features.
+   inFeats = The input features
+   fields = The attribute fields to include. If not given, all fields are included, except the OID and geometry
+      length/area fields.
+   where = Optional where clause, to only include some rows
+   by = Optional field. If given, returns a dictionary of {field value: Fingerprint}, one for each value."""
+   if fields is None:
+      m = datasetMeta(inFeats)
+      skip = [m.lengthField, m.areaField]
+      fields = [f.name for f in m.fields if f.type not in ['OID', 'Geometry'] and f.name not in skip]
+   ls = ['SHAPE@WKB'] + fields
+   if by is None:
+      fp = Fingerprint()
+      with arcpy.da.SearchCursor(inFeats, ls, where) as sc:
+         for row in countRows(sc):
+            fp.addRow(row)
+      return fp
+   if by not in ls:
+      ls.append(by)
+   ix = ls.index(by)
+   fps = {}
+   with arcpy.da.SearchCursor(inFeats, ls, where) as sc:
+      for row in countRows(sc):
+         fp = fps.get(row[ix])
+         if fp is None:
+            fp = fps[row[ix]] = Fingerprint()
+         fp.addRow(row)
+   return fps
+
+
+# Table in each species geodatabase, holding the fingerprint of the inputs of the last successful run of each stage
+manifestTab = 'sdm_manifest'
+manifestFields = [['stage', 'TEXT', 'stage', 50], ['run_key', 'TEXT', 'run_key', 255],
+                  ['fingerprint', 'TEXT', 'fingerprint', 64], ['outputs', 'TEXT', 'outputs', 2000],
+                  ['run_date', 'DATE', 'run_date', '']]
+
+
+def lastRun(gdb, stage, key):
+   """Gets the last successful run of a stage from the geodatabase's manifest table.
+   Returns a tuple: (fingerprint, list of output paths), or (None, []) if there is no run recorded."""
+   tab = gdb + os.sep + manifestTab
+   if not arcpy.Exists(tab):
+      return None, []
+   where = "stage = '" + stage + "' AND run_key = '" + key.replace("'", "''") + "'"
+   for row in arcpy.da.SearchCursor(tab, ['fingerprint', 'outputs'], where):
+      return row[0], [gdb + os.sep + a for a in row[1].split(';') if a]
+   return None, []
+
+
+def logRun(gdb, stage, key, fingerprint, outputs):
+   """Records a successful run of a stage (its input fingerprint and outputs) in the geodatabase's manifest table.
+   Outputs must be in the geodatabase; they are stored by name, so the geodatabase can be moved."""
+   tab = gdb + os.sep + manifestTab
+   if not arcpy.Exists(tab):
+      arcpy.CreateTable_management(gdb, manifestTab)
+      arcpy.AddFields_management(tab, manifestFields)
+   if isinstance(outputs, str):
+      outputs = [outputs]
+   row = [stage, key, fingerprint, ';'.join([os.path.basename(a) for a in outputs]), datetime.now()]
+   where = "stage = '" + stage + "' AND run_key = '" + key.replace("'", "''") + "'"
+   with arcpy.da.UpdateCursor(tab, [f[0] for f in manifestFields], where) as curs:
+      for r in curs:
+         curs.updateRow(row)
+         return
+   with arcpy.da.InsertCursor(tab, [f[0] for f in manifestFields]) as curs:
+      curs.insertRow(row)
+
+
+def unchangedRun(gdb, stage, key, fingerprint):
+   """Checks whether a stage can be skipped: its inputs have the same fingerprint as in the last successful run,
+   and that run's outputs still exist. Returns the list of outputs of that run, or None if the stage must be run."""
+   fp, outputs = lastRun(gdb, stage, key)
+   if fp == fingerprint and len(outputs) > 0 and all([arcpy.Exists(a) for a in outputs]):
+      return outputs
+   return None
+
+
+@traced
+def SpatialCluster(inFeats, sepDist, fldGrpID='grpID', method='BUFFER'):
    """Clusters features based on specified search distance. Features within twice the search distance of each other will be assigned to the same group.
    inFeats = The input features to group
    sepDist = The search distance to use for clustering.
-   fldGrpID = The desired name for the output grouping field. If not specified, it will be "grpID"."""
+   fldGrpID = The desired name for the output grouping field. If not specified, it will be "grpID".
+   method = 'BUFFER' (buffer/dissolve/spatial join) or 'INDEX' (in-memory, see SpatialClusterIndex)."""
+
+   if method == 'INDEX':
+      return SpatialClusterIndex(inFeats, sepDist, fldGrpID)
 
    # set sepDist
    sd0 = sepDist.split(" ")
@@ -270,8 +642,7 @@ def SpatialCluster(inFeats, sepDist, fldGrpID='grpID'):
    else:
       sepDist = str(int(sd0[0]) / 2)
 
-   # Initialize trash items list
-   trashList = []
+   scratch = getScratch()
    # Unique ID (OBJECT/FID)
    a = arcpy.Describe(inFeats).Fields
    for a1 in a:
@@ -286,28 +657,25 @@ def SpatialCluster(inFeats, sepDist, fldGrpID='grpID'):
       pass
 
    # Buffer input features
-   printMsg('Buffering input features')
-   outBuff = scratchGDB + os.sep + 'outBuff'
-   arcpy.Buffer_analysis(inFeats, outBuff, sepDist, '', '', 'ALL')
-   trashList.append(outBuff)
+   with step('Buffering input features'):
+      outBuff = scratch.path('outBuff', memory=True)
+      arcpy.Buffer_analysis(inFeats, outBuff, sepDist, '', '', 'ALL')
 
    # Explode multipart  buffers
-   printMsg('Exploding buffers')
-   explBuff = scratchGDB + os.sep + 'explBuff'
-   arcpy.MultipartToSinglepart_management(outBuff, explBuff)
-   trashList.append(explBuff)
+   with step('Exploding buffers'):
+      explBuff = scratch.path('explBuff', memory=True)
+      arcpy.MultipartToSinglepart_management(outBuff, explBuff)
 
    # Add and populate grpID field in buffers
-   printMsg('Populating grouping field in buffers')
-   arcpy.AddField_management(explBuff, fldGrpID, 'LONG')
-   # arcpy.CalculateField_management(explBuff, fldGrpID, '!OBJECTID!', 'PYTHON')
-   copyFld(explBuff, 'OBJECTID', fldGrpID)
+   with step('Populating grouping field in buffers'):
+      arcpy.AddField_management(explBuff, fldGrpID, 'LONG')
+      # arcpy.CalculateField_management(explBuff, fldGrpID, '!OBJECTID!', 'PYTHON')
+      copyFld(explBuff, 'OBJECTID', fldGrpID)
 
    # Spatial join buffers with input features
-   printMsg('Performing spatial join between buffers and input features')
-   joinFeats = scratchGDB + os.sep + 'joinFeats'
-   arcpy.SpatialJoin_analysis(inFeats, explBuff, joinFeats, 'JOIN_ONE_TO_ONE', 'KEEP_ALL', '', 'WITHIN')
-   trashList.append(joinFeats)
+   with step('Performing spatial join between buffers and input features'):
+      joinFeats = scratch.path('joinFeats', memory=True)
+      arcpy.SpatialJoin_analysis(inFeats, explBuff, joinFeats, 'JOIN_ONE_TO_ONE', 'KEEP_ALL', '', 'WITHIN')
 
    # Join grpID field to input features
    # This employs a custom function because arcpy is stupid slow at this
@@ -315,19 +683,535 @@ def SpatialCluster(inFeats, sepDist, fldGrpID='grpID'):
    # arcpy.JoinField_management(inFeats, fldID, joinFeats, 'TARGET_FID', [fldGrpID])
 
    # Cleanup: delete buffers, spatial join features
-   garbagePickup(trashList)
+   scratch.delete([outBuff, explBuff, joinFeats])
+
+   printMsg('Processing complete.')
+
+   return inFeats
+
+
+def geom2rings(geom):
+   """Converts an arcpy geometry to a list of rings/paths (lists of (x, y) tuples), from all parts."""
+   if geom is None or geom.pointCount == 0:
+      return []
+   if geom.hasCurves:
+      geom = geom.densify('ANGLE', geom.length, 0.0174533)  # 1-degree arcs
+   gi = geom.__geo_interface__
+   c = gi['coordinates']
+   if gi['type'] == 'Point':
+      return [[c]]
+   elif gi['type'] in ['MultiPoint', 'LineString']:
+      return [c]
+   elif gi['type'] in ['MultiLineString', 'Polygon']:
+      return list(c)
+   else:
+      # MultiPolygon
+      return [r for p in c for r in p]
+
+
+@traced
+def readPolys(inFeats, where=None):
+   """Reads polygon features into in-memory polygons (tbx_geom.Poly).
+   Returns a tuple: (list of OIDs, list of Poly objects; None for empty geometries)"""
+   import tbx_geom
+   oids, polys = [], []
+   with arcpy.da.SearchCursor(inFeats, ['OID@', 'SHAPE@'], where) as sc:
+      for oid, geom in countRows(sc):
+         oids.append(oid)
+         rings = geom2rings(geom)
+         polys.append(tbx_geom.Poly(rings) if rings else None)
+   return oids, polys
+
+
+@traced
+def SpatialClusterIndex(inFeats, sepDist, fldGrpID='grpID'):
+   """Clusters features based on specified search distance, in memory (the same groups as SpatialCluster).
+   inFeats = The input features to group
+   sepDist = The search distance to use for clustering.
+   fldGrpID = The desired name for the output grouping field. If not specified, it will be "grpID"."""
+   import tbx_geom
+   dist = parseDist(sepDist, arcpy.Describe(inFeats).spatialReference.metersPerUnit)
+
+   # Delete the GrpID field from the input features, if it already exists.
+   try:
+      arcpy.DeleteField_management(inFeats, fldGrpID)
+   except:
+      pass
+
+   printMsg('Reading input features')
+   oids, polys = readPolys(inFeats)
+   with step('Clustering features using spatial index'):
+      grp = dict(zip(oids, tbx_geom.clusterPolygons(polys, dist)))
+
+   with step('Populating grouping field'):
+      arcpy.AddField_management(inFeats, fldGrpID, 'LONG')
+      with arcpy.da.UpdateCursor(inFeats, ['OID@', fldGrpID]) as cursor:
+         for row in countRows(cursor, 'rows written'):
+            row[1] = grp.get(row[0])
+            cursor.updateRow(row)
 
    printMsg('Processing complete.')
 
    return inFeats
 
 
+def grpFieldName(fldGrpID, sepDist, metersPerUnit=1.0, workspace=None):
+   """Name of the group ID field for one separation distance in multi-distance grouping (see SpatialClusterMulti):
+   fldGrpID_<distance in meters>, e.g. sdm_grpid_500 for '500 Meters', sdm_grpid_2000 for '2 Kilometers', or
+   sdm_grpid_0_25 for '25 Centimeters'. The name is validated for the workspace."""
+   m = round(parseDist(sepDist, metersPerUnit) * (metersPerUnit or 1.0), 3)
+   if m == int(m):
+      dist = '%d' % m
+   else:
+      dist = ('%.3f' % m).rstrip('0').replace('.', '_')
+   return arcpy.ValidateFieldName(fldGrpID + '_' + dist, workspace)
+
+
+@traced
+def SpatialClusterMulti(inFeats, sepDists, fldGrpID='grpID'):
+   """Clusters features at several separation distances at once (e.g. for sensitivity analysis). Polygon distances
+   are measured once, up to the largest distance, and the groups for every distance come from the resulting
+   single-linkage hierarchy (tbx_geom.ClusterTree). Grouping at each distance is the same as SpatialClusterIndex's.
+   inFeats = The input features to group
+   sepDists = List of separation distances (e.g. ['500 Meters', '1 Kilometers', '2 Kilometers'])
+   fldGrpID = Group ID field. It gets the groups for the first distance, and a field for each distance is added (see
+      grpFieldName), all written in one pass.
+   Returns the list of group ID fields for the distances, in the order of sepDists."""
+   import tbx_geom
+   desc = arcpy.Describe(inFeats)
+   mpu = desc.spatialReference.metersPerUnit
+   flds = [grpFieldName(fldGrpID, d, mpu, os.path.dirname(desc.catalogPath)) for d in sepDists]
+   # one field per distance (distances given twice, e.g. in different units, are written once)
+   dists = dict([(f, parseDist(d, mpu)) for f, d in zip(flds, sepDists)])
+   for f in [fldGrpID] + list(dists):
+      try:
+         arcpy.DeleteField_management(inFeats, f)
+      except:
+         pass
+
+   printMsg('Reading input features')
+   oids, polys = readPolys(inFeats)
+   with step('Building cluster hierarchy up to ' + str(max(dists.values())) + ' units'):
+      tree = tbx_geom.ClusterTree.build(polys, max(dists.values()))
+   with step('Assigning groups for ' + str(len(dists)) + ' distances'):
+      grps = [dict(zip(oids, tree.groups(d))) for d in dists.values()]
+      for f, g in zip(dists, grps):
+         addCount('groups (' + f + ')', len(set(g.values()) - {None}))
+
+   with step('Populating grouping fields'):
+      arcpy.AddFields_management(inFeats, [[f, 'LONG'] for f in [fldGrpID] + list(dists)])
+      with arcpy.da.UpdateCursor(inFeats, ['OID@', fldGrpID] + list(dists)) as cursor:
+         for row in countRows(cursor, 'rows written'):
+            vals = [g.get(row[0]) for g in grps]
+            cursor.updateRow([row[0], vals[0]] + vals)
+
+   printMsg('Processing complete.')
+
+   return flds
+
+
+@traced
+def readFlowGraph(flowlines, flowID='NHDPlusID', orderFld='StreamOrde'):
+   """Reads flowlines into an in-memory network graph (tbx_network.FlowGraph), connected at shared end points.
+   Stream orders are read from orderFld, if the flowlines have it."""
+   import tbx_network
+   hasOrder = datasetMeta(flowlines).hasField(orderFld)
+   ids, lines, orders = [], [], []
+   with arcpy.da.SearchCursor(flowlines, [flowID, 'SHAPE@'] + ([orderFld] if hasOrder else [])) as sc:
+      for row in countRows(sc):
+         ln = [xy[:2] for path in geom2rings(row[1]) for xy in path]
+         if len(ln) > 1:
+            ids.append(row[0])
+            lines.append(ln)
+            orders.append(row[2] if hasOrder else None)
+   return tbx_network.FlowGraph.fromLines(ids, lines, orders=orders if hasOrder else None)
+
+
+flowGraphVersion = 1
+
+
+@traced
+def flowGraph(flowlines, flowID='NHDPlusID'):
+   """Returns the network graph for flowlines (tbx_network.FlowGraph), cached on disk (see datasetCache)."""
+   import tbx_network
+   return datasetCache(flowlines, 'graph_' + flowID.lower(), flowGraphVersion,
+                       lambda folder: readFlowGraph(flowlines, flowID).save(folder), tbx_network.FlowGraph.load,
+                       'flowline graph')
+
+
+def cacheFolder(dataset, kind):
+   """Folder for persistent caches built from a dataset (see DiskCache), e.g. indexes for an NHDPlus HR geodatabase.
+   Caches go in the folder named by the SDM_CACHE_DIR environment variable, or in an 'sdm_cache' folder next to the
+   dataset's geodatabase (or in the scratch folder, if that folder cannot be written to).
+   kind = type of cache (e.g. 'catchments'), used as a sub-folder name"""
+   p = os.path.normpath(str(dataset))
+   gdb = p
+   while gdb and not gdb.lower().endswith('.gdb') and os.path.dirname(gdb) != gdb:
+      gdb = os.path.dirname(gdb)
+   if not gdb.lower().endswith('.gdb'):
+      gdb = p
+   name = make_gdb_name(os.path.basename(p)) + '_' + hashlib.md5(p.lower().encode('utf-8')).hexdigest()[:8]
+   roots = [os.path.join(os.path.dirname(gdb), 'sdm_cache'), os.path.join(arcpy.env.scratchFolder, 'sdm_cache')]
+   if os.environ.get('SDM_CACHE_DIR'):
+      roots.insert(0, os.environ['SDM_CACHE_DIR'])
+   for root in roots:
+      folder = os.path.join(root, kind, name)
+      try:
+         os.makedirs(folder, exist_ok=True)
+         return folder
+      except OSError:
+         pass
+   raise OSError('Could not create a cache folder for ' + str(dataset) + '.')
+
+
+# Items built from datasets and opened in this process (see datasetCache): {(catalog path, kind): (stamp, item)}
+_datasetCaches = {}
+
+
+def datasetCache(inFeats, kind, version, write, load, label):
+   """Returns an item (e.g. an index) built from a dataset, cached on disk until the dataset's geodatabase changes
+   (see DiskCache). Items for datasets without a stamp are built in the scratch workspace, for this run only.
+   kind = type of item (cache sub-folder name)
+   version = item format version (items with another version are rebuilt)
+   write = function writing the item to a folder: write(folder)
+   load = function opening the item from a folder: load(folder)
+   label = description of the item for messages (e.g. 'catchment index')"""
+   meta = datasetMeta(inFeats)
+   src = meta.catalogPath
+   stamp = datasetStamp(src) if meta.dataType != 'FeatureLayer' else None
+   key = (src, kind)
+   if stamp is not None and key in _datasetCaches and _datasetCaches[key][0] == stamp:
+      return _datasetCaches[key][1]
+   folder = None
+   if stamp is not None:
+      cache = DiskCache(cacheFolder(src, kind), version)
+      folder = cache.get(stamp)
+   if folder is None:
+      with step('Building ' + label + ' for ' + meta.name + '...'):
+         if stamp is None:
+            folder = os.path.join(getScratch().folder(kind), uuid.uuid4().hex)
+            os.makedirs(folder)
+            write(folder)
+         else:
+            with cache.write(stamp) as tmp:
+               write(tmp)
+            folder = cache.get(stamp)
+   else:
+      addCount(label + ' reused')
+   item = load(folder)
+   if stamp is not None:
+      _datasetCaches[key] = (stamp, item)
+   return item
+
+
+catchmentIndexVersion = 2
+
+
+@traced
+def catchmentIndex(catchments, flowID='NHDPlusID'):
+   """Returns a spatial index over catchments (tbx_geom.PolyStore, with the flowline IDs as ids), cached on disk (see
+   datasetCache). Catchments with a null flowline ID are not indexed."""
+   import tbx_geom
+
+   def write(folder):
+      ids = []
+
+      def polys():
+         with arcpy.da.SearchCursor(catchments, [flowID, 'SHAPE@']) as sc:
+            for fid, geom in countRows(sc):
+               if fid is not None:
+                  ids.append(fid)
+                  yield geom2rings(geom)
+
+      tbx_geom.PolyStore.write(folder, ids, polys())
+
+   return datasetCache(catchments, 'catchments_' + flowID.lower(), catchmentIndexVersion, write, tbx_geom.PolyStore,
+                       'catchment index')
+
+
+flowlineIndexVersion = 1
+
+
+@traced
+def flowlineIndex(flowlines, flowID='NHDPlusID'):
+   """Returns an index from flowline IDs to flowline OIDs (tbx_network.KeyIndex), for reading only the flowlines with
+   given IDs (see presenceFlowlines). The index is built once for a flowline feature class and kept in a cache folder
+   until the feature class's geodatabase changes (see datasetCache)."""
+   import tbx_network
+
+   def write(folder):
+      ids, oids = [], []
+      with arcpy.da.SearchCursor(flowlines, [flowID, 'OID@']) as sc:
+         for fid, oid in countRows(sc):
+            if fid is not None:
+               ids.append(fid)
+               oids.append(oid)
+      tbx_network.KeyIndex.write(folder, ids, oids)
+
+   return datasetCache(flowlines, 'flowlines_' + flowID.lower(), flowlineIndexVersion, write, tbx_network.KeyIndex,
+                       'flowline index')
+
+
+@traced
+def presenceFlowlines(flowlines, occPts, outLines, flowFields, occFields, flowID='NHDPlusID', maxRows=1000):
+   """Writes the flowlines of reaches with occurrences, with the attributes of an occurrence on each reach (the first
+   by OID, as from a join). Flowlines are found with the flowline index (see flowlineIndex) and read by OID, and
+   occurrence attributes are joined in memory, so only the needed flowlines are read, in one pass.
+   flowlines = Flowlines, with the flowline ID field
+   occPts = Occurrences (e.g. points), with the flowline ID field
+   outLines = Output flowlines
+   flowFields, occFields = Flowline and occurrence fields to write (fields missing from the inputs are skipped). The
+      flowline ID is always written first.
+   maxRows = Maximum number of flowlines read per query
+   Returns outLines."""
+   occ = {}
+   occFlds = [f for f in arcpy.ListFields(occPts) if f.name in occFields and f.name.lower() != flowID.lower()]
+   occFlds.sort(key=lambda f: occFields.index(f.name))
+   with arcpy.da.SearchCursor(occPts, [flowID] + [f.name for f in occFlds]) as sc:
+      for row in countRows(sc):
+         if row[0] is not None and row[0] not in occ:
+            occ[row[0]] = row[1:]
+   meta = datasetMeta(flowlines)
+   flowFlds = [f for f in meta.fields if f.name.lower() == flowID.lower()]
+   flowFlds += [f for f in meta.fields if f.name in flowFields and f.name.lower() != flowID.lower() and
+                f.name not in [a.name for a in occFlds]]
+   flowFlds = flowFlds[:1] + sorted(flowFlds[1:], key=lambda f: flowFields.index(f.name))
+   d = arcpy.Describe(flowlines)
+   arcpy.CreateFeatureclass_management(os.path.dirname(outLines), os.path.basename(outLines), 'POLYLINE',
+                                       has_m='ENABLED' if getattr(d, 'hasM', False) else 'DISABLED',
+                                       has_z='ENABLED' if getattr(d, 'hasZ', False) else 'DISABLED',
+                                       spatial_reference=meta.spatialReference)
+   arcpy.AddFields_management(outLines, [fieldDef(f) for f in flowFlds + occFlds])
+   ids = sorted(occ)
+   oids = sorted([a for a in flowlineIndex(flowlines, flowID).lookup(ids).tolist() if a >= 0])
+   addCount('flowlines selected', len(oids))
+   with arcpy.da.InsertCursor(outLines, ['SHAPE@'] + [f.name for f in flowFlds + occFlds]) as ic:
+      for i in range(0, len(oids), maxRows):
+         with arcpy.da.SearchCursor(flowlines, ['SHAPE@'] + [f.name for f in flowFlds],
+                                    sqlValues(meta.oidField, oids[i:i + maxRows])) as sc:
+            for row in countRows(sc):
+               ic.insertRow(list(row) + list(occ.get(row[1], (None,) * len(occFlds))))
+         addCount('rows written', len(oids[i:i + maxRows]))
+   return outLines
+
+
+@traced
+def catchmentPoints(inFeats, catchments, outPts, flowID='NHDPlusID'):
+   """Converts point or line features to points with the flowline ID of the catchment they are in (see
+   catchmentIndex). Lines give the end points of their pieces in each catchment.
+   inFeats = Input points or lines
+   catchments = Catchment polygons, with the flowline ID field
+   outPts = Output points, with the input attributes and the flowline ID
+   Returns outPts."""
+   import numpy as np
+   import tbx_geom
+   idx = catchmentIndex(catchments, flowID)
+   d = arcpy.Describe(inFeats)
+   flds = [f for f in arcpy.ListFields(inFeats) if f.type not in ['OID', 'Geometry'] and f.editable and
+           f.name.lower() not in [flowID.lower(), weightFld.lower()]]
+   names = [f.name for f in flds]
+   pts, cats, attrs = [], [], []
+   with arcpy.da.SearchCursor(inFeats, ['SHAPE@'] + names) as sc:
+      for row in countRows(sc):
+         for path in geom2rings(row[0]):
+            path = np.asarray(path, dtype=float)[:, :2]
+            if d.shapeType == 'Polyline':
+               if len(path) < 2:
+                  continue
+               lo, hi = path.min(axis=0), path.max(axis=0)
+               cand = idx.query((lo[0], lo[1], hi[0], hi[1]))
+               for z, piece in tbx_geom.splitPath(path, [idx.poly(k) for k in cand.tolist()]):
+                  pts.extend([piece[0], piece[-1]])
+                  cats.extend([cand[z] if z >= 0 else -1] * 2)
+                  attrs.extend([row[1:]] * 2)
+            else:
+               pts.extend(path)
+               cats.extend([None] * len(path))
+               attrs.extend([row[1:]] * len(path))
+   pts = np.array(pts, dtype=float).reshape(-1, 2)
+   if d.shapeType != 'Polyline':
+      cats = idx.locate(pts)
+   ids = [idx.ids[k].item() if k >= 0 else None for k in np.asarray(cats, dtype=np.int64).tolist()]
+   flowFld = [f for f in arcpy.ListFields(catchments) if f.name.lower() == flowID.lower()][0]
+   arcpy.CreateFeatureclass_management(os.path.dirname(outPts), os.path.basename(outPts), 'POINT',
+                                       spatial_reference=d.spatialReference)
+   arcpy.AddFields_management(outPts, [fieldDef(f) for f in flds] + [fieldDef(flowFld, flowID)])
+   with arcpy.da.InsertCursor(outPts, ['SHAPE@XY'] + names + [flowID]) as ic:
+      for xy, a, fid in zip(pts.tolist(), attrs, ids):
+         ic.insertRow([tuple(xy)] + list(a) + [fid])
+   addCount('rows written', len(ids))
+   return outPts
+
+
+def capPoints(edge, offset, maxGap, cuts=None):
+   """Selects the points of one polygon-catchment piece needed for network grouping: on each stretch of an edge
+   between dams, the end points and points at most maxGap apart. If no point snaps to a flowline, the first is kept.
+   edge, offset = arrays of snapped edge (-1 if not snapped) and offset along the edge, for each point
+   cuts = Optional dictionary of {edge: sorted array of dam offsets}
+   Returns a sorted array of indices into the points, and an array of the number of snapped points each kept point
+   stands for (itself and the dropped points after it on its stretch, which are in the same group)."""
+   import numpy as np
+   ok = np.nonzero(edge >= 0)[0]
+   if len(ok) == 0:
+      return np.array([0]), np.array([len(edge)])
+   part = np.zeros(len(ok), dtype=np.int64)
+   if cuts:
+      for e in np.unique(edge[ok]).tolist():
+         if e in cuts:
+            s = edge[ok] == e
+            part[s] = np.searchsorted(cuts[e], offset[ok][s])
+   order = np.lexsort((offset[ok], part, edge[ok]))
+   ok, part = ok[order], part[order]
+   e, m = edge[ok], offset[ok]
+   first = np.ones(len(ok), dtype=bool)
+   first[1:] = (e[1:] != e[:-1]) | (part[1:] != part[:-1])
+   starts = np.nonzero(first)[0].tolist()
+   pos, weight = [], []
+   for i0, i1 in zip(starts, starts[1:] + [len(ok)]):
+      j = i0
+      kept = [j]
+      while j < i1 - 1:
+         # furthest point within maxGap of the last kept point (or the next point, if none)
+         j = max(i0 + int(np.searchsorted(m[i0:i1], m[j] + maxGap, side='right')) - 1, j + 1)
+         kept.append(j)
+      pos = pos + kept
+      weight = weight + np.diff(kept + [i1]).tolist()
+   keep = ok[np.array(pos)]
+   order = np.argsort(keep)
+   return keep[order], np.array(weight)[order]
+
+
+@traced
+def polySnapPoints(inPolys, catchments, flowlines, outPts, spacing, snapDist, maxGap=None, dams=None,
+                   flowID='NHDPlusID', weightFld='sample_pts'):
+   """Generates points inside polygons on a grid, at least one per polygon-catchment piece, to use as network
+   facilities. If maxGap is given, only the points which can change groups are kept (see capPoints).
+   inPolys = Input polygons
+   catchments = Catchment polygons, with the flowline ID field
+   flowlines = Flowlines, with the flowline ID field
+   outPts = Output points, with the polygon attributes and the flowline ID (null for points not in a catchment)
+   spacing, snapDist = Grid spacing and snap distance, in coordinate system units
+   maxGap = Service area distance of the points, in coordinate system units (None to keep all points)
+   dams = Optional dam points, which cut flowlines in network grouping
+   weightFld = Field for the number of sampled points each point stands for
+   Returns outPts."""
+   import numpy as np
+   import tbx_geom
+   sr = arcpy.Describe(inPolys).spatialReference
+   flds = [f for f in arcpy.ListFields(inPolys) if f.type not in ['OID', 'Geometry'] and f.editable and
+           f.name.lower() not in [flowID.lower(), weightFld.lower()]]
+   names = [f.name for f in flds]
+   polys, attrs = [], []
+   with arcpy.da.SearchCursor(inPolys, ['SHAPE@'] + names) as sc:
+      for row in countRows(sc):
+         rings = geom2rings(row[0])
+         if rings:
+            polys.append(tbx_geom.Poly(rings))
+            attrs.append(row[1:])
+   idx = catchmentIndex(catchments, flowID)
+
+   with step('Sampling points in ' + str(len(polys)) + ' polygons...'):
+      pieces = []  # [polygon index, flowline ID, points, weights]
+      for i, p in enumerate(polys):
+         cand = idx.query(p.bbox)
+         pts, zone = tbx_geom.samplePolygon(p, spacing, [idx.poly(k) for k in cand.tolist()])
+         for z in np.unique(zone).tolist():
+            s = zone == z
+            pieces.append([i, idx.ids[cand[z]].item() if z >= 0 else None, pts[s], np.ones(int(s.sum()), dtype=int)])
+      nAll = sum([len(a[2]) for a in pieces])
+      addCount('points sampled', nAll)
+
+   if maxGap is not None:
+      with step('Keeping points at most ' + str(maxGap) + ' apart along flowlines...'):
+         big = [a for a in pieces if len(a[2]) > 2]
+         graph = flowGraph(flowlines, flowID)
+         cuts = {}
+         if dams:
+            dxy = [row[0] for row in countRows(arcpy.da.SearchCursor(dams, ['SHAPE@XY']))]
+            # as in networkGroupsGraph
+            for e, m in zip(*[a.tolist() for a in graph.snap(dxy, 2.1)]):
+               if e >= 0:
+                  cuts.setdefault(e, []).append(m)
+            cuts = dict([(e, np.sort(m)) for e, m in cuts.items()])
+         if big:
+            edge, offset = graph.snap(np.vstack([a[2] for a in big]), snapDist)
+            k = 0
+            for a in big:
+               n = len(a[2])
+               keep, a[3] = capPoints(edge[k:k + n], offset[k:k + n], maxGap, cuts)
+               a[2] = a[2][keep]
+               k += n
+      printMsg('Kept ' + str(sum([len(a[2]) for a in pieces])) + ' of ' + str(nAll) + ' sampled points.')
+
+   flowFld = [f for f in arcpy.ListFields(catchments) if f.name.lower() == flowID.lower()][0]
+   arcpy.CreateFeatureclass_management(os.path.dirname(outPts), os.path.basename(outPts), 'POINT',
+                                       spatial_reference=sr)
+   arcpy.AddFields_management(outPts, [fieldDef(f) for f in flds] + [fieldDef(flowFld, flowID), [weightFld, 'LONG']])
+   with arcpy.da.InsertCursor(outPts, ['SHAPE@XY'] + names + [flowID, weightFld]) as ic:
+      for i, fid, pts, w in pieces:
+         for xy, n in zip(pts.tolist(), w.tolist()):
+            ic.insertRow([tuple(xy)] + list(attrs[i]) + [fid, n])
+         addCount('rows written', len(pts))
+   return outPts
+
+
+def polyGroups(pts, fldID, group_id, weightFld='sample_pts'):
+   """Group of each polygon from its network points: the group with the most sampled points (weightFld, see
+   polySnapPoints; 1 where null), or the lowest group ID if tied. Used in SpatialClusterNetwork.
+   Returns a tuple: (dictionary of {polygon ID: group}, list of polygon IDs with points in more than one group)."""
+   counts = {}
+   flds = [fldID, group_id]
+   if weightFld in [f.name for f in arcpy.ListFields(pts)]:
+      flds.append(weightFld)
+   for row in countRows(arcpy.da.SearchCursor(pts, flds)):
+      c = counts.setdefault(row[0], {})
+      c[row[1]] = c.get(row[1], 0) + (row[2] if len(row) > 2 and row[2] is not None else 1)
+   grps = dict([(i, min(c, key=lambda g: (-c[g], g))) for i, c in counts.items()])
+   return grps, sorted([i for i, c in counts.items() if len(c) > 1])
+
+
+@traced
+def networkGroupsGraph(species_pt, flowlines, dams, maxDist, snap_dist, group_id):
+   """Assigns network groups to points using the flowline graph, instead of Network Analyst service areas.
+   Points not snapped to a flowline are deleted. Used in SpatialClusterNetwork. Returns the maximum group ID."""
+   import tbx_network
+   graph = flowGraph(flowlines)
+   oids, xy = [], []
+   for row in countRows(arcpy.da.SearchCursor(species_pt, ['OID@', 'SHAPE@XY'])):
+      oids.append(row[0])
+      xy.append(row[1])
+   with stage('snap'):
+      occEdge, occOffset = graph.snap(xy, snap_dist)
+      cutEdge = cutOffset = None
+      if dams:
+         dxy = [row[0] for row in countRows(arcpy.da.SearchCursor(dams, ['SHAPE@XY']))]
+         # dams within the distance used to split service area buffers (1 meter + 1.1 meters)
+         cutEdge, cutOffset = graph.snap(dxy, 2.1)
+   with stage('networkClusters'):
+      grp = tbx_network.networkClusters(graph, occEdge, occOffset, maxDist, cutEdge, cutOffset)
+   grp = dict(zip(oids, grp))
+   if group_id not in [a.name for a in arcpy.ListFields(species_pt)]:
+      arcpy.AddField_management(species_pt, group_id, "LONG")
+   # delete null groups to get rid of observations that were beyond snap_dist
+   with arcpy.da.UpdateCursor(species_pt, ['OID@', group_id]) as cursor:
+      for row in countRows(cursor, 'rows written'):
+         if grp[row[0]] is None:
+            cursor.deleteRow()
+         else:
+            row[1] = grp[row[0]]
+            cursor.updateRow(row)
+   return max([g for g in grp.values() if g is not None] + [0])
+
+
+@traced
 def SpatialClusterNetwork(species_pt, species_ln, species_py, flowlines, catchments, network, dams, sep_dist, snap_dist,
-                          output_lines):
+                          output_lines, method='NA'):
    """Clusters features based on specified search distance across a linear network dataset.
    Features within the search distance of each other will be assigned to the same group.
    :param species_pt, species_ln, species_py = The input features to group
    :param sepDist = The distance with which to group features
+   :param method = 'NA' (Network Analyst service areas) or 'GRAPH' (in-memory flowline graph, see networkGroupsGraph;
+      does not require the Network Analyst extension)
    Adapted from script by Molly Moore, PANHP
 
    # internal spatial clustering function over network dataset
@@ -338,232 +1222,566 @@ def SpatialClusterNetwork(species_pt, species_ln, species_py, flowlines, catchme
    # output_lines = "testlines"
    #
 
-   # env and extensions
-   arcpy.env.workspace = scratchGDB
-   arcpy.CheckOutExtension("Network")
+   # env and extensions (intermediate datasets are in the run's scratch workspace, and environment settings are
+   # restored when done)
+   scratch = getScratch()
+   qualified = arcpy.env.qualifiedFieldNames
    arcpy.env.qualifiedFieldNames = False
+   try:
+      # create empty list to store converted point layers for future merge
+      species_lyrs = []
+
+      with step('Generating points to use in network analysis...'):
+         # This process also attributes points with flowline IDs (NHDPlusID in NHDPlusHR),
+         #  using catchments (NOT nearest flowline).
+         if species_pt:
+            pts = catchmentPoints(species_pt, catchments, scratch.path('ptcats'))
+            species_lyrs.append(pts)
+
+         # convert lines to by-catchment endpoint vertices
+         if species_ln:
+            lns = catchmentPoints(species_ln, catchments, scratch.path('lns'))
+            species_lyrs.append(lns)
+
+         # convert polygons to by-catchment sample points, one per block of area snap-distance squared (default would
+         # be 10,000 sq. meters), keeping only those which can change groups: points along a flowline closer than the
+         # service area distance (see sep_dist below) are covered by their neighbours
+         if species_py:
+            pys = polySnapPoints(species_py, catchments, flowlines, scratch.path('polys'),
+                                 float(snap_dist), float(snap_dist), max(int(sep_dist) / 2 - 2, 0), dams)
+            species_lyrs.append(pys)
+
+         # merge the point layers together
+         species_pt = arcpy.Merge_management(species_lyrs, scratch.path('species_pt')).getOutput(0)
+
+      # calculate separation distance to be used in tools. use half of original minus
+      # 1 to account for 1 meter buffer and overlapping buffers
+      sep_dist = int(sep_dist)
+      sep_dist = (sep_dist / 2) - 2
+
+      # create temporary unique id for use in join field later
+      i = 1
+      fieldnames = [field.name for field in arcpy.ListFields(species_pt)]
+      if 'temp_join_id' not in fieldnames:
+         arcpy.AddField_management(species_pt, "temp_join_id", "LONG")
+         with arcpy.da.UpdateCursor(species_pt, "temp_join_id") as cursor:
+            for row in countRows(cursor, 'rows written'):
+               row[0] = i
+               cursor.updateRow(row)
+               i += 1
 
-   # create empty list to store converted point layers for future merge
-   species_lyrs = []
-
-   arcpy.AddMessage('Generating points to use in network analysis...')
-   # This process also attributes points with flowline IDs (NHDPlusID in NHDPlusHR),
-   #  using catchments (NOT nearest flowline).
-   if species_pt:
-      arcpy.MultipartToSinglepart_management(species_pt, "pts0")
-      pts = arcpy.Identity_analysis('pts0', catchments, 'ptcats', "NO_FID")
-      species_lyrs.append(pts)
-
-   # convert lines to by-catchment endpoint vertices
-   if species_ln:
-      arcpy.Identity_analysis(species_ln, catchments, 'lincats', "NO_FID")
-      lns = arcpy.FeatureVerticesToPoints_management('lincats', "lns", "BOTH_ENDS")
-      species_lyrs.append(lns)
-
-   # convert polygons to by-catchment, subdivided-polygon centroids
-   if species_py:
-      arcpy.Identity_analysis(species_py, catchments, 'polycats', "NO_FID")
-      # Target area size calculated as square of snap-distance (default would be 10,000 sq. meters)
-      arcpy.SubdividePolygon_management("polycats", "polycats_subd", "EQUAL_AREAS",
-                                        target_area=float(snap_dist)**2, subdivision_type="STACKED_BLOCKS")
-      pys = arcpy.FeatureToPoint_management('polycats_subd', 'polys', "INSIDE")
-      # pys = arcpy.FeatureVerticesToPoints_management(species_py, "polys", "ALL")
-      species_lyrs.append(pys)
-
-   # merge the point layers together
-   species_pt = arcpy.Merge_management(species_lyrs, "species_pt")
-
-   # calculate separation distance to be used in tools. use half of original minus
-   # 1 to account for 1 meter buffer and overlapping buffers
-   sep_dist = int(sep_dist)
-   sep_dist = (sep_dist / 2) - 2
-
-   # create temporary unique id for use in join field later
-   i = 1
-   fieldnames = [field.name for field in arcpy.ListFields(species_pt)]
-   if 'temp_join_id' not in fieldnames:
-      arcpy.AddField_management(species_pt, "temp_join_id", "LONG")
-      with arcpy.da.UpdateCursor(species_pt, "temp_join_id") as cursor:
-         for row in cursor:
-            row[0] = i
-            cursor.updateRow(row)
-            i += 1
-
-   # delete identical points
-   arcpy.DeleteIdentical_management(species_pt, "Shape")
-
-   arcpy.AddMessage("Creating service area line layer...")
-   pyvers = sys.version_info.major
-   if pyvers < 3:
-      # create service area line layer for ArcMap
-      service_area_lyr = arcpy.na.MakeServiceAreaLayer(network, "service_area_lyr", "Length", "TRAVEL_FROM", sep_dist,
-                                                       polygon_type="NO_POLYS", line_type="TRUE_LINES",
-                                                       overlap="OVERLAP", restriction_attribute_name="#")
-      # Note: Restriction attribute name = "#" is necessary for networks with standard restrictions in place.
-   else:
-      # ArcGIS Pro: old MakeServiceAreaLayer call would work, but is deprecated, see:
-      # (https://pro.arcgis.com/en/pro-app/tool-reference/network-analyst/make-service-area-layer.htm)
-      tm = arcpy.na.TravelMode(arcpy.na.GetTravelModes(network)["Standard"])
-      tm.name = "noRestrict"
-      # Note: This removes all travel restrictions along network
-      tm.restrictions = []
-      service_area_lyr = arcpy.na.MakeServiceAreaAnalysisLayer(network, "service_area_lyr", tm, "FROM_FACILITIES",
-                                                               sep_dist, output_type="LINES",
-                                                               geometry_at_overlaps="OVERLAP")
-   service_area_lyr = service_area_lyr.getOutput(0)
-   subLayerNames = arcpy.na.GetNAClassNames(service_area_lyr)
-   facilitiesLayerName = subLayerNames["Facilities"]
-   serviceLayerName = subLayerNames["SALines"]
-   arcpy.na.AddLocations(service_area_lyr, facilitiesLayerName, species_pt, "", snap_dist)
-   arcpy.na.Solve(service_area_lyr, "SKIP")
-   if pyvers < 3:
-      lines = arcpy.mapping.ListLayers(service_area_lyr, serviceLayerName)[0]
-   else:
-      lines = service_area_lyr.listLayers(serviceLayerName)[0]
-   flowline_clip = arcpy.CopyFeatures_management(lines, "service_area")
-
-   arcpy.AddMessage("Buffering service area flowlines...")
-   # buffer clipped service area flowlines by 1 meter, dissolved all
-   flowline_buff = arcpy.Buffer_analysis(flowline_clip, "flowline_buff", "1 Meter", "FULL", "ROUND", "ALL")
-
-   # separate buffered flowlines at dams
-   if dams:
-      arcpy.AddMessage("Splitting service areas at dam locations...")
-      # buffer dams by 1.1 meters
-      dams0 = arcpy.MakeFeatureLayer_management(dams)
-      arcpy.SelectLayerByLocation_management(dams0, "INTERSECT", flowline_buff)
-      if int(arcpy.GetCount_management(dams0)[0]) > 0:
-         dam_buff = arcpy.Buffer_analysis(dams0, "dam_buff", "1.1 Meter", "FULL", "FLAT")
-         # split flowline buffers at dam buffers by erasing area of dam
-         flowline_erase = arcpy.Erase_analysis(flowline_buff, dam_buff, "flowline_erase")
-         multipart_input = flowline_erase
-      else:
-         multipart_input = flowline_buff
-   else:
-      multipart_input = flowline_buff
-
-   # multi-part to single part to create unique polygons
-   single_part = arcpy.MultipartToSinglepart_management(multipart_input, "single_part")
-
-   # create unique group id
-   group_id = fldGrpID.Name  # unique to this toolbox
-   if group_id not in [a.name for a in arcpy.ListFields(single_part)]:
-      arcpy.AddField_management(single_part, group_id, "LONG")
-   num = 1
-   with arcpy.da.UpdateCursor(single_part, group_id) as cursor:
-      for row in cursor:
-         row[0] = num
-         cursor.updateRow(row)
-         num += 1
-
-   # join group id of buffered flowlines to closest points
-   s_join = arcpy.SpatialJoin_analysis(target_features=species_pt, join_features=single_part,
-                                       out_feature_class="s_join", join_operation="JOIN_ONE_TO_ONE",
-                                       join_type="KEEP_ALL", match_option="CLOSEST", search_radius=snap_dist,
-                                       distance_field_name="")
-   # join field to original dataset
-   # join_field = [field.name for field in arcpy.ListFields(s_join)]
-   # join_field = join_field[-1]
-   arcpy.JoinField_management(species_pt, "temp_join_id", s_join, "temp_join_id", group_id)
-
-   # delete null groups to get rid of observations that were beyond snap_dist
-   with arcpy.da.UpdateCursor(species_pt, group_id) as cursor:
-      for row in cursor:
-         if row[0] is None:
-            cursor.deleteRow()
+      # delete identical points
+      arcpy.DeleteIdentical_management(species_pt, "Shape")
 
-   arcpy.AddMessage("Joining flowline ID...")
-   flow_ID = 'NHDPlusID'   # previously COMID
-   sp_join = arcpy.CopyFeatures_management(species_pt, 'sp_join')
-   sp_join = arcpy.DeleteIdentical_management(sp_join, [group_id, flow_ID])
-
-   # OLD METHOD: join species_pt layer with catchments to assign COMID
-   # sp_join = arcpy.SpatialJoin_analysis(species_pt, catchments, "sp_join", "JOIN_ONE_TO_ONE", "KEEP_COMMON", "",
-   #                                      "INTERSECT")
-   # Below not used: NHDPlusID is only ID needed in NHDPlusHR
-   # if len(arcpy.ListFields(sp_join, "COMID")) == 0:
-   #    arcpy.AddField_management(sp_join, "COMID", "LONG")
-   #    with arcpy.da.UpdateCursor(sp_join, ["FEATUREID", "COMID"]) as cursor:
-   #       for row in cursor:
-   #          row[1] = str(row[0])
-   #          cursor.updateRow(row)
-
-   # obtain list of duplicate COMID because these can be reaches assigned to multiple groups
-   freq = arcpy.Frequency_analysis(sp_join, "freq", flow_ID)
-   dup_comid = []
-   with arcpy.da.SearchCursor(freq, ["FREQUENCY", flow_ID]) as cursor:
-      for row in cursor:
-         if row[0] > 1:
-            dup_comid.append(row[1])
-
-   # get all groups within duplicate reaches and assign them to a single group
-   sp_join_lyr = arcpy.MakeFeatureLayer_management(sp_join, "sp_join_lyr")
-   if dup_comid:
-      arcpy.AddMessage("Resolving same reaches assigned to different groups")
-      for dup in dup_comid:
-         arcpy.SelectLayerByAttribute_management(sp_join_lyr, "NEW_SELECTION", flow_ID + " = {0}".format(dup))
-         combine_groups = []
-         with arcpy.da.SearchCursor(sp_join_lyr, [group_id]) as cursor:
-            for row in cursor:
-               combine_groups.append(row[0])
-         arcpy.SelectLayerByAttribute_management(sp_join_lyr, "NEW_SELECTION", fldGrpID.Name + " IN ({0})".format(
-            ','.join(str(x) for x in combine_groups)))
-         with arcpy.da.UpdateCursor(sp_join_lyr, [group_id]) as cursor:
-            for row in cursor:
+      group_id = fldGrpID.Name  # unique to this toolbox
+      if method == 'GRAPH':
+         # service areas of sep_dist from each point, buffered by 1 meter, meet at a network distance of
+         # (2 * sep_dist) + 2 between points
+         printMsg("Grouping points along flowline network...")
+         num = networkGroupsGraph(species_pt, flowlines, dams, (2 * sep_dist) + 2, float(snap_dist), group_id) + 1
+      else:
+         checkOutExtension("Network")
+         arcpy.AddMessage("Creating service area line layer...")
+         pyvers = sys.version_info.major
+         if pyvers < 3:
+            # create service area line layer for ArcMap
+            service_area_lyr = arcpy.na.MakeServiceAreaLayer(network, "service_area_lyr", "Length", "TRAVEL_FROM",
+                                                             sep_dist, polygon_type="NO_POLYS", line_type="TRUE_LINES",
+                                                             overlap="OVERLAP", restriction_attribute_name="#")
+            # Note: Restriction attribute name = "#" is necessary for networks with standard restrictions in place.
+         else:
+            # ArcGIS Pro: old MakeServiceAreaLayer call would work, but is deprecated, see:
+            # (https://pro.arcgis.com/en/pro-app/tool-reference/network-analyst/make-service-area-layer.htm)
+            tm = arcpy.na.TravelMode(arcpy.na.GetTravelModes(network)["Standard"])
+            tm.name = "noRestrict"
+            # Note: This removes all travel restrictions along network
+            tm.restrictions = []
+            service_area_lyr = arcpy.na.MakeServiceAreaAnalysisLayer(network, "service_area_lyr", tm, "FROM_FACILITIES",
+                                                                     sep_dist, output_type="LINES",
+                                                                     geometry_at_overlaps="OVERLAP")
+         service_area_lyr = service_area_lyr.getOutput(0)
+         subLayerNames = arcpy.na.GetNAClassNames(service_area_lyr)
+         facilitiesLayerName = subLayerNames["Facilities"]
+         serviceLayerName = subLayerNames["SALines"]
+         with step("Solving service areas..."):
+            arcpy.na.AddLocations(service_area_lyr, facilitiesLayerName, species_pt, "", snap_dist)
+            arcpy.na.Solve(service_area_lyr, "SKIP")
+         if pyvers < 3:
+            lines = arcpy.mapping.ListLayers(service_area_lyr, serviceLayerName)[0]
+         else:
+            lines = service_area_lyr.listLayers(serviceLayerName)[0]
+         flowline_clip = arcpy.CopyFeatures_management(lines, scratch.path('service_area'))
+
+         with step("Buffering service area flowlines..."):
+            # buffer clipped service area flowlines by 1 meter, dissolved all
+            flowline_buff = arcpy.Buffer_analysis(flowline_clip, scratch.path('flowline_buff'), "1 Meter", "FULL",
+                                                  "ROUND", "ALL")
+
+         # separate buffered flowlines at dams
+         if dams:
+            arcpy.AddMessage("Splitting service areas at dam locations...")
+            # buffer dams by 1.1 meters
+            dams0 = arcpy.MakeFeatureLayer_management(dams)
+            arcpy.SelectLayerByLocation_management(dams0, "INTERSECT", flowline_buff)
+            if int(arcpy.GetCount_management(dams0)[0]) > 0:
+               dam_buff = arcpy.Buffer_analysis(dams0, scratch.path('dam_buff'), "1.1 Meter", "FULL", "FLAT")
+               # split flowline buffers at dam buffers by erasing area of dam
+               flowline_erase = arcpy.Erase_analysis(flowline_buff, dam_buff, scratch.path('flowline_erase'))
+               multipart_input = flowline_erase
+            else:
+               multipart_input = flowline_buff
+         else:
+            multipart_input = flowline_buff
+
+         # multi-part to single part to create unique polygons
+         single_part = arcpy.MultipartToSinglepart_management(multipart_input, scratch.path('single_part'))
+
+         # create unique group id
+         if group_id not in [a.name for a in arcpy.ListFields(single_part)]:
+            arcpy.AddField_management(single_part, group_id, "LONG")
+         num = 1
+         with arcpy.da.UpdateCursor(single_part, group_id) as cursor:
+            for row in countRows(cursor, 'rows written'):
                row[0] = num
                cursor.updateRow(row)
-         num += 1
-
-   # clear selection on layer
-   arcpy.SelectLayerByAttribute_management(sp_join_lyr, "CLEAR_SELECTION")
+               num += 1
+
+         # join group id of buffered flowlines to closest points
+         with stage('SpatialJoin'):
+            s_join = arcpy.SpatialJoin_analysis(target_features=species_pt, join_features=single_part,
+                                                out_feature_class=scratch.path('s_join'),
+                                                join_operation="JOIN_ONE_TO_ONE", join_type="KEEP_ALL",
+                                                match_option="CLOSEST", search_radius=snap_dist,
+                                                distance_field_name="")
+         # join field to original dataset
+         # join_field = [field.name for field in arcpy.ListFields(s_join)]
+         # join_field = join_field[-1]
+         JoinFields(species_pt, "temp_join_id", s_join, "temp_join_id", [group_id])
+
+         # delete null groups to get rid of observations that were beyond snap_dist
+         with arcpy.da.UpdateCursor(species_pt, group_id) as cursor:
+            for row in cursor:
+               if row[0] is None:
+                  cursor.deleteRow()
+
+      arcpy.AddMessage("Joining flowline ID...")
+      flow_ID = 'NHDPlusID'   # previously COMID
+      sp_join = arcpy.CopyFeatures_management(species_pt, scratch.path('sp_join'))
+      sp_join = arcpy.DeleteIdentical_management(sp_join, [group_id, flow_ID])
+
+      # OLD METHOD: join species_pt layer with catchments to assign COMID
+      # sp_join = arcpy.SpatialJoin_analysis(species_pt, catchments, "sp_join", "JOIN_ONE_TO_ONE", "KEEP_COMMON", "",
+      #                                      "INTERSECT")
+      # Below not used: NHDPlusID is only ID needed in NHDPlusHR
+      # if len(arcpy.ListFields(sp_join, "COMID")) == 0:
+      #    arcpy.AddField_management(sp_join, "COMID", "LONG")
+      #    with arcpy.da.UpdateCursor(sp_join, ["FEATUREID", "COMID"]) as cursor:
+      #       for row in cursor:
+      #          row[1] = str(row[0])
+      #          cursor.updateRow(row)
+
+      # get all groups within duplicate reaches (these can be reaches assigned to multiple groups) and assign them to
+      # a single group
+      t0 = time.time()
+      rows = [row for row in countRows(arcpy.da.SearchCursor(sp_join, [group_id, flow_ID]))]
+      newIDs, num = mergeGroups([r[0] for r in rows], [r[1] for r in rows], num)
+      if newIDs:
+         arcpy.AddMessage("Resolving same reaches assigned to different groups")
+         for fc in [sp_join, species_pt]:
+            with arcpy.da.UpdateCursor(fc, [group_id]) as cursor:
+               for row in countRows(cursor):
+                  if row[0] in newIDs:
+                     row[0] = newIDs[row[0]]
+                     cursor.updateRow(row)
+         printMsg('Merged ' + str(len(newIDs)) + ' groups sharing reaches into ' + str(len(set(newIDs.values()))) +
+                  ' groups (' + str(round(time.time() - t0, 1)) + ' seconds).')
+
+      # export presence flowlines, with the attributes of an occurrence on each reach
+      # NOTE: These are NHDPlusHR attributes
+      with stage('export flowlines'):
+         presenceFlowlines(flowlines, sp_join, output_lines, ['StreamOrde', 'Permanent_Identifier'], initDissList,
+                           flow_ID)
+
+      # append group IDs to original datasets
+      if species_py:
+         # species_pt = arcpy.DeleteIdentical_management(species_pt, [fldFeatID.Name, group_id])
+         # JoinFields(species_py, fldFeatID.Name, species_pt, fldFeatID.Name, [fldGrpID.Name])
+         # counted with the sampled points each polygon point stands for, so dropping points does not change groups
+         grps, u2 = polyGroups(species_pt, fldFeatID.Name, fldGrpID.Name)
+         if len(u2) > 0:
+            printMsg('One or more features cover multiple occurrence groups (' + fldFeatID.Name + ' in [' +
+                     ','.join([str(a) for a in u2]) + ']). The most common group ID among feature input points will '
+                     'be assigned to the polygon(s).')
+         if fldGrpID.Name not in [f.name for f in arcpy.ListFields(species_py)]:
+            f = [f for f in arcpy.ListFields(species_pt) if f.name == fldGrpID.Name][0]
+            arcpy.AddFields_management(species_py, [fieldDef(f)])
+         with arcpy.da.UpdateCursor(species_py, [fldFeatID.Name, fldGrpID.Name]) as cursor:
+            for row in countRows(cursor, 'rows written'):
+               row[1] = grps.get(row[0])
+               cursor.updateRow(row)
+   finally:
+      arcpy.env.qualifiedFieldNames = qualified
 
-   # get list of COMID values for export of flowlines
-   with arcpy.da.SearchCursor(sp_join_lyr, flow_ID) as cursor:
-      comid = sorted({row[0] for row in cursor})
-   comid = list(set(comid))
+   return species_py
 
-   # join attributes to flowlines
-   expression = flow_ID + ' IN ({0})'.format(','.join(str(x) for x in comid))
-   flowlines_lyr = arcpy.MakeFeatureLayer_management(flowlines, "flowlines_lyr", expression)
-   arcpy.AddJoin_management(flowlines_lyr, flow_ID, sp_join, flow_ID)
 
-   arcpy.env.qualifiedFieldNames = False
+eraseIndexVersion = 1
 
-   # export presence flowlines
-   flowlines_lyr = arcpy.CopyFeatures_management(flowlines_lyr, "flowlines_lyr")
-   # reduce fields
-   # myfields = ['COMID', 'FEATUREID', 'SOURCEFC'] + initDissList
-   # NOTE: These are NHDPlusHR attributes
-   myfields = [flow_ID, 'StreamOrde', 'Permanent_Identifier'] + initDissList
-   # create an empty field mapping object
-   mapS = arcpy.FieldMappings()
-   # for each field, create an individual field map, and add it to the field mapping object
-   for field in myfields:
-      try:
-         map = arcpy.FieldMap()
-         map.addInputField(flowlines_lyr, field)
-         mapS.addFieldMap(map)
-      except:
-         next
-   arcpy.FeatureClassToFeatureClass_conversion(flowlines_lyr, os.path.dirname(output_lines),
-                                               os.path.basename(output_lines), "#", mapS)
-   # append group IDs to original datasets
-   if species_py:
-      # species_pt = arcpy.DeleteIdentical_management(species_pt, [fldFeatID.Name, group_id])
-      # JoinFields(species_py, fldFeatID.Name, species_pt, fldFeatID.Name, [fldGrpID.Name])
-      arcpy.Statistics_analysis(species_pt, 'pt_join_py', [[fldGrpID.Name, 'COUNT']], [fldFeatID.Name, fldGrpID.Name])
-      u = [a[0] for a in arcpy.da.SearchCursor('pt_join_py', fldFeatID.Name)]
-      u2 = [str(a) for a in list(set(u)) if u.count(a) > 1]
-      if len(u2) > 0:
-         arcpy.Sort_management('pt_join_py', 'pt_join_py2', [['COUNT_' + fldGrpID.Name, 'Ascending']])
-         printMsg('One or more features cover multiple occurrence groups (' + fldFeatID.Name + ' in [' + ','.join(u2) +
-                  ']). The most common group ID among feature input points will be assigned to the polygon(s).')
-         jn = 'pt_join_py2'
-      else:
-         jn = 'pt_join_py'
-      arcpy.JoinField_management(species_py, fldFeatID.Name, jn, fldFeatID.Name, fldGrpID.Name)
 
-   return species_py
+@traced
+def eraseIndex(eraseFeats):
+   """Returns a spatial index over the bounding boxes of erase features (cached, see datasetCache).
+   Returns a tuple: (tbx_geom.BoxGrid, array of erase feature OIDs)"""
+   import numpy as np
+   import tbx_geom
+
+   def write(folder):
+      oids, bboxes = [], []
+      with arcpy.da.SearchCursor(eraseFeats, ['OID@', 'SHAPE@']) as sc:
+         for oid, g in countRows(sc):
+            if g is not None and g.pointCount > 0:
+               e = g.extent
+               oids.append(oid)
+               bboxes.append((e.XMin, e.YMin, e.XMax, e.YMax))
+      tbx_geom.BoxGrid.build(np.array(bboxes, dtype=float).reshape(-1, 4)).save(folder)
+      np.save(os.path.join(folder, 'oids.npy'), np.array(oids, dtype=np.int64), allow_pickle=False)
+
+   def load(folder):
+      return tbx_geom.BoxGrid.load(folder), tbx_geom.loadArray(os.path.join(folder, 'oids.npy'))
+
+   return datasetCache(eraseFeats, 'erase', eraseIndexVersion, write, load, 'erase feature index')
+
+
+def readByOID(inFeats, oids, fields, maxRows=1000):
+   """Reads rows of features with the given OIDs, in queries of at most maxRows OIDs. Yields rows (the OID first)."""
+   oidFld = datasetMeta(inFeats).oidField
+   oids = sorted(oids)
+   for i in range(0, len(oids), maxRows):
+      with arcpy.da.SearchCursor(inFeats, ['OID@'] + fields, sqlValues(oidFld, oids[i:i + maxRows])) as sc:
+         for row in sc:
+            yield row
+
+
+def clipFeatures(inFeats, eraseFeats, pairs, maxRows=1000):
+   """Erases candidate erase features from input features (see eraseFeatures and tbx_geom.eraseGeoms). Only the
+   features in pairs, and their candidates, are read.
+   pairs = dictionary of {input feature OID: list of candidate erase feature OIDs}
+   Returns a dictionary of {input feature OID: remaining geometry, or None if nothing remains}, for features changed
+   by the erase."""
+   import tbx_geom
+   ext = lambda g: (g.extent.XMin, g.extent.YMin, g.extent.XMax, g.extent.YMax)
+   erase = {}
+   for oid, g in countRows(readByOID(eraseFeats, set([k for v in pairs.values() for k in v]), ['SHAPE@'], maxRows),
+                           'erase features read'):
+      erase[oid] = (g, ext(g))
+   oids, geoms = [], []
+   for oid, g in readByOID(inFeats, pairs, ['SHAPE@'], maxRows):
+      oids.append(oid)
+      geoms.append(g)
+   ix = [(i, k) for i, oid in enumerate(oids) for k in pairs[oid] if k in erase]
+   out = tbx_geom.eraseGeoms(geoms, [ext(g) for g in geoms], ([a[0] for a in ix], [a[1] for a in ix]), erase,
+                             lambda a, b: a.difference(b), lambda a: a is None or a.area <= 0, ext)
+   return dict([(oids[i], g) for i, g in out.items() if g is not geoms[i]])
+
+
+def eraseWorker(inFeats, eraseFeats, pairs, maxRows=1000):
+   """Runs clipFeatures for one partition in a worker process. Geometries are returned as WKB."""
+   return dict([(oid, None if g is None else bytes(g.WKB))
+                for oid, g in clipFeatures(inFeats, eraseFeats, pairs, maxRows).items()])
+
+
+@traced
+def eraseFeatures(inFeats, eraseFeats, outFeats, workers=1, maxRows=1000):
+   """Alternative to Erase_analysis for large erase datasets (e.g. statewide land cover), which only reads the erase
+   features near input features (see eraseIndex).
+   inFeats = Input polygons
+   eraseFeats = Erase polygons
+   outFeats = Output polygons
+   maxRows = Maximum number of features read per query
+   Returns outFeats."""
+   import numpy as np
+   import tbx_geom
+   grid, eraseOIDs = eraseIndex(eraseFeats)
+   oids, bboxes, empty = [], [], []
+   with arcpy.da.SearchCursor(inFeats, ['OID@', 'SHAPE@']) as sc:
+      for oid, g in countRows(sc):
+         oids.append(oid)
+         if g is None or g.pointCount == 0:
+            empty.append(oid)
+            bboxes.append((np.nan,) * 4)
+         else:
+            e = g.extent
+            bboxes.append((e.XMin, e.YMin, e.XMax, e.YMax))
+   occ, cand = grid.boxPairs(np.array(bboxes, dtype=float).reshape(-1, 4))
+   occ, cand = [oids[i] for i in occ.tolist()], eraseOIDs[cand].tolist()
+   pairs = {}
+   for a, k in zip(occ, cand):
+      pairs.setdefault(a, []).append(k)
+   addCount('features near erase features', len(pairs))
+
+   layers = [a for a in [inFeats, eraseFeats] if datasetMeta(a).dataType == 'FeatureLayer']
+   if workers > 1 and len(pairs) > 1 and not layers:
+      part = tbx_geom.partitionPairs(occ, cand, workers * 2)
+      jobs = [{} for i in range(max(part.values()) + 1)]
+      for a, v in pairs.items():
+         jobs[part[a]][a] = v
+      printMsg('Erasing ' + str(len(jobs)) + ' partitions using ' + str(workers) + ' workers...')
+      clipped = {}
+      for r in runPool(eraseWorker, [(inFeats, eraseFeats, j, maxRows) for j in jobs], workers):
+         clipped.update([(a, None if w is None else arcpy.FromWKB(bytearray(w))) for a, w in r.items()])
+   else:
+      clipped = clipFeatures(inFeats, eraseFeats, pairs, maxRows)
+   # as in Erase, features with empty geometry are not output
+   clipped.update([(a, None) for a in empty])
+
+   # features are written with their clipped geometry, matched by the input OID (as in Erase, features with nothing
+   # left are not output)
+   meta = datasetMeta(inFeats)
+   flds = [f.name for f in meta.fields if f.type not in ['OID', 'Geometry'] and f.editable and
+           f.name not in [meta.lengthField, meta.areaField]]
+   arcpy.CreateFeatureclass_management(os.path.dirname(outFeats), os.path.basename(outFeats), 'POLYGON', inFeats,
+                                       spatial_reference=meta.spatialReference)
+   with arcpy.da.InsertCursor(outFeats, ['SHAPE@'] + flds) as ic:
+      with arcpy.da.SearchCursor(inFeats, ['OID@', 'SHAPE@'] + flds) as sc:
+         for row in countRows(sc):
+            if row[0] in clipped:
+               if clipped[row[0]] is None:
+                  addCount('features erased')
+                  continue
+               addCount('features clipped')
+               ic.insertRow([clipped[row[0]]] + list(row[2:]))
+            else:
+               ic.insertRow(list(row[1:]))
+   return outFeats
+
+
+class ValueReport:
+   """Counts of rows flagged by the AddInitFlds value checks, with the bad values found (see writeInitFlds).
+   At most maxValues distinct bad values are kept for each check."""
+   def __init__(self, maxValues=50):
+      self.counts = {}
+      self.values = {}
+      self.maxValues = maxValues
+
+   def add(self, check, value):
+      self.counts[check] = self.counts.get(check, 0) + 1
+      v = self.values.setdefault(check, {})
+      if value in v or len(v) < self.maxValues:
+         v[value] = v.get(value, 0) + 1
+
+   def count(self, check):
+      return self.counts.get(check, 0)
+
+   def examples(self, check, n=5):
+      """The n most common bad values for a check, as a string."""
+      v = sorted(self.values.get(check, {}).items(), key=lambda a: -a[1])[:n]
+      return ', '.join(['<null>' if k is None else "'" + str(k) + "'" for k, c in v])
+
+   def writeCSV(self, path):
+      """Writes the bad values (columns: check, value, count) to a csv file."""
+      with open(path, 'w', newline='') as f:
+         w = csv.writer(f)
+         w.writerow(['check', 'value', 'count'])
+         for check in sorted(self.values):
+            for k, c in sorted(self.values[check].items(), key=lambda a: -a[1]):
+               w.writerow([check, '<null>' if k is None else k, c])
+
+
+def initFldsTransforms(ix, srcTab, spCode, fldDate, fldSFRA, fldEO, fldSF):
+   """Row transforms calculating the initial fields, for writeInitFlds. Each updates a list of rows in place.
+   ix = Dictionary of {lower-case field name: index} in the rows
+   Returns the list of transforms, in the order they are applied."""
+   def srcIDs(rows, report):
+      iFID, iTab, iSp, iUse = [ix[f.Name.lower()] for f in [fldSrcFID, fldSrcTab, fldSpCode, fldUse]]
+      for r in rows:
+         r[iFID] = r[0]
+         r[iTab] = srcTab
+         r[iSp] = spCode
+         r[iUse] = 1
+
+   def copyValues(fromFld, toFld):
+      def copy(rows, report):
+         i, j = ix[fromFld.lower()], ix[toFld.lower()]
+         for r in rows:
+            r[j] = r[i]
+      return copy
+
+   def checkRA(rows, report):
+      iFlag = ix[fldRAFlag.Name.lower()]
+      if fldSFRA == '#':
+         for r in rows:
+            r[iFlag] = 1
+            report.add('RA', None)
+         return
+      i, iCalc = ix[fldSFRA.lower()], ix[fldSFRACalc.Name.lower()]
+      for r in rows:
+         r[iCalc] = r[i]
+         if r[i] not in raScores:
+            r[iFlag] = 1
+            report.add('RA', r[i])
+
+   def stdDates(rows, report):
+      i, iCalc, iFlag = [ix[f.lower()] for f in [fldDate, fldDateCalc.Name, fldDateFlag.Name]]
+      dates, flags = getStdDates([r[i] for r in rows])
+      for r, d, fl in zip(rows, dates, flags):
+         r[iCalc] = str(d)
+         if fl == 1:
+            r[iFlag] = 1
+            report.add('date', r[i])
+
+   transforms = [srcIDs]
+   for fromFld, toFld in [(fldEO, fldEOID.Name), (fldSF, fldSFID.Name)]:
+      if fromFld != '#' and fromFld.lower() != toFld.lower():
+         transforms.append(copyValues(fromFld, toFld))
+   return transforms + [checkRA, stdDates]
+
+
+class InitFldsOutputs:
+   """Species datasets for writeInitFlds, made as species are found in the input.
+   Outputs with an earlier run are written as pending datasets (see finishInitFlds)."""
+   pendingSuffix = '_pending'
+
+   def __init__(self, outFold, srcTab, lookup, reprocess=False):
+      self.outFold = outFold
+      self.srcTab = srcTab
+      self.lookup = lookup
+      self.reprocess = reprocess
+      self.outs = {}
+
+   def spCode(self, el):
+      # species codes must be 20 characters or less
+      return make_gdb_name(getSpCodes([el], self.lookup)[0][el])[0:20]
+
+   def get(self, el):
+      """Returns a tuple: (dataset to write, species code), or None for rows without a species value."""
+      if el is None:
+         return None
+      if el not in self.outs:
+         spCode = self.spCode(el)
+         outGDB = self.outFold + os.sep + spCode + '.gdb'
+         if not make_gdb(outGDB):
+            raise Exception('Invalid input geodatabase path. Make sure it has a ".gdb" extension.')
+         out = outGDB + os.sep + self.srcTab + '_' + spCode
+         if not self.reprocess and lastRun(outGDB, 'AddInitFlds', self.srcTab)[0] is not None:
+            out += self.pendingSuffix
+         self.outs[el] = (out, spCode)
+      return self.outs[el]
+
+
+def finishInitFlds(out, fingerprint, srcTab):
+   """Keeps or replaces the earlier output of a species written to a pending dataset (see InitFldsOutputs).
+   Returns a tuple: (output, True if the input changed since the earlier run)."""
+   if not out.endswith(InitFldsOutputs.pendingSuffix):
+      return out, True
+   outPolys = out[:-len(InitFldsOutputs.pendingSuffix)]
+   if unchangedRun(os.path.dirname(outPolys), 'AddInitFlds', srcTab, fingerprint):
+      arcpy.Delete_management(out)
+      return outPolys, False
+   if arcpy.Exists(outPolys):
+      arcpy.Delete_management(outPolys)
+   arcpy.Rename_management(out, outPolys)
+   return outPolys, True
+
+
+@traced
+def writeInitFlds(inFeats, outDict, srcTab, fldDate, fldSFRA, fldEO, fldSF, selFld=None, where=None, maxRows=50000,
+                  key=None):
+   """Creates species datasets with the initial fields calculated, in one pass over the input. Used in AddInitFlds.
+   inFeats = The input features
+   outDict = Dictionary (or InitFldsOutputs) of {selFld value: (output feature class, species code)}. Outputs are
+      created for the values found in the input.
+   srcTab, fldDate, fldSFRA, fldEO, fldSF = Source table name and source fields, as in AddInitFlds
+   selFld = The field to select species by. If None, all rows are written to the output for key.
+   where = Optional where clause, to only read some rows
+   maxRows = Maximum number of rows held in memory before they are written to the outputs
+   Returns a list of (output feature class, ValueReport, selFld value, Fingerprint) tuples"""
+   meta = datasetMeta(inFeats)
+   sr = meta.spatialReference
+   inFlds = [f.name for f in meta.fields if f.type not in ['OID', 'Geometry'] and f.editable]
+   newFlds = [a for a in initFieldsFull if a[0].lower() not in [f.lower() for f in inFlds]]
+   ls = ['SHAPE@'] + inFlds + [a[0] for a in newFlds]
+   ix = dict([(f.lower(), i + 1) for i, f in enumerate(ls)])
+   pad = [None] * len(newFlds)
+   # fields hashed for the fingerprint (as in fingerprintFeatures), read after the output fields
+   fpFlds = [f.name for f in meta.fields if f.type not in ['OID', 'Geometry'] and
+             f.name not in [meta.lengthField, meta.areaField]]
+   if selFld is not None and selFld not in fpFlds:
+      fpFlds.append(selFld)
+   cur = ['OID@'] + ls[:len(inFlds) + 1]
+   cur = cur + [f for f in fpFlds if f not in cur]
+   fpIx = [cur.index(f) for f in fpFlds]
+   nIn = len(inFlds) + 2
+   outs = {}
+
+   def output(value):
+      if value in outs:
+         return outs[value]
+      o = outDict.get(value)
+      if o is not None:
+         out, spCode = o
+         arcpy.CreateFeatureclass_management(os.path.dirname(out), os.path.basename(out), template=inFeats,
+                                             has_m='SAME_AS_TEMPLATE', has_z='SAME_AS_TEMPLATE', spatial_reference=sr)
+         if newFlds:
+            arcpy.AddFields_management(out, newFlds)
+         o = {'out': out, 'rows': [], 'report': ValueReport(), 'value': value, 'fp': Fingerprint(),
+              'transforms': initFldsTransforms(ix, srcTab, spCode, fldDate, fldSFRA, fldEO, fldSF)}
+      outs[value] = o
+      return o
+
+   def flush():
+      for o in outs.values():
+         if o is None or not o['rows']:
+            continue
+         for t in o['transforms']:
+            t(o['rows'], o['report'])
+         with arcpy.da.InsertCursor(o['out'], ls) as ic:
+            for r in o['rows']:
+               ic.insertRow(r[1:])
+         addCount('rows written', len(o['rows']))
+         o['rows'] = []
+
+   printMsg('Calculating fields...')
+   if selFld is None:
+      only = output(key)
+      route = lambda row: only
+   else:
+      iSel = cur.index(selFld)
+      route = lambda row: output(row[iSel])
+   n = 0
+   with arcpy.da.SearchCursor(inFeats, cur, where) as sc:
+      for row in countRows(sc):
+         o = route(row)
+         if o is None:
+            continue
+         o['fp'].addRow([None if row[1] is None else row[1].WKB] + [row[i] for i in fpIx])
+         o['rows'].append(list(row[:nIn]) + pad)
+         n += 1
+         if n >= maxRows:
+            flush()
+            n = 0
+   flush()
+   return [(o['out'], o['report'], o['value'], o['fp']) for o in outs.values() if o is not None]
+
+
+def sqlValues(fld, vals):
+   """Where clause selecting rows where a field has one of a list of values."""
+   return fld + ' IN (' + ', '.join(["'" + v.replace("'", "''") + "'" if isinstance(v, str) else str(v)
+                                     for v in vals]) + ')'
+
+
+def newPool(workers):
+   """Creates a pool of worker processes."""
+   import multiprocessing
+   if not os.path.basename(sys.executable).lower().startswith('python'):
+      # when run from ArcGIS Pro, the executable is ArcGISPro.exe; workers need to use python
+      multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+   return multiprocessing.Pool(workers)
+
+
+def runPool(fn, argList, workers):
+   """Runs fn(*args) for each args in argList on a pool of worker processes. Returns the list of results, in order."""
+   with newPool(min(workers, len(argList))) as pool:
+      return pool.starmap(fn, argList)
 
 
 def tbackInLoop():
@@ -582,11 +1800,18 @@ def tbackInLoop():
 
 
 def unique_values(table, field):
-   """ Gets list of unique values in a field.
+   """ Gets list of unique values in a field (None if the field has nulls). The field is read in chunks (see
+   columnChunks), so memory use depends on the number of unique values, not the number of rows.
    Thanks, ArcPy Cafe! https://arcpy.wordpress.com/2012/02/01/create-a-list-of-unique-field-values/"""
-   val = [r[0] for r in arcpy.da.SearchCursor(table, [field])]
-   uv = list(set(val))
-   return uv
+   import numpy as np
+   uv = set()
+   for chunk in columnChunks(table, [field]):
+      mask = np.ma.getmaskarray(chunk[field])
+      if mask.any():
+         uv.add(None)
+      val = np.ma.getdata(chunk[field])[~mask]
+      uv.update(val.tolist() if val.dtype.kind == 'O' else np.unique(val).tolist())
+   return list(uv)
 
 
 def make_gdb(path):
@@ -617,38 +1842,158 @@ def make_gdb_name(string):
    return nm
 
 
-def GetOverlapping(inList, outPolys, summFlds=None):
+@traced
+def markSpatialDuplicates(inPolys, rankBy='RA first'):
+   """Sets RA scores, and marks spatial duplicates (all but the 'best' polygon covering each unique polygon area) with
+   use = 0. Polygons are ranked by decreasing RA, date, and objectid (in case locations have the same date/RA); or
+   by date first, if rankBy = 'Date first'.
+   inPolys = Polygons with the uniqID_poly field (see GetOverlapping)
+   Used in MergeData. Returns the number of spatial duplicates."""
+   oids, polyIDs, sfra, dates = readColumns(inPolys, ['OID@', 'uniqID_poly', fldSFRACalc.Name, fldDateCalc.Name])
+   if not all([r in raScores for r in set(sfra)]):
+      printWrng("Some '" + fldSFRACalc.Name + "' values are missing or are not in allowed RA values. These will receive an '" + fldRA.Name + "' value of 0.")
+      # return?
+   ra = [raScores.get(r, 0) for r in sfra]
+   if rankBy == 'Date first':
+      dups = spatialDuplicates(oids, polyIDs, [dates, ra])
+   else:
+      dups = spatialDuplicates(oids, polyIDs, [ra, dates])
+   if len(dups) > 0:
+      printMsg('Setting spatial duplicates to ' + fldUse.Name + ' = 0')
+   raDict = dict(zip(oids, ra))
+   with arcpy.da.UpdateCursor(inPolys, ['OID@', fldRA.Name, fldUse.Name, fldUseWhy.Name]) as curs:
+      for row in countRows(curs, 'rows written'):
+         row[1] = raDict[row[0]]
+         if row[0] in dups:
+            row[2] = 0
+            row[3] = 'Spatial duplicate'
+         curs.updateRow(row)
+   return len(dups)
+
+
+# Fields for the final MergeData dissolve
+mergeDissList = [a for a in initDissList if a != fldSFRACalc.Name]
+
+
+@traced
+def mergeOverlaps(inPolys, outPolys, method='GP', rankBy='RA first', tolerance='0.1 Meters'):
+   """Integrates merged polygons, generates all unique polygons (see GetOverlapping), marks spatial duplicates (see
+   markSpatialDuplicates), and dissolves polygons on all attributes. Used in MergeData, for all merged polygons, or
+   for one partition (see partitionMerged).
+   inPolys = Merged polygons (these are modified by Integrate)
+   outPolys = Output polygons
+   method = 'GP' or 'INDEX' (see GetOverlapping)
+   tolerance = Integrate tolerance
+   Returns the number of spatial duplicates."""
+   scratch = getScratch()
+   with stage('Integrate'):
+      # Integrate should clean up slight boundary mismatches
+      arcpy.Integrate_management(inPolys, tolerance)
+   # This approach uses count overlapping polys (requires ArcPro 2.5+)
+   with step('Generating all unique polygons...'):
+      temp1 = scratch.path('merged_temp_1')
+      GetOverlapping([inPolys], temp1, method=method)
+   # temp1 has fields uniqID_poly and COUNT_.
+   # Set RA values, and set = 0 those which are spatial duplicates (sorting by ra/date to find 'best' polygon)
+   nDup = markSpatialDuplicates(temp1, rankBy)
+   with step("Dissolving polygons on all attributes..."):
+      arcpy.Dissolve_management(temp1, outPolys, mergeDissList)  # , multi_part="SINGLE_PART")
+   # slivers/edges can result from this; leaving as single_part makes it easier to exclude them. Shouldn't be a
+   # problem to keep though, since these will be 'grouped' with adjacent polygon.
+   return nDup
+
+
+def mergeWorker(inPolys, outPolys, method='GP', rankBy='RA first', tolerance='0.1 Meters'):
+   """Runs mergeOverlaps for one partition in a worker process, with its own scratch workspace."""
+   arcpy.env.overwriteOutput = True
+   with ScratchWorkspace():
+      return mergeOverlaps(inPolys, outPolys, method, rankBy, tolerance)
+
+
+@traced
+def partitionMerged(inPolys, nParts, tolerance='0.1 Meters'):
+   """Splits merged polygons into partitions which can be processed independently by mergeOverlaps.
+   inPolys = Merged polygons
+   nParts = Maximum number of partitions
+   Each partition is written to its own scratch geodatabase. Returns the list of partition feature classes."""
+   import tbx_geom
+   scratch = getScratch()
+   sr = arcpy.Describe(inPolys).spatialReference
+   tol = parseDist(tolerance, sr.metersPerUnit)
+   oids, bboxes, keys = [], [], []
+   with arcpy.da.SearchCursor(inPolys, ['OID@', 'SHAPE@', fldSrcTab.Name, fldSrcFID.Name]) as sc:
+      for oid, g, tab, fid in countRows(sc):
+         oids.append(oid)
+         if g is None:
+            bboxes.append((float('nan'),) * 4)
+         else:
+            e = g.extent
+            bboxes.append((e.XMin, e.YMin, e.XMax, e.YMax))
+         keys.append((tab, fid))
+   if not oids:
+      return [inPolys]
+   part = dict(zip(oids, tbx_geom.partitionBoxes(bboxes, nParts, 2 * tol, keys)))
+   n = max(part.values()) + 1
+   if n == 1:
+      return [inPolys]
+   outs = [scratch.workspace('part' + str(i)) + os.sep + 'part' for i in range(n)]
+   flds = [f.name for f in arcpy.ListFields(inPolys) if f.type not in ['OID', 'Geometry'] and f.editable]
+   with contextlib.ExitStack() as stack:
+      ics = []
+      for out in outs:
+         arcpy.CreateFeatureclass_management(os.path.dirname(out), os.path.basename(out), template=inPolys,
+                                             spatial_reference=sr)
+         ics.append(stack.enter_context(arcpy.da.InsertCursor(out, ['SHAPE@'] + flds)))
+      with arcpy.da.SearchCursor(inPolys, ['OID@', 'SHAPE@'] + flds) as sc:
+         for row in sc:
+            ics[part[row[0]]].insertRow(row[1:])
+   addCount('rows written', len(oids))
+   return outs
+
+
+@traced
+def GetOverlapping(inList, outPolys, summFlds=None, method='GP'):
    """Internal function for MergeData. Generates all unique polygons from list of one or more polygon FCs.
    If summFlds is provided, final dataset will be 'flat' (no overlap), with only ID, Count, and summary
    fields returned.
+   method = 'GP' (geoprocessing tools) or 'INDEX' (in-memory overlay, see GetOverlappingIndex)
    Used in MergeData.
    """
+   if method == 'INDEX':
+      if summFlds:
+         return GetOverlappingIndex(inList, None, summFlds, outFlat=outPolys)
+      else:
+         return GetOverlappingIndex(inList, outPolys)
 
    # unique polygon ID to assign to new 'flat' dataset
    polyID = 'uniqID_poly'
-   if len(inList) > 1:
-      print('Merging all datasets, converting to single-part...')
-      m = arcpy.Merge_management(inList, scratchGDB + os.sep + 'merged0')
-      m0 = arcpy.MultipartToSinglepart_management(m, scratchGDB + os.sep + 'merged0_single')
-   else:
-      print('Converting to single-part...')
-      m0 = arcpy.MultipartToSinglepart_management(inList[0], scratchGDB + os.sep + 'merged0_single')
-
-   upoly = arcpy.CountOverlappingFeatures_analysis(m0, scratchGDB + os.sep + 'upoly')
-   arcpy.AddField_management(upoly, polyID, 'LONG')
-   # arcpy.CalculateField_management(upoly, polyID, '!OBJECTID!')
-   copyFld(upoly, 'OBJECTID', polyID)
+   scratch = getScratch()
+   with stage('single-part'):
+      if len(inList) > 1:
+         print('Merging all datasets, converting to single-part...')
+         m = arcpy.Merge_management(inList, scratch.path('merged0'))
+         m0 = arcpy.MultipartToSinglepart_management(m, scratch.path('merged0_single'))
+      else:
+         print('Converting to single-part...')
+         m0 = arcpy.MultipartToSinglepart_management(inList[0], scratch.path('merged0_single'))
+
+   with stage('CountOverlappingFeatures'):
+      upoly = arcpy.CountOverlappingFeatures_analysis(m0, scratch.path('upoly'))
+      arcpy.AddField_management(upoly, polyID, 'LONG')
+      # arcpy.CalculateField_management(upoly, polyID, '!OBJECTID!')
+      copyFld(upoly, 'OBJECTID', polyID)
    # check if any overlaps
-   maxct = max([a[0] for a in arcpy.da.SearchCursor(upoly, "COUNT_")])
+   maxct = max([a[0] for a in countRows(arcpy.da.SearchCursor(upoly, "COUNT_"))])
 
    if maxct > 1:
-      ct1 = arcpy.FeatureToPoint_management(upoly, scratchGDB + os.sep + 'ct1', point_location="INSIDE")
-      sj0 = arcpy.SpatialJoin_analysis(ct1, m0, scratchGDB + os.sep + 'sj0', "JOIN_ONE_TO_MANY", "KEEP_ALL", match_option="WITHIN")
-      # Generate one polygon for each overlap section from any dataset
-      allpoly = arcpy.SpatialJoin_analysis(upoly, sj0, scratchGDB + os.sep + 'allpoly', "JOIN_ONE_TO_MANY", "KEEP_ALL", match_option="INTERSECT")
+      with stage('SpatialJoin'):
+         ct1 = arcpy.FeatureToPoint_management(upoly, scratch.path('ct1', memory=True), point_location="INSIDE")
+         sj0 = arcpy.SpatialJoin_analysis(ct1, m0, scratch.path('sj0', memory=True), "JOIN_ONE_TO_MANY", "KEEP_ALL", match_option="WITHIN")
+         # Generate one polygon for each overlap section from any dataset
+         allpoly = arcpy.SpatialJoin_analysis(upoly, sj0, scratch.path('allpoly'), "JOIN_ONE_TO_MANY", "KEEP_ALL", match_option="INTERSECT")
       if summFlds:
          print('Returning `flat` polygons with summarized fields...')
-         summ0 = arcpy.Statistics_analysis(allpoly, scratchGDB + os.sep + 'summ0', summFlds, polyID)
+         summ0 = arcpy.Statistics_analysis(allpoly, scratch.path('summ0', memory=True), summFlds, polyID)
          arcpy.JoinField_management(upoly, polyID, summ0, polyID)
          arcpy.CopyFeatures_management(upoly, outPolys)
       else:
@@ -665,47 +2010,281 @@ def GetOverlapping(inList, outPolys, summFlds=None):
    return outPolys
 
 
-def fc2df(feature_class, field_list, skip_nulls=True):
+@traced
+def GetOverlappingIndex(inList, outPolys, summFlds=None, outFlat=None):
+   """In-memory alternative to GetOverlapping, which does not write any intermediate datasets.
+   Polygons from all input FCs are read once (as single parts), and overlapping polygons (found with a spatial
+   index) are overlaid using geometry methods, giving the unique faces and the polygons covering each.
+   outPolys = Output with all polygons, duplicated in areas of overlap (with source attributes). Can be None.
+   summFlds = Summary fields for outFlat ([[field, statistic], ...], as in Statistics_analysis)
+   outFlat = Output with 'flat' polygons (no overlap), with only ID, Count, and summary fields. Can be None.
+   Both outputs have fields uniqID_poly and COUNT_. Returns outPolys (or outFlat, if outPolys is None)."""
+   import tbx_geom
+   polyID = 'uniqID_poly'
+   sr = arcpy.Describe(inList[0]).spatialReference
+
+   # output fields: all fields from all inputs (as in Merge)
+   flds = []
+   for fc in inList:
+      for f in arcpy.ListFields(fc):
+         if f.type not in ['OID', 'Geometry'] and f.editable and f.name.lower() not in [a.name.lower() for a in flds]:
+            flds.append(f)
+   names = [f.name for f in flds]
+
+   print('Reading polygons, converting to single-part...')
+   geoms, attrs = [], []
+   for fc in inList:
+      fcNames = [f.name.lower() for f in arcpy.ListFields(fc)]
+      use = [n for n in names if n.lower() in fcNames]
+      ix = [use.index(n) + 1 if n in use else None for n in names]
+      for row in countRows(arcpy.da.SearchCursor(fc, ['SHAPE@'] + use)):
+         if row[0] is None:
+            continue
+         att = tuple([row[i] if i is not None else None for i in ix])
+         for k in range(row[0].partCount):
+            geoms.append(arcpy.Polygon(row[0].getPart(k), sr))
+            attrs.append(att)
+
+   print('Generating unique polygons...')
+   with stage('overlayFaces'):
+      ext = lambda g: (g.extent.XMin, g.extent.YMin, g.extent.XMax, g.extent.YMax)
+      faces = tbx_geom.overlayFaces(geoms, [ext(g) for g in geoms], lambda a, b: a.intersect(b, 4),
+                                    lambda a, b: a.difference(b), lambda a: a is None or a.area <= 0, ext)
+
+   if outPolys:
+      print('Writing all polygons (duplicated in areas of overlap)...')
+      arcpy.CreateFeatureclass_management(os.path.dirname(outPolys), os.path.basename(outPolys), 'POLYGON',
+                                          spatial_reference=sr)
+      arcpy.AddFields_management(outPolys, [fieldDef(f) for f in flds] + [[polyID, 'LONG'], ['COUNT_', 'LONG']])
+      with arcpy.da.InsertCursor(outPolys, ['SHAPE@'] + names + [polyID, 'COUNT_']) as ic:
+         for fid, (g, ids) in enumerate(faces, 1):
+            for i in ids:
+               ic.insertRow((g,) + attrs[i] + (fid, len(ids)))
+            addCount('rows written', len(ids))
+   if outFlat:
+      print('Writing `flat` polygons with summarized fields...')
+      if summFlds is None:
+         summFlds = []
+      fdict = dict([(f.name.lower(), f) for f in flds])
+      summDefs = []
+      for fld, stat in summFlds:
+         nm = stat.upper() + '_' + fld
+         if stat.upper() in ['MIN', 'MAX', 'FIRST', 'LAST']:
+            summDefs.append(fieldDef(fdict[fld.lower()], nm))
+         elif stat.upper() == 'COUNT':
+            summDefs.append([nm, 'LONG'])
+         else:
+            summDefs.append([nm, 'DOUBLE'])
+      arcpy.CreateFeatureclass_management(os.path.dirname(outFlat), os.path.basename(outFlat), 'POLYGON',
+                                          spatial_reference=sr)
+      arcpy.AddFields_management(outFlat, [[polyID, 'LONG'], ['COUNT_', 'LONG']] + summDefs)
+      six = [names.index(fdict[fld.lower()].name) for fld, stat in summFlds]
+      with arcpy.da.InsertCursor(outFlat, ['SHAPE@', polyID, 'COUNT_'] + [d[0] for d in summDefs]) as ic:
+         for fid, (g, ids) in enumerate(faces, 1):
+            summ = [summarize([attrs[i][k] for i in ids], s[1]) for k, s in zip(six, summFlds)]
+            ic.insertRow([g, fid, len(ids)] + summ)
+         addCount('rows written', len(faces))
+
+   if outPolys:
+      return outPolys
+   else:
+      return outFlat
+
+
+# NumPy types for ListFields field types and cursor tokens (see columnChunks). Other fields are read as objects.
+numpyTypes = {'String': 'U', 'GUID': 'U', 'GlobalID': 'U', 'Integer': 'int32', 'SmallInteger': 'int16',
+              'BigInteger': 'int64', 'OID': 'int64', 'Double': 'float64', 'Single': 'float32',
+              'Date': 'datetime64[us]', 'DateOnly': 'datetime64[D]', 'OID@': 'int64', 'SHAPE@X': 'float64',
+              'SHAPE@Y': 'float64', 'SHAPE@AREA': 'float64', 'SHAPE@LENGTH': 'float64'}
+
+
+def columnTypes(table, fields):
+   """NumPy types (see numpyTypes) for fields of a table."""
+   meta = dict([(f.name.lower(), f.type) for f in arcpy.ListFields(table)])
+   return [numpyTypes.get(f.upper(), numpyTypes.get(meta.get(f.lower()), 'O')) for f in fields]
+
+
+def dateArray(vals, dtype='datetime64[us]'):
+   """Converts dates or datetimes (None for nulls) to a datetime64 array, with NaT for nulls. Offsets from 1970 are
+   computed with Python arithmetic, which is several times faster than NumPy's conversion of datetime objects."""
+   import numpy as np
+   nat = np.iinfo(np.int64).min
+   try:
+      if dtype == 'datetime64[D]':
+         off = (v.toordinal() - 719163 if v is not None else nat for v in vals)
+      else:
+         e, us = datetime(1970, 1, 1), timedelta(microseconds=1)
+         off = ((v - e) // us if v is not None else nat for v in vals)
+      return np.fromiter(off, dtype=np.int64, count=len(vals)).view(dtype)
+   except (TypeError, AttributeError, OverflowError):
+      # e.g. time zone aware values
+      return np.array(vals, dtype=dtype)
+
+
+def columnChunks(table, fields, where=None, chunkSize=100000):
+   """Reads fields from a table in chunks of at most chunkSize rows, as typed arrays with nulls masked.
+   Yields dictionaries of {field: numpy.ma.MaskedArray}."""
+   import itertools
+   import numpy as np
+   types = columnTypes(table, fields)
+   fills = [{'U': '', 'O': None}.get(t, np.nan if t.startswith('float') else 0) for t in types]
+   with arcpy.da.SearchCursor(table, fields, where) as sc:
+      while True:
+         rows = list(itertools.islice(sc, chunkSize))
+         if not rows:
+            break
+         addCount('rows read', len(rows))
+         out = {}
+         for k, (f, t, fill) in enumerate(zip(fields, types, fills)):
+            col = [r[k] for r in rows]
+            mask = np.fromiter((v is None for v in col), dtype=bool, count=len(col))
+            if mask.any() and t[0] in 'Uif':
+               col = [fill if v is None else v for v in col]
+            if t == 'O':
+               a = np.fromiter(col, dtype=object, count=len(col))
+            elif t.startswith('datetime'):
+               a = dateArray(col, t)
+            else:
+               a = np.array(col, dtype=t if t != 'U' else str)
+            out[f] = np.ma.MaskedArray(a, mask)
+         yield out
+         if len(rows) < chunkSize:
+            break
+
+
+@traced
+def readArrays(table, fields, where=None, chunkSize=100000):
+   """Reads fields from a table into typed masked arrays (see columnChunks). The whole table is held in memory; to
+   process large tables with bounded memory, use columnChunks. Returns a dictionary of {field: numpy.ma.MaskedArray}."""
+   import numpy as np
+   parts = dict([(f, []) for f in fields])
+   for chunk in columnChunks(table, fields, where, chunkSize):
+      for f in fields:
+         parts[f].append(chunk[f])
+   types = columnTypes(table, fields)
+   return dict([(f, np.ma.concatenate(parts[f]) if parts[f] else
+                 np.ma.MaskedArray(np.empty(0, dtype=t if t != 'U' else str), np.empty(0, dtype=bool)))
+                for f, t in zip(fields, types)])
+
+
+def arrayField(name, arr):
+   """Field definition (as in fieldDef) for a column array. Integers are written to the smallest of SHORT, LONG and
+   BIGINTEGER holding their values; text fields are as long as the longest value."""
+   import numpy as np
+   a = np.ma.getdata(arr)
+   if a.dtype.kind == 'b':
+      return [name, 'SHORT', name, '']
+   if a.dtype.kind in 'iu':
+      v = np.ma.compressed(np.ma.MaskedArray(a, np.ma.getmaskarray(arr)))
+      lo, hi = (int(v.min()), int(v.max())) if len(v) else (0, 0)
+      if -2 ** 15 <= lo and hi < 2 ** 15:
+         return [name, 'SHORT', name, '']
+      if -2 ** 31 <= lo and hi < 2 ** 31:
+         return [name, 'LONG', name, '']
+      return [name, 'BIGINTEGER', name, '']
+   if a.dtype.kind == 'f':
+      return [name, 'FLOAT' if a.dtype.itemsize == 4 else 'DOUBLE', name, '']
+   if a.dtype.kind == 'M':
+      return [name, 'DATEONLY' if np.datetime_data(a.dtype)[0] in ('D', 'W', 'M', 'Y') else 'DATE', name, '']
+   if a.dtype.kind == 'U':
+      return [name, 'TEXT', name, max(a.dtype.itemsize // 4, 1)]
+   n = max([len(str(v)) for v in a.tolist() if v is not None] or [1])
+   return [name, 'TEXT', name, n]
+
+
+@traced
+def writeArrays(columns, outTable, chunkSize=100000):
+   """Writes column arrays (e.g. from readArrays) to a new table, in chunks of at most chunkSize rows. Field types
+   follow the array types (see arrayField), and masked values are written as nulls.
+   columns = dictionary of {field: array or masked array}
+   Returns outTable."""
+   import numpy as np
+   names = list(columns)
+   arcpy.CreateTable_management(os.path.dirname(outTable), os.path.basename(outTable))
+   arcpy.AddFields_management(outTable, [arrayField(f, columns[f]) for f in names])
+   n = len(columns[names[0]]) if names else 0
+   with arcpy.da.InsertCursor(outTable, names) as ic:
+      for i in range(0, n, chunkSize):
+         cols = []
+         for f in names:
+            a = columns[f][i:i + chunkSize]
+            data = np.ma.getdata(a)
+            if data.dtype.kind == 'M' and np.datetime_data(data.dtype)[0] in ('ns', 'ps', 'fs', 'as'):
+               # as datetime objects (finer units convert to integers)
+               data = data.astype('datetime64[us]')
+            vals = data.tolist()
+            for k in np.nonzero(np.ma.getmaskarray(a))[0].tolist():
+               vals[k] = None
+            cols.append(vals)
+         for row in zip(*cols):
+            ic.insertRow(row)
+         addCount('rows written', len(cols[0]))
+   return outTable
+
+
+@traced
+def fc2df(feature_class, field_list, skip_nulls=True, chunkSize=100000):
    """
    Load data into a Pandas Data Frame for subsequent analysis.
    :param feature_class: Input ArcGIS Feature Class.
    :param field_list: Fields for input.
+   :param skip_nulls: Drop rows with a null in any field.
+   :param chunkSize: Number of rows read at a time.
    :return: Pandas DataFrame object.
    """
-   from pandas import DataFrame
-   if not skip_nulls:
-      return DataFrame(
-         arcpy.da.FeatureClassToNumPyArray(
-            in_table=feature_class,
-            field_names=field_list,
-            skip_nulls=False,
-            null_value=-99999
-         )
-      )
-   else:
-      return DataFrame(
-         arcpy.da.FeatureClassToNumPyArray(
-            in_table=feature_class,
-            field_names=field_list,
-            skip_nulls=True
-         )
-      )
-
-
-def df2tab(df, outTable):
+   import numpy as np
+   import pandas as pd
+   frames = []
+   for cols in columnChunks(feature_class, field_list, chunkSize=chunkSize):
+      if skip_nulls and field_list:
+         keep = ~np.any([np.ma.getmaskarray(a) for a in cols.values()], axis=0)
+         addCount('rows with nulls skipped', int((~keep).sum()))
+         cols = dict([(f, a[keep]) for f, a in cols.items()])
+      out = {}
+      for f, a in cols.items():
+         data, mask = np.ma.getdata(a), np.ma.getmaskarray(a)
+         if data.dtype.kind in 'iu' and mask.any():
+            out[f] = pd.arrays.IntegerArray(data, mask)
+         elif data.dtype.kind == 'f' and mask.any():
+            out[f] = pd.arrays.FloatingArray(data, mask)
+         elif data.dtype.kind == 'U':
+            obj = data.astype(object)
+            obj[mask] = None
+            out[f] = pd.array(obj, dtype='string')
+         else:
+            out[f] = data
+      frames.append(pd.DataFrame(out))
+   if not frames:
+      # no rows: empty columns of the field types (pandas has no day unit for dates)
+      types = [{'U': 'string', 'datetime64[D]': 'datetime64[s]'}.get(t, t) for t in
+               columnTypes(feature_class, field_list)]
+      return pd.DataFrame(dict([(f, pd.Series([], dtype=t)) for f, t in zip(field_list, types)]))
+   return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+@traced
+def df2tab(df, outTable, chunkSize=100000):
    """
    Create an ArcGIS table from a Pandas Data Frame (generally for joins)
    :param df: Input pandas DataFrame
    :param outTable: Name of output table
+   :param chunkSize: Number of rows written at a time.
    :return: outTable
    """
    import numpy as np
-   x = np.array(np.rec.fromrecords(df.values))
-   names = df.dtypes.index.tolist()
-   names = [str(n) for n in names]
-   x.dtype.names = tuple(names)
-   return arcpy.da.NumPyArrayToTable(x, outTable)
-
+   columns = {}
+   for name in df.columns:
+      s = df[name]
+      mask = s.isna().to_numpy()
+      dt = getattr(s.dtype, 'numpy_dtype', s.dtype)
+      if dt.kind in 'biufM':
+         data = s.to_numpy(dtype=dt, na_value=np.datetime64('NaT') if dt.kind == 'M' else 0)
+      else:
+         data = s.to_numpy(dtype=object, na_value=None)
+         if not mask.all() and all([isinstance(v, str) for v in data[~mask].tolist()]):
+            data = np.where(mask, '', data).astype(str)
+      columns[str(name)] = np.ma.MaskedArray(data, mask)
+   return writeArrays(columns, outTable, chunkSize)
 
 
 # end
\ No newline at end of file
@@ -0,0 +1,898 @@
+# Minimal local stand-in for the parts of arcpy used by tbx_helper, so helper functions can be run and benchmarked
+# on machines without ArcGIS (see tbx_bench.py). Tables and feature classes are held in memory, keyed by path.
+# Supported: arcpy.da cursors (SearchCursor, UpdateCursor, InsertCursor, with simple where clauses), ListFields,
+# Describe, geometry classes (Point, Array, Polygon, Polyline, PointGeometry), field and table management, and
+# messages. Geoprocessing tools (Buffer, SpatialJoin, Dissolve, etc.) are not available.
+# Use before importing tbx_helper:
+#    import tbx_localarcpy
+#    tbx_localarcpy.install()
+import os
+import re
+import struct
+import sys
+import tempfile
+import types
+
+
+class ExecuteError(Exception):
+   pass
+
+
+# ---- geometry ----
+
+class Point:
+   def __init__(self, X=0.0, Y=0.0, Z=None, M=None, ID=0):
+      self.X = X
+      self.Y = Y
+      self.Z = Z
+      self.M = M
+      self.ID = ID
+
+
+class Array(list):
+   """Array of Points, or of Arrays (for multi-part geometries)."""
+   def __init__(self, items=None):
+      list.__init__(self, items or [])
+
+   def add(self, item):
+      self.append(item)
+
+   @property
+   def count(self):
+      return len(self)
+
+
+class Extent:
+   def __init__(self, XMin, YMin, XMax, YMax):
+      self.XMin = XMin
+      self.YMin = YMin
+      self.XMax = XMax
+      self.YMax = YMax
+      self.width = XMax - XMin
+      self.height = YMax - YMin
+
+
+class SpatialReference:
+   def __init__(self, item=None, name='Local_Meters', metersPerUnit=1.0):
+      self.factoryCode = item if isinstance(item, int) else 0
+      self.name = self.Name = name
+      self.metersPerUnit = metersPerUnit
+      self.type = 'Projected'
+      self.GCS = self
+
+   def exportToString(self):
+      return self.name
+
+
+def _parts(arr):
+   """Converts an Array (of Points, or of Arrays of Points), or nested lists of (x, y), to a list of parts (lists of
+   (x, y) tuples)."""
+   if len(arr) == 0:
+      return []
+   first = arr[0]
+   if isinstance(first, Point) or (isinstance(first, (tuple, list)) and len(first) in (2, 3) and
+                                   not isinstance(first[0], (list, tuple, Point))):
+      arr = [arr]
+   parts = []
+   for p in arr:
+      parts.append([(float(q.X), float(q.Y)) if isinstance(q, Point) else (float(q[0]), float(q[1])) for q in p])
+   return parts
+
+
+class Geometry:
+   """Geometry with parts (lists of (x, y)). For polygons, each part is one ring."""
+   type = 'geometry'
+
+   def __init__(self, inputs=None, spatial_reference=None, has_z=False, has_m=False):
+      self.parts = _parts(inputs) if inputs is not None else []
+      self.spatialReference = spatial_reference
+
+   @property
+   def partCount(self):
+      return len(self.parts)
+
+   @property
+   def pointCount(self):
+      return sum([len(p) for p in self.parts])
+
+   @property
+   def hasCurves(self):
+      return False
+
+   @property
+   def isMultipart(self):
+      return len(self.parts) > 1
+
+   @property
+   def extent(self):
+      xs = [q[0] for p in self.parts for q in p]
+      ys = [q[1] for p in self.parts for q in p]
+      if not xs:
+         return Extent(None, None, None, None)
+      return Extent(min(xs), min(ys), max(xs), max(ys))
+
+   @property
+   def firstPoint(self):
+      q = self.parts[0][0]
+      return Point(q[0], q[1])
+
+   @property
+   def centroid(self):
+      xs = [q[0] for p in self.parts for q in p]
+      ys = [q[1] for p in self.parts for q in p]
+      return Point(sum(xs) / len(xs), sum(ys) / len(ys))
+
+   def getPart(self, i=None):
+      if i is None:
+         return Array([Array([Point(*q) for q in p]) for p in self.parts])
+      return Array([Point(*q) for q in self.parts[i]])
+
+   @property
+   def length(self):
+      tot = 0.0
+      for p in self.parts:
+         for a, b in zip(p[:-1], p[1:]):
+            tot += ((b[0] - a[0]) ** 2 + (b[1] - a[1]) ** 2) ** 0.5
+      return tot
+
+   @property
+   def WKB(self):
+      b = struct.pack('<BII', 1, {'point': 1, 'polyline': 5, 'polygon': 6}.get(self.type, 7), len(self.parts))
+      for p in self.parts:
+         b += struct.pack('<I', len(p)) + b''.join([struct.pack('<dd', *q) for q in p])
+      return bytearray(b)
+
+   def densify(self, method, distance, deviation=None):
+      return self
+
+
+class Polygon(Geometry):
+   type = 'polygon'
+
+   @property
+   def area(self):
+      tot = 0.0
+      for p in self.parts:
+         s = 0.0
+         for a, b in zip(p, p[1:] + p[:1]):
+            s += a[0] * b[1] - b[0] * a[1]
+         tot += s / 2.0
+      return abs(tot)
+
+   @property
+   def __geo_interface__(self):
+      return {'type': 'MultiPolygon', 'coordinates': [[p] for p in self.parts]}
+
+
+class Polyline(Geometry):
+   type = 'polyline'
+
+   @property
+   def __geo_interface__(self):
+      if len(self.parts) == 1:
+         return {'type': 'LineString', 'coordinates': self.parts[0]}
+      return {'type': 'MultiLineString', 'coordinates': self.parts}
+
+
+class PointGeometry(Geometry):
+   type = 'point'
+
+   def __init__(self, inputs=None, spatial_reference=None, has_z=False, has_m=False):
+      if isinstance(inputs, Point):
+         inputs = [(inputs.X, inputs.Y)]
+      elif isinstance(inputs, tuple):
+         inputs = [inputs]
+      Geometry.__init__(self, inputs, spatial_reference)
+
+   @property
+   def __geo_interface__(self):
+      return {'type': 'Point', 'coordinates': self.parts[0][0]}
+
+
+_geomTypes = {'POLYGON': Polygon, 'POLYLINE': Polyline, 'POINT': PointGeometry, 'MULTIPOINT': PointGeometry}
+_shapeTypes = {'POLYGON': 'Polygon', 'POLYLINE': 'Polyline', 'POINT': 'Point', 'MULTIPOINT': 'Multipoint'}
+
+
+# ---- tables ----
+
+class Field:
+   # ListFields field, with both arcpy attribute spellings (name/Name, type/Type) used in the toolbox
+   def __init__(self, name, type, length=0, aliasName=None, editable=True):
+      self.name = self.Name = name
+      self.type = self.Type = type
+      self.length = self.Length = length
+      self.aliasName = aliasName or name
+      self.editable = editable
+      self.required = type in ('OID', 'Geometry')
+      self.isNullable = not self.required
+
+
+_fieldTypes = {'TEXT': 'String', 'LONG': 'Integer', 'SHORT': 'SmallInteger', 'BIGINTEGER': 'BigInteger',
+               'DOUBLE': 'Double', 'FLOAT': 'Single', 'DATE': 'Date', 'GUID': 'GUID', 'BLOB': 'Blob'}
+
+
+class Table:
+   """In-memory table or feature class. Rows are lists of values (in field order, starting with the OID), keyed
+   by OID."""
+   def __init__(self, path, shapeType=None, spatialReference=None):
+      self.path = path
+      self.fields = [Field('OBJECTID', 'OID', 4, editable=False)]
+      self.shapeType = shapeType
+      self.spatialReference = spatialReference or (SpatialReference() if shapeType else None)
+      self.geomClass = None
+      if shapeType:
+         self.fields.append(Field('Shape', 'Geometry', 0, editable=True))
+         self.geomClass = _geomTypes[shapeType.upper()]
+      self.rows = {}
+      self.nextOID = 1
+
+   def fieldIndex(self, name):
+      n = name.lower()
+      for i, f in enumerate(self.fields):
+         if f.name.lower() == n:
+            return i
+      raise ExecuteError('Field ' + name + ' does not exist in ' + self.path)
+
+   def addField(self, name, ftype, length=None):
+      if name.lower() in [f.name.lower() for f in self.fields]:
+         return
+      t = _fieldTypes.get(str(ftype).upper(), ftype)
+      self.fields.append(Field(name, t, int(length) if length not in (None, '') else (255 if t == 'String' else 0)))
+      for r in self.rows.values():
+         r.append(None)
+      self.touch()
+
+   def touch(self):
+      """Writes a marker file for the table in its geodatabase folder, if the folder exists, so the folder's
+      modification stamp (tbx_core.pathStamp) changes when the table is edited, as with a file geodatabase."""
+      gdb = os.path.dirname(self.path)
+      if gdb.lower().endswith('.gdb') and os.path.isdir(gdb):
+         with open(os.path.join(gdb, os.path.basename(self.path) + '.table'), 'w') as f:
+            f.write(str(len(self.rows)))
+
+
+_tables = {}
+
+
+class Layer:
+   """Feature layer: a table with a where clause (the definition query, and the selection if any)."""
+   def __init__(self, name, table, where=None):
+      self.name = name
+      self.table = table
+      self.where = where
+      self.query = where
+      self.selection = []
+
+   def __str__(self):
+      return self.name
+
+
+class Result:
+   def __init__(self, *outputs):
+      self.outputs = list(outputs)
+
+   def getOutput(self, i):
+      return self.outputs[i]
+
+   def __getitem__(self, i):
+      return self.outputs[i]
+
+   def __str__(self):
+      return str(self.outputs[0])
+
+
+def _key(path):
+   path = str(path)
+   if not os.path.isabs(path) and not path.lower().startswith('memory') and env.workspace:
+      path = os.path.join(env.workspace, path)
+   return os.path.normpath(path).lower()
+
+
+def _resolve(obj):
+   """Returns (Table, where clause) for a path, Layer or Result."""
+   if isinstance(obj, Result):
+      obj = obj.getOutput(0)
+   if isinstance(obj, Layer):
+      return obj.table, obj.where
+   if isinstance(obj, str) and obj in _layers:
+      lyr = _layers[obj]
+      return lyr.table, lyr.where
+   t = _tables.get(_key(obj))
+   if t is None:
+      raise ExecuteError('Dataset ' + str(obj) + ' does not exist.')
+   return t, None
+
+
+_layers = {}
+
+
+# ---- where clauses ----
+
+_tokenRe = re.compile(r"\s*(?:('(?:[^']|'')*')|(-?\d+\.?\d*(?:[eE][-+]?\d+)?)|(<>|!=|<=|>=|=|<|>|\(|\)|,)|([A-Za-z_][\w.]*))")
+
+
+def _tokens(where):
+   pos, out = 0, []
+   where = where.strip()
+   while pos < len(where):
+      m = _tokenRe.match(where, pos)
+      if not m or m.end() == pos:
+         raise ExecuteError('Unsupported where clause: ' + where)
+      s, num, op, name = m.groups()
+      if s is not None:
+         out.append(('val', s[1:-1].replace("''", "'")))
+      elif num is not None:
+         out.append(('val', float(num) if ('.' in num or 'e' in num.lower()) else int(num)))
+      elif op is not None:
+         out.append(('op', op))
+      else:
+         out.append(('kw', name.upper()) if name.upper() in ('AND', 'OR', 'NOT', 'IN', 'IS', 'NULL') else
+                    ('name', name))
+      pos = m.end()
+   return out
+
+
+def _compileWhere(where, table):
+   """Compiles a simple SQL where clause (comparisons, IN, IS [NOT] NULL, AND, OR, NOT, parentheses) into a
+   function of a row."""
+   if not where:
+      return None
+   toks = _tokens(where)
+   pos = [0]
+
+   def peek():
+      return toks[pos[0]] if pos[0] < len(toks) else (None, None)
+
+   def take():
+      pos[0] += 1
+      return toks[pos[0] - 1]
+
+   def expr():
+      f = term()
+      while peek() == ('kw', 'OR'):
+         take()
+         a, b = f, term()
+         f = (lambda a, b: lambda r: a(r) or b(r))(a, b)
+      return f
+
+   def term():
+      f = factor()
+      while peek() == ('kw', 'AND'):
+         take()
+         a, b = f, factor()
+         f = (lambda a, b: lambda r: a(r) and b(r))(a, b)
+      return f
+
+   def factor():
+      t = peek()
+      if t == ('kw', 'NOT'):
+         take()
+         a = factor()
+         return lambda r: not a(r)
+      if t == ('op', '('):
+         take()
+         f = expr()
+         take()
+         return f
+      kind, name = take()
+      ix = table.fieldIndex(name)
+      kind, op = take()
+      if (kind, op) == ('kw', 'IS'):
+         neg = peek() == ('kw', 'NOT')
+         if neg:
+            take()
+         take()
+         return (lambda r: r[ix] is not None) if neg else (lambda r: r[ix] is None)
+      if (kind, op) == ('kw', 'IN'):
+         take()
+         vals = []
+         while peek() != ('op', ')'):
+            k, v = take()
+            if k == 'val':
+               vals.append(v)
+         take()
+         vals = set(vals)
+         return lambda r: r[ix] in vals
+      k, v = take()
+      cmp = {'=': lambda a, b: a == b, '<>': lambda a, b: a != b, '!=': lambda a, b: a != b,
+             '<': lambda a, b: a < b, '>': lambda a, b: a > b, '<=': lambda a, b: a <= b,
+             '>=': lambda a, b: a >= b}[op]
+      return lambda r: r[ix] is not None and cmp(r[ix], v)
+
+   return expr()
+
+
+# ---- cursors ----
+
+
+_oidInRe = re.compile(r'^\s*(\w+)\s+IN\s*\(([\d\s,]*)\)\s*$', re.IGNORECASE)
+
+
+def _oidLookup(where, table):
+   """Returns the sorted OIDs for a where clause of the form 'OBJECTID IN (...)', or None for other clauses (OIDs are
+   looked up directly, as a geodatabase uses its OID index)."""
+   m = _oidInRe.match(where or '')
+   if m is None or m.group(1).lower() != table.fields[0].name.lower():
+      return None
+   return sorted(set([int(a) for a in m.group(2).split(',') if a.strip()]))
+
+
+def _fieldGetters(table, fields):
+   if isinstance(fields, str):
+      fields = [fields] if fields != '*' else [f.name for f in table.fields]
+   getters, setters = [], []
+   for f in fields:
+      u = f.upper()
+      if u == 'OID@':
+         getters.append(lambda oid, r: oid)
+         setters.append(None)
+      elif u in ('SHAPE@', 'SHAPE'):
+         ix = table.fieldIndex('Shape')
+         getters.append((lambda ix: lambda oid, r: r[ix])(ix))
+         setters.append((lambda ix: lambda r, v: r.__setitem__(ix, _toGeom(table, v)))(ix))
+      elif u == 'SHAPE@XY':
+         ix = table.fieldIndex('Shape')
+         getters.append((lambda ix: lambda oid, r: _xy(r[ix]))(ix))
+         setters.append((lambda ix: lambda r, v: r.__setitem__(ix, _toGeom(table, v)))(ix))
+      elif u == 'SHAPE@WKB':
+         ix = table.fieldIndex('Shape')
+         getters.append((lambda ix: lambda oid, r: r[ix].WKB if r[ix] is not None else None)(ix))
+         setters.append(None)
+      else:
+         ix = table.fieldIndex(f)
+         getters.append((lambda ix: lambda oid, r: r[ix])(ix))
+         if table.fields[ix].type == 'OID':
+            setters.append(None)
+         else:
+            setters.append((lambda ix: lambda r, v: r.__setitem__(ix, v))(ix))
+   return getters, setters
+
+
+def _xy(g):
+   if g is None:
+      return (None, None)
+   if g.type == 'point':
+      return g.parts[0][0]
+   c = g.centroid
+   return (c.X, c.Y)
+
+
+def _toGeom(table, v):
+   if v is None or isinstance(v, Geometry):
+      return v
+   if isinstance(v, (tuple, list)) and len(v) == 2 and not isinstance(v[0], (list, tuple)):
+      return PointGeometry(tuple(v), table.spatialReference)
+   return table.geomClass(v, table.spatialReference)
+
+
+class _Cursor:
+   def __init__(self, in_table, field_names, where_clause=None, *args, **kwargs):
+      self.table, lyrWhere = _resolve(in_table)
+      self.getters, self.setters = _fieldGetters(self.table, field_names)
+      self.fields = tuple(field_names) if not isinstance(field_names, str) else (field_names,)
+      oids = _oidLookup(where_clause, self.table)
+      if oids is None:
+         tests = [w for w in [_compileWhere(lyrWhere, self.table), _compileWhere(where_clause, self.table)] if w]
+         self.oids = [oid for oid, r in list(self.table.rows.items()) if all([t(r) for t in tests])]
+      else:
+         test = _compileWhere(lyrWhere, self.table)
+         self.oids = [oid for oid in oids if oid in self.table.rows and (test is None or test(self.table.rows[oid]))]
+      self.pos = 0
+      self.current = None
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      return False
+
+   def __iter__(self):
+      return self
+
+   def reset(self):
+      self.pos = 0
+
+   def _next(self):
+      rows = self.table.rows
+      while self.pos < len(self.oids):
+         oid = self.oids[self.pos]
+         self.pos += 1
+         r = rows.get(oid)
+         if r is not None:
+            self.current = oid
+            return oid, r
+      raise StopIteration
+
+
+class SearchCursor(_Cursor):
+   def __next__(self):
+      oid, r = self._next()
+      return tuple([g(oid, r) for g in self.getters])
+
+   next = __next__
+
+
+class UpdateCursor(_Cursor):
+   def __init__(self, in_table, field_names, where_clause=None, *args, **kwargs):
+      _Cursor.__init__(self, in_table, field_names, where_clause)
+      self.table.touch()
+
+   def __exit__(self, *args):
+      self.table.touch()
+      return False
+
+   def __next__(self):
+      oid, r = self._next()
+      return [g(oid, r) for g in self.getters]
+
+   next = __next__
+
+   def updateRow(self, row):
+      r = self.table.rows[self.current]
+      for s, v in zip(self.setters, row):
+         if s is not None:
+            s(r, v)
+
+   def deleteRow(self):
+      del self.table.rows[self.current]
+
+
+class InsertCursor:
+   def __init__(self, in_table, field_names, *args, **kwargs):
+      self.table, w = _resolve(in_table)
+      self.getters, self.setters = _fieldGetters(self.table, field_names)
+      self.table.touch()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.table.touch()
+      return False
+
+   def insertRow(self, row):
+      t = self.table
+      r = [None] * len(t.fields)
+      for s, v in zip(self.setters, row):
+         if s is not None:
+            s(r, v)
+      oid = t.nextOID
+      t.nextOID += 1
+      r[0] = oid
+      t.rows[oid] = r
+      return oid
+
+
+# ---- tool parameters ----
+
+class Filter:
+   def __init__(self):
+      self.type = None
+      self.list = []
+
+
+class Parameter:
+   """Tool parameter (for loading the toolbox and running getParameterInfo/updateParameters)."""
+   def __init__(self, name=None, displayName=None, direction=None, datatype=None, parameterType=None, enabled=True,
+                category=None, symbology=None, multiValue=False):
+      self.name = name
+      self.displayName = displayName
+      self.direction = direction
+      self.datatype = datatype
+      self.parameterType = parameterType
+      self.enabled = enabled
+      self.category = category
+      self.multiValue = multiValue
+      self.value = None
+      self.filter = Filter()
+      self.parameterDependencies = []
+      self.altered = False
+      self.hasBeenValidated = False
+
+   @property
+   def valueAsText(self):
+      if self.value is None:
+         return None
+      if isinstance(self.value, (list, tuple)):
+         return ';'.join([str(v) for v in self.value])
+      return str(self.value)
+
+
+# ---- describe and management functions ----
+
+class _Describe:
+   def __init__(self, obj):
+      t, w = _resolve(obj)
+      self.table = t
+      self.catalogPath = t.path
+      self.path = os.path.dirname(t.path)
+      self.name = self.Name = self.baseName = os.path.basename(t.path)
+      self.fields = self.Fields = list(t.fields)
+      self.OIDFieldName = 'OBJECTID'
+      self.hasOID = True
+      self.shapeType = _shapeTypes.get((t.shapeType or '').upper())
+      self.shapeFieldName = 'Shape' if t.shapeType else None
+      self.spatialReference = t.spatialReference
+      self.lengthFieldName = ''
+      self.areaFieldName = ''
+      self.dataType = 'FeatureClass' if t.shapeType else 'Table'
+      if isinstance(obj, Result):
+         obj = obj.getOutput(0)
+      lyr = obj if isinstance(obj, Layer) else _layers.get(obj) if isinstance(obj, str) else None
+      if lyr is not None:
+         self.dataType = 'FeatureLayer'
+         self.name = self.Name = lyr.name
+         self.FIDSet = '; '.join([str(a) for a in lyr.selection])
+         self.whereClause = lyr.query or ''
+
+   @property
+   def extent(self):
+      es = [r[1].extent for r in self.table.rows.values() if r[1] is not None and r[1].parts]
+      if not es:
+         return Extent(None, None, None, None)
+      return Extent(min([e.XMin for e in es]), min([e.YMin for e in es]), max([e.XMax for e in es]),
+                    max([e.YMax for e in es]))
+
+
+def Describe(obj):
+   return _Describe(obj)
+
+
+def AddFieldDelimiters(datasource, field):
+   return field
+
+
+def ValidateFieldName(name, workspace=None):
+   # as for a file geodatabase: letters, digits and underscores, starting with a letter, up to 64 characters
+   name = re.sub('[^A-Za-z0-9_]', '_', str(name))
+   if not name[:1].isalpha():
+      name = 'T' + name
+   return name[:64]
+
+
+def ListFields(dataset, wild_card=None, field_type=None):
+   t, w = _resolve(dataset)
+   return list(t.fields)
+
+
+def Exists(dataset):
+   if isinstance(dataset, (Layer, Result)):
+      return True
+   return _key(dataset) in _tables or str(dataset) in _layers or os.path.exists(str(dataset))
+
+
+def _create(path, shapeType=None, template=None, spatial_reference=None):
+   key = _key(path)
+   if key in _tables and not env.overwriteOutput:
+      raise ExecuteError('Dataset ' + str(path) + ' already exists.')
+   if template:
+      tt, w = _resolve(template)
+      shapeType = shapeType or tt.shapeType
+      spatial_reference = spatial_reference or tt.spatialReference
+   t = Table(os.path.normpath(str(path)), shapeType, spatial_reference)
+   if template:
+      for f in tt.fields:
+         if f.type not in ('OID', 'Geometry'):
+            t.fields.append(Field(f.name, f.type, f.length, f.aliasName))
+   _tables[key] = t
+   t.touch()
+   return t
+
+
+def CreateTable_management(out_path, out_name, template=None, *args, **kwargs):
+   _create(os.path.join(str(out_path), out_name), template=template)
+   return Result(os.path.join(str(out_path), out_name))
+
+
+def CreateFeatureclass_management(out_path, out_name, geometry_type='POLYGON', template=None, has_m=None,
+                                  has_z=None, spatial_reference=None, *args, **kwargs):
+   if template and geometry_type in (None, '', 'POLYGON'):
+      geometry_type = None
+   if not isinstance(spatial_reference, SpatialReference):
+      spatial_reference = None
+   _create(os.path.join(str(out_path), out_name), geometry_type or 'POLYGON', template, spatial_reference)
+   return Result(os.path.join(str(out_path), out_name))
+
+
+def CreateFileGDB_management(out_folder_path, out_name, *args):
+   p = os.path.join(str(out_folder_path), out_name)
+   if not p.lower().endswith('.gdb'):
+      p += '.gdb'
+   if not os.path.exists(p):
+      os.makedirs(p)
+   return Result(p)
+
+
+def AddField_management(in_table, field_name, field_type, field_precision=None, field_scale=None,
+                        field_length=None, *args, **kwargs):
+   t, w = _resolve(in_table)
+   t.addField(field_name, field_type, field_length)
+   return Result(in_table)
+
+
+def AddFields_management(in_table, field_description, *args):
+   t, w = _resolve(in_table)
+   for d in field_description:
+      t.addField(d[0], d[1], d[3] if len(d) > 3 else None)
+   return Result(in_table)
+
+
+def DeleteField_management(in_table, drop_field, *args):
+   t, w = _resolve(in_table)
+   if isinstance(drop_field, str):
+      drop_field = drop_field.split(';')
+   for f in drop_field:
+      try:
+         ix = t.fieldIndex(f)
+      except ExecuteError:
+         continue
+      del t.fields[ix]
+      for r in t.rows.values():
+         del r[ix]
+      t.touch()
+   return Result(in_table)
+
+
+def GetCount_management(in_rows):
+   t, w = _resolve(in_rows)
+   if w:
+      return Result(str(len(SearchCursor(in_rows, ['OID@']).oids)))
+   return Result(str(len(t.rows)))
+
+
+def Rename_management(in_data, out_data, *args):
+   t = _tables.pop(_key(in_data))
+   marker = t.path + '.table'
+   if os.path.exists(marker):
+      os.remove(marker)
+   t.path = os.path.normpath(str(out_data))
+   _tables[_key(out_data)] = t
+   t.touch()
+   return Result(str(out_data))
+
+
+def Delete_management(in_data, *args):
+   if isinstance(in_data, Layer):
+      _layers.pop(in_data.name, None)
+   elif str(in_data) in _layers:
+      _layers.pop(str(in_data))
+   elif _key(in_data) in _tables:
+      t = _tables.pop(_key(in_data))
+      marker = t.path + '.table'
+      if os.path.exists(marker):
+         os.remove(marker)
+   else:
+      p = str(in_data)
+      for k in [k for k in _tables if k.startswith(os.path.normpath(p).lower() + os.sep)]:
+         del _tables[k]
+      if os.path.isdir(p):
+         import shutil
+         shutil.rmtree(p, ignore_errors=True)
+   return Result(in_data)
+
+
+def CopyFeatures_management(in_features, out_feature_class, *args, **kwargs):
+   t, w = _resolve(in_features)
+   out = _create(out_feature_class, t.shapeType, in_features, t.spatialReference)
+   for row in SearchCursor(in_features, [f.name for f in t.fields if f.type != 'OID']):
+      out.rows[out.nextOID] = [out.nextOID] + list(row)
+      out.nextOID += 1
+   return Result(out_feature_class)
+
+
+CopyRows_management = CopyFeatures_management
+
+
+def Select_analysis(in_features, out_feature_class, where_clause=None):
+   return CopyFeatures_management(Layer('sel', _resolve(in_features)[0], where_clause), out_feature_class)
+
+
+def MakeFeatureLayer_management(in_features, out_layer=None, where_clause=None, *args, **kwargs):
+   t, w = _resolve(in_features)
+   if w and where_clause:
+      where_clause = '(' + w + ') AND (' + where_clause + ')'
+   lyr = Layer(out_layer or ('lyr' + str(len(_layers))), t, where_clause or w)
+   _layers[lyr.name] = lyr
+   return Result(lyr)
+
+
+MakeTableView_management = MakeFeatureLayer_management
+
+
+def SelectLayerByLocation_management(in_layer, overlap_type='INTERSECT', select_features=None, search_distance=None,
+                                     selection_type='NEW_SELECTION', *args, **kwargs):
+   """New selection of features whose extents are within search_distance of the extent of a select feature (extents
+   stand in for the geometry test, so the selection can include extra features). As in arcpy, a layer with an
+   empty selection returns all its features."""
+   if isinstance(in_layer, Result):
+      in_layer = in_layer.getOutput(0)
+   lyr = in_layer if isinstance(in_layer, Layer) else _layers[str(in_layer)]
+   dist = float(str(search_distance).split()[0]) if search_distance not in (None, '', '#') else 0.0
+   boxes = [g.extent for (g,) in SearchCursor(select_features, ['SHAPE@']) if g is not None and g.parts]
+   cell = max(sorted([max(b.XMax - b.XMin, b.YMax - b.YMin) for b in boxes])[len(boxes) // 2], 1.0) if boxes else 1.0
+   grid = {}
+   for b in boxes:
+      for i in range(int((b.XMin - dist) // cell), int((b.XMax + dist) // cell) + 1):
+         for j in range(int((b.YMin - dist) // cell), int((b.YMax + dist) // cell) + 1):
+            grid.setdefault((i, j), []).append(b)
+   sel = []
+   for oid, g in SearchCursor(Layer('sel', lyr.table, lyr.query), ['OID@', 'SHAPE@']):
+      if g is None or not g.parts:
+         continue
+      e = g.extent
+      cand = [b for i in range(int(e.XMin // cell), int(e.XMax // cell) + 1)
+              for j in range(int(e.YMin // cell), int(e.YMax // cell) + 1) for b in grid.get((i, j), [])]
+      if [b for b in cand if b.XMin - dist <= e.XMax and e.XMin <= b.XMax + dist and b.YMin - dist <= e.YMax and
+          e.YMin <= b.YMax + dist]:
+         sel.append(oid)
+   lyr.selection = sel
+   if sel:
+      w = 'OBJECTID IN (' + ','.join([str(a) for a in sel]) + ')'
+      lyr.where = '(' + lyr.query + ') AND ' + w if lyr.query else w
+   else:
+      lyr.where = lyr.query
+   return Result(lyr)
+
+
+# extensions checked out (used to check that nothing is checked out on import)
+checkedOut = []
+
+
+def CheckOutExtension(name):
+   checkedOut.append(name)
+   return 'CheckedOut'
+
+
+def CheckInExtension(name):
+   return 'CheckedIn'
+
+
+_messages = []
+
+
+def AddMessage(msg):
+   _messages.append((0, str(msg)))
+
+
+def AddWarning(msg):
+   _messages.append((1, str(msg)))
+
+
+def AddError(msg):
+   _messages.append((2, str(msg)))
+
+
+def GetMessages(severity=None):
+   return '\n'.join([m for s, m in _messages if severity is None or s == severity])
+
+
+def reset():
+   """Deletes all tables, layers and messages."""
+   _tables.clear()
+   _layers.clear()
+   del _messages[:]
+
+
+env = types.SimpleNamespace(workspace=None, scratchFolder=tempfile.gettempdir(), scratchGDB=None,
+                            scratchWorkspace=None, overwriteOutput=True, outputCoordinateSystem=None,
+                            qualifiedFieldNames=True)
+env.scratchGDB = os.path.join(env.scratchFolder, 'scratch.gdb')
+da = types.SimpleNamespace(SearchCursor=SearchCursor, UpdateCursor=UpdateCursor, InsertCursor=InsertCursor)
+
+
+def install(force=False):
+   """Makes this module importable as arcpy, if arcpy is not available (or force = True).
+   Returns True if the stand-in is installed."""
+   if not force:
+      try:
+         import arcpy
+         return getattr(arcpy, '__file__', None) == __file__
+      except ImportError:
+         pass
+   mod = sys.modules[__name__]
+   sys.modules['arcpy'] = mod
+   sys.modules['arcpy.da'] = da
+   return True
+
+
+# end
@@ -0,0 +1,293 @@
+# Network helper functions for python toolbox
+# In-memory (arcpy-free) stream network graph, used for network grouping in place of Network Analyst service areas.
+# Flowlines are read from/written to feature classes in tbx_helper.
+import heapq
+import os
+
+import numpy as np
+
+from tbx_core import *
+
+
+class FlowGraph:
+   """Undirected flowline network in compressed sparse row (CSR) form.
+   Nodes are flowline end points; edges are flowlines. Attributes (all NumPy arrays):
+      indptr = node offsets into adjNode/adjEdge (length nNodes + 1)
+      adjNode, adjEdge = neighbor node and connecting edge, for each node's adjacency list
+      edgeFrom, edgeTo, edgeLen, edgeID = edge end nodes, length, and flowline ID (NHDPlusID)
+      edgeOrder = stream order of each edge (StreamOrde), or None
+      xy, xyptr = flowline vertices, and offsets of each edge's vertices into xy (used for snapping)
+      xym = distance of each vertex along its edge
+   A graph can be saved to a folder of .npy files (see save) and opened memory-mapped (see load), so it is built once
+   for a flowline dataset and shared by all runs and worker processes (see tbx_helper.flowGraph)."""
+   arrays = ['indptr', 'adjNode', 'adjEdge', 'edgeFrom', 'edgeTo', 'edgeLen', 'edgeID', 'xy', 'xyptr', 'edgeOrder',
+             'xym']
+
+   def __init__(self, indptr, adjNode, adjEdge, edgeFrom, edgeTo, edgeLen, edgeID, xy, xyptr, edgeOrder=None,
+                xym=None):
+      self.indptr = indptr
+      self.adjNode = adjNode
+      self.adjEdge = adjEdge
+      self.edgeFrom = edgeFrom
+      self.edgeTo = edgeTo
+      self.edgeLen = edgeLen
+      self.edgeID = edgeID
+      self.edgeOrder = edgeOrder
+      self.xy = xy
+      self.xyptr = xyptr
+      if xym is None:
+         seg = np.hypot(*np.diff(xy, axis=0).T) if len(xy) > 1 else np.empty(0)
+         cum = np.concatenate([[0.0], np.cumsum(seg)])
+         xym = cum - np.repeat(cum[xyptr[:-1]], np.diff(xyptr))
+      self.xym = xym
+      self._index = None
+
+   @property
+   def nNodes(self):
+      return len(self.indptr) - 1
+
+   @property
+   def nEdges(self):
+      return len(self.edgeLen)
+
+   @classmethod
+   def fromLines(cls, ids, lines, tol=0.01, orders=None):
+      """Builds a graph from flowline vertices. Lines sharing an end point (within tol) are connected.
+      ids = flowline IDs (e.g. NHDPlusID)
+      lines = list of (n, 2) arrays of line vertices, in order
+      orders = stream orders of the flowlines (optional)"""
+      lines = [np.asarray(l, dtype=float).reshape(-1, 2) for l in lines]
+      n = len(lines)
+      xyptr = np.zeros(n + 1, dtype=np.int64)
+      xyptr[1:] = np.cumsum([len(l) for l in lines])
+      xy = np.vstack(lines) if n else np.empty((0, 2))
+      seg = np.hypot(*np.diff(xy, axis=0).T) if len(xy) > 1 else np.empty(0)
+      cum = np.concatenate([[0.0], np.cumsum(seg)])
+      edgeLen = cum[xyptr[1:] - 1] - cum[xyptr[:-1]]
+      ends = np.vstack([xy[xyptr[:-1]], xy[xyptr[1:] - 1]])
+      keys = np.round(ends / tol).astype(np.int64)
+      nodes = np.unique(keys, axis=0, return_inverse=True)[1].reshape(-1)
+      edgeFrom, edgeTo = nodes[:n], nodes[n:]
+      nNodes = int(nodes.max()) + 1 if n else 0
+      indptr, adjNode, adjEdge = buildCSR(edgeFrom, edgeTo, nNodes)
+      xym = cum - np.repeat(cum[xyptr[:-1]], np.diff(xyptr))
+      if orders is not None:
+         orders = np.array([-1 if a is None else a for a in orders], dtype=np.int64)
+      return cls(indptr, adjNode, adjEdge, edgeFrom, edgeTo, edgeLen, np.asarray(ids), xy, xyptr, orders, xym)
+
+   def save(self, folder):
+      """Writes the graph arrays (.npy), with the edge index (see edgeIndex), to a folder."""
+      for a in self.arrays:
+         v = getattr(self, a)
+         np.save(os.path.join(folder, a + '.npy'), np.empty(0, dtype=np.int64) if v is None else np.asarray(v),
+                 allow_pickle=False)
+      self.edgeIndex().save(folder)
+
+   @classmethod
+   def load(cls, folder):
+      """Opens a graph saved with save. Arrays are memory-mapped (read-only, and not copied into memory), so a graph
+      used by several processes is read from disk once."""
+      import tbx_geom
+      a = dict([(k, tbx_geom.loadArray(os.path.join(folder, k + '.npy'))) for k in cls.arrays])
+      if len(a['edgeOrder']) == 0:
+         a['edgeOrder'] = None
+      g = cls(**a)
+      g._index = tbx_geom.BoxGrid.load(folder)
+      return g
+
+   def edgeIndex(self):
+      """Grid spatial index over edge bounding boxes (tbx_geom.BoxGrid, built on first use)."""
+      if self._index is None:
+         import tbx_geom
+         b = np.empty((self.nEdges, 4))
+         if self.nEdges:
+            starts = self.xyptr[:-1]
+            b[:, 0], b[:, 1] = np.minimum.reduceat(self.xy, starts).T
+            b[:, 2], b[:, 3] = np.maximum.reduceat(self.xy, starts).T
+         self._index = tbx_geom.BoxGrid.build(b)
+      return self._index
+
+   def snap(self, pts, snapDist, chunk=20000):
+      """Snaps points to the nearest edge within snapDist (if edges are equally near, the last edge), chunk points at
+      a time.
+      Returns a tuple of arrays: (edge, offset along edge from its from-node); edge is -1 if not snapped."""
+      pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+      edge = np.full(len(pts), -1, dtype=np.int64)
+      offset = np.zeros(len(pts))
+      if self.nEdges == 0:
+         return edge, offset
+      idx = self.edgeIndex()
+      for i0 in range(0, len(pts), chunk):
+         q = pts[i0:i0 + chunk]
+         pt, e = idx.pointPairs(q, snapDist)
+         # (point, segment) pairs for all segments of the candidate edges
+         start = self.xyptr[e]
+         ns = self.xyptr[e + 1] - start - 1
+         pt, e = np.repeat(pt, ns), np.repeat(e, ns)
+         v = np.repeat(start - np.cumsum(ns) + ns, ns) + np.arange(ns.sum())
+         a, b, p = self.xy[v], self.xy[v + 1], q[pt]
+         dx, dy = b[:, 0] - a[:, 0], b[:, 1] - a[:, 1]
+         ln = np.hypot(dx, dy)
+         l2 = np.where(ln > 0, ln * ln, 1.0)
+         t = np.clip(((p[:, 0] - a[:, 0]) * dx + (p[:, 1] - a[:, 1]) * dy) / l2, 0.0, 1.0)
+         d = np.hypot(p[:, 0] - (a[:, 0] + t * dx), p[:, 1] - (a[:, 1] + t * dy))
+         ok = np.nonzero(d <= snapDist)[0]
+         # nearest segment for each point: least distance, then last edge, then first segment
+         ok = ok[np.lexsort((v[ok], -e[ok], d[ok], pt[ok]))]
+         first = np.ones(len(ok), dtype=bool)
+         first[1:] = pt[ok][1:] != pt[ok][:-1]
+         k = ok[first]
+         edge[i0 + pt[k]] = e[k]
+         offset[i0 + pt[k]] = self.xym[v[k]] + t[k] * ln[k]
+      return edge, offset
+
+
+class KeyIndex:
+   """Index from keys to row IDs (e.g. flowline NHDPlusID to OID), stored as sorted arrays in a folder (keys.npy,
+   rows.npy) and opened memory-mapped, so a lookup reads only the parts of the arrays it needs (see
+   tbx_helper.flowlineIndex).
+   folder = index folder, written by KeyIndex.write"""
+   def __init__(self, folder):
+      import tbx_geom
+      self.folder = folder
+      self.keys = tbx_geom.loadArray(os.path.join(folder, 'keys.npy'))
+      self.rows = tbx_geom.loadArray(os.path.join(folder, 'rows.npy'))
+
+   def __len__(self):
+      return len(self.keys)
+
+   @staticmethod
+   def write(folder, keys, rows):
+      """Writes an index of keys (numbers or strings) to row IDs (integers) to a folder. For duplicate keys, the
+      first row is kept."""
+      keys = np.asarray(keys)
+      rows = np.asarray(rows, dtype=np.int64)
+      order = np.argsort(keys, kind='stable')
+      keys, rows = keys[order], rows[order]
+      first = np.ones(len(keys), dtype=bool)
+      first[1:] = keys[1:] != keys[:-1]
+      np.save(os.path.join(folder, 'keys.npy'), keys[first], allow_pickle=False)
+      np.save(os.path.join(folder, 'rows.npy'), rows[first], allow_pickle=False)
+      return int(first.sum())
+
+   def lookup(self, keys):
+      """Returns the row IDs for keys (an array, -1 for keys not in the index)."""
+      keys = np.asarray(keys)
+      out = np.full(len(keys), -1, dtype=np.int64)
+      if len(keys) == 0 or len(self.keys) == 0:
+         return out
+      pos = np.searchsorted(self.keys, keys)
+      ok = pos < len(self.keys)
+      ok[ok] = self.keys[pos[ok]] == keys[ok]
+      out[ok] = self.rows[pos[ok]]
+      return out
+
+
+def buildCSR(edgeFrom, edgeTo, nNodes):
+   """Builds undirected CSR adjacency arrays (indptr, adjNode, adjEdge) from edge end nodes."""
+   nE = len(edgeFrom)
+   src = np.concatenate([edgeFrom, edgeTo])
+   dst = np.concatenate([edgeTo, edgeFrom])
+   eid = np.concatenate([np.arange(nE), np.arange(nE)])
+   order = np.argsort(src, kind='stable')
+   indptr = np.zeros(nNodes + 1, dtype=np.int64)
+   indptr[1:] = np.cumsum(np.bincount(src, minlength=nNodes))
+   return indptr, dst[order].astype(np.int64), eid[order].astype(np.int64)
+
+
+def networkClusters(graph, occEdge, occOffset, maxDist, cutEdge=None, cutOffset=None):
+   """Groups occurrences connected along the network within maxDist of each other (directly, or through other
+   occurrences), without passing cut locations (e.g. dams). Uses one multi-source traversal from all occurrences.
+   graph = FlowGraph
+   occEdge, occOffset = snapped occurrence locations (see FlowGraph.snap). Edge -1 = not on the network.
+   maxDist = maximum network distance between occurrences in a group
+   cutEdge, cutOffset = snapped cut locations
+   Returns a list of group IDs (1..n, in order of first appearance; None for occurrences not on the network)."""
+   occEdge = np.asarray(occEdge, dtype=np.int64)
+   occOffset = np.asarray(occOffset, dtype=float)
+   nOcc = len(occEdge)
+   n = graph.nNodes
+
+   # Locations on edges (occurrences and cuts). Edges having these are replaced by a chain of virtual nodes.
+   events = {}
+   for i in range(nOcc):
+      if occEdge[i] >= 0:
+         events.setdefault(int(occEdge[i]), []).append((float(occOffset[i]), 0, i))
+   if cutEdge is not None:
+      for e, o in zip(cutEdge, cutOffset):
+         if e >= 0:
+            events.setdefault(int(e), []).append((float(o), 1, -1))
+   extra = {}  # node: [(node, length)] for virtual edges
+   occNode = {}
+
+   def link(u, v, w):
+      extra.setdefault(u, []).append((v, w))
+      extra.setdefault(v, []).append((u, w))
+
+   nv = n
+   for e, ev in events.items():
+      ev.sort()
+      prev, prevOff = int(graph.edgeFrom[e]), 0.0
+      for off, kind, i in ev:
+         if kind == 1:
+            # cut: nothing connects across this location
+            prev = None
+         else:
+            occNode[i] = nv
+            if prev is not None:
+               link(prev, nv, off - prevOff)
+            prev = nv
+            nv += 1
+         prevOff = off
+      if prev is not None:
+         link(prev, int(graph.edgeTo[e]), max(graph.edgeLen[e] - prevOff, 0.0))
+
+   def neighbors(u):
+      if u < n:
+         for k in range(graph.indptr[u], graph.indptr[u + 1]):
+            e = graph.adjEdge[k]
+            if e not in events:
+               yield int(graph.adjNode[k]), graph.edgeLen[e]
+      for vw in extra.get(u, ()):
+         yield vw
+
+   # multi-source, distance-bounded traversal
+   dist = {}
+   label = {}
+   heap = []
+   for i, u in occNode.items():
+      dist[u] = 0.0
+      label[u] = i
+      heap.append((0.0, u))
+   heapq.heapify(heap)
+   ds = DisjointSet(nOcc)
+   while heap:
+      d, u = heapq.heappop(heap)
+      if d > dist[u]:
+         continue
+      for v, w in neighbors(u):
+         nd = d + w
+         if nd > maxDist:
+            continue
+         if v not in dist or nd < dist[v]:
+            dist[v] = nd
+            label[v] = label[u]
+            heapq.heappush(heap, (nd, v))
+
+   # merge occurrences whose nearest-occurrence areas meet within maxDist
+   for u, du in dist.items():
+      for v, w in neighbors(u):
+         if v in dist and label[v] != label[u] and du + w + dist[v] <= maxDist:
+            ds.union(label[u], label[v])
+
+   grp = {}
+   out = []
+   for i in range(nOcc):
+      if i in occNode:
+         out.append(grp.setdefault(ds.find(i), len(grp) + 1))
+      else:
+         out.append(None)
+   return out
+
+
+# end
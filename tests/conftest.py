@@ -0,0 +1,19 @@
+# Test setup: the toolbox modules are imported from the repository folder, and tests needing arcpy use the local
+# stand-in (tbx_localarcpy) when ArcGIS is not available.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def gdb(tmp_path):
+   """A new file geodatabase (in memory with the local stand-in)."""
+   import tbx_localarcpy
+   tbx_localarcpy.install()
+   import arcpy
+   arcpy.env.overwriteOutput = True
+   arcpy.CreateFileGDB_management(str(tmp_path), 'test.gdb')
+   return str(tmp_path / 'test.gdb')
@@ -0,0 +1,129 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from tbx_core import *
+
+
+@pytest.mark.parametrize('raw, std', [
+   ('2001-05-06', '2001-05-06'), ('2001-05', '2001-05-00'), ('2001', '2001-00-00'), ('2001-', '2001-00-00'),
+   ('5/6/2001', '2001-05-06'), ('05/06/2001', '2001-05-06'), ('ca. 1985', '1985-00-00'), (1999, '1999-00-00'),
+   (datetime(2001, 5, 6, 13, 0), '2001-05-06'), ('19??', noDate), ('unknown', noDate), (None, noDate)])
+def test_getStdDate(raw, std):
+   assert getStdDate(raw) == std
+
+
+def test_getStdDates():
+   pytest.importorskip('numpy')
+   from tbx_bench import makeDates
+   dates = makeDates(2000, nUnique=300) + [None, 1, 1.0, True, '1', [2001]]
+   std, flags = getStdDates(dates)
+   assert std.tolist() == [getStdDate(d) for d in dates]
+   assert flags.tolist() == [int(getStdDate(d) == noDate) for d in dates]
+   std, flags = getStdDates([])
+   assert len(std) == 0 and len(flags) == 0
+
+
+def test_DisjointSet():
+   ds = DisjointSet(6)
+   assert ds.union(0, 1) and ds.union(4, 5) and ds.union(1, 5)
+   assert not ds.union(0, 4)
+   assert ds.find(0) == ds.find(5) and ds.size[ds.find(0)] == 4
+   assert ds.labels() == [1, 1, 2, 3, 1, 1]
+   assert ds.labels(start=0) == [0, 0, 1, 2, 0, 0]
+
+
+def test_mergeGroups():
+   # groups 1 and 2 share reach 'a', groups 2 and 3 share reach 'b' (merged through 2); group 4 is alone, and
+   # group 5 has two reaches of its own
+   grp = [1, 2, 2, 3, 4, 5, 5]
+   keys = ['a', 'a', 'b', 'b', 'c', 'd', 'e']
+   newIDs, nextID = mergeGroups(grp, keys, 10)
+   assert newIDs == {1: 10, 2: 10, 3: 10}
+   assert nextID == 11
+   assert mergeGroups([1, 2], ['a', 'b'], 3) == ({}, 3)
+
+
+def test_spatialDuplicates_ranking():
+   pytest.importorskip('numpy')
+   # group 1: highest RA wins; group 2: same RA, latest date wins; group 3: ties broken by highest OID
+   oids = [1, 2, 3, 4, 5, 6, 7]
+   grp = [1, 1, 2, 2, 3, 3, 4]
+   ra = [3, 5, 2, 2, 1, 1, 0]
+   dates = ['2000-01-01', '1990-01-01', '2001-01-01', '2010-01-01', '2000-01-01', '2000-01-01', '1980-01-01']
+   assert spatialDuplicates(oids, grp, [ra, dates]) == {1, 3, 5}
+   assert spatialDuplicates(oids, grp, [dates, ra]) == {2, 3, 5}
+
+
+def test_spatialDuplicates_null_dates():
+   pytest.importorskip('numpy')
+   # null rank values never win a shared location (even against a lower RA), and lone rows are never duplicates
+   oids = [1, 2, 3, 4, 5, 6]
+   grp = [1, 1, 2, 2, 3, 4]
+   ra = [5, 1, 5, 5, 5, 5]
+   dates = [None, '2000-01-01', None, None, None, '2000-01-01']
+   assert spatialDuplicates(oids, grp, [ra, dates]) == {1, 3, 4}
+   assert spatialDuplicates(oids, grp, [dates, ra]) == {1, 3, 4}
+   assert spatialDuplicates([], [], [[], []]) == set()
+
+
+def test_spatialDuplicates_reference():
+   pytest.importorskip('numpy')
+   from tbx_bench import makeDuplicates, duplicatesPandas, duplicatesSort
+   oids, grp, ra, dates = makeDuplicates(5000, 1500)
+   assert spatialDuplicates(oids, grp, [ra, dates]) == duplicatesSort(oids, grp, ra, dates)
+   try:
+      import pandas
+   except ImportError:
+      return
+   assert spatialDuplicates(oids, grp, [ra, dates]) == duplicatesPandas(oids, grp, ra, dates)
+
+
+def test_Fingerprint():
+   def fp(rows, **params):
+      f = Fingerprint()
+      for r in rows:
+         f.addRow(r)
+      for k, v in params.items():
+         f.addParam(k, v)
+      return f.hexdigest()
+
+   rows = [(b'\x01\x02', 1, 'a'), (None, 2.5, 'b'), (b'', 3, None)]
+   assert fp(rows, a=1) == fp(list(reversed(rows)), a=1)
+   assert fp(rows, a=1) != fp(rows, a=2)
+   assert fp(rows) != fp(rows[:2])
+   # values are typed and delimited
+   assert fp([(1,)]) != fp([('1',)])
+   assert fp([(b'1',)]) != fp([('1',)])
+   assert fp([('ab', 'c')]) != fp([('a', 'bc')])
+   # duplicate rows count
+   assert fp(rows) != fp(rows + rows[:1])
+   # parameters can be fingerprints
+   inner = Fingerprint()
+   inner.addRow((1,))
+   f = Fingerprint()
+   f.addParam('input', inner)
+   assert f.params['input'] == inner.hexdigest()
+
+
+def test_pathStamp(tmp_path):
+   gdb = tmp_path / 'test.gdb'
+   gdb.mkdir()
+   (gdb / 'a0001.gdbtable').write_text('a')
+   fc = str(gdb / 'occ')
+   st = pathStamp(fc)
+   assert st.startswith(fc + '@')
+   assert pathStamp(str(tmp_path / 'missing.gdb' / 'occ')) == str(tmp_path / 'missing.gdb' / 'occ')
+   scanned = {}
+   assert pathStamp(fc, scanned) == st and list(scanned) == [str(gdb)]
+   os.utime(gdb / 'a0001.gdbtable', ns=(1, 10 ** 19))
+   assert pathStamp(fc) != st
+   # datasets in a geodatabase already scanned share its stamp
+   assert pathStamp(str(gdb / 'other'), scanned) == str(gdb / 'other') + st[len(fc):]
+
+
+def test_GetElapsedTime():
+   assert GetElapsedTime(0, 93784.5) == '1 days, 2 hours, 3 minutes, 4 seconds'
+   assert GetElapsedTime(datetime(2020, 1, 1), datetime(2020, 1, 1, 0, 1, 5)) == \
+      '0 days, 0 hours, 1 minutes, 5 seconds'
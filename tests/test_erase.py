@@ -0,0 +1,26 @@
+# Indexed erase (eraseFeatures): output rows keep their own attributes.
+
+
+def square(x, y, d=10.0):
+   import arcpy
+   return arcpy.Polygon(arcpy.Array([arcpy.Point(a, b) for a, b in
+                                     [(x, y), (x, y + d), (x + d, y + d), (x + d, y), (x, y)]]))
+
+
+def test_null_geometry_rows_do_not_shift_attributes(gdb):
+   import arcpy
+   from tbx_helper import eraseFeatures
+   occ = gdb + '/occ'
+   arcpy.CreateFeatureclass_management(gdb, 'occ', 'POLYGON')
+   arcpy.AddField_management(occ, 'SF_ID', 'LONG')
+   with arcpy.da.InsertCursor(occ, ['SHAPE@', 'SF_ID']) as ic:
+      ic.insertRow([None, 1])
+      ic.insertRow([square(0, 0), 2])
+      ic.insertRow([square(100, 0), 3])
+   erase = gdb + '/erase'
+   arcpy.CreateFeatureclass_management(gdb, 'erase', 'POLYGON')
+   with arcpy.da.InsertCursor(erase, ['SHAPE@']) as ic:
+      ic.insertRow([square(1000, 1000)])
+   out = eraseFeatures(occ, erase, gdb + '/out')
+   rows = [(r[0], r[1].extent.XMin) for r in arcpy.da.SearchCursor(out, ['SF_ID', 'SHAPE@'])]
+   assert rows == [(2, 0.0), (3, 100.0)]
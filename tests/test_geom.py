@@ -0,0 +1,71 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import tbx_geom
+from tbx_bench import checkFaces, clusterBrute, makePolys, makeRects, rectBbox, rectDifference, rectIntersect
+
+rectOps = (rectIntersect, rectDifference, lambda a: len(a) == 0, rectBbox)
+
+
+def square(x, y, size=10.0):
+   return tbx_geom.Poly([[(x, y), (x, y + size), (x + size, y + size), (x + size, y), (x, y)]])
+
+
+def test_clusterPolygons():
+   polys = [square(0, 0), square(15, 0), None, square(100, 0), square(40, 0)]
+   assert tbx_geom.clusterPolygons(polys, 5.0) == [1, 1, None, 2, 3]
+   assert tbx_geom.clusterPolygons(polys, 4.9) == [1, 2, None, 3, 4]
+   assert tbx_geom.clusterPolygons(polys, 15.0) == [1, 1, None, 2, 1]
+   # a polygon in another one's hole is measured to the edge of the hole (not contained)
+   ring = tbx_geom.Poly([[(0, 0), (0, 50), (50, 50), (50, 0), (0, 0)],
+                         [(10, 10), (10, 40), (40, 40), (40, 10), (10, 10)]])
+   assert tbx_geom.clusterPolygons([ring, square(20, 20)], 9.9) == [1, 2]
+   assert tbx_geom.clusterPolygons([ring, square(20, 20)], 10.0) == [1, 1]
+
+
+def test_clusterPolygons_reference():
+   polys = makePolys(150, extent=2000.0 * 150 ** 0.5)
+   for d in [250.0, 1000.0]:
+      assert tbx_geom.clusterPolygons(polys, d) == clusterBrute(polys, d)
+
+
+def test_ClusterTree():
+   polys = makePolys(150, extent=2000.0 * 150 ** 0.5) + [None]
+   tree = tbx_geom.ClusterTree.build(polys, 2000.0)
+   for d in [0.0, 250.0, 500.0, 1000.0, 2000.0]:
+      assert tree.groups(d) == tbx_geom.clusterPolygons(polys, d)
+   with pytest.raises(ValueError):
+      tree.groups(2000.1)
+
+
+def test_overlayFaces():
+   a = [(0.0, 0.0, 10.0, 10.0)]
+   b = [(5.0, 5.0, 15.0, 15.0)]
+   c = [(100.0, 100.0, 110.0, 110.0)]
+   faces = tbx_geom.overlayFaces([a, b, c], [rectBbox(p) for p in [a, b, c]], *rectOps)
+   assert sorted(sorted(ids) for f, ids in faces) == [[0], [0, 1], [1], [2]]
+   area = dict([(tuple(sorted(ids)), sum((r[2] - r[0]) * (r[3] - r[1]) for r in f)) for f, ids in faces])
+   assert area == {(0,): 75.0, (0, 1): 25.0, (1,): 75.0, (2,): 100.0}
+   # polygons not sharing bounding box area are returned unchanged
+   assert [f for f, ids in faces if ids == [2]] == [c]
+
+
+def test_overlayFaces_points():
+   polys = makeRects(300, extent=250.0 * 300 ** 0.5)
+   faces = tbx_geom.overlayFaces(polys, [rectBbox(p) for p in polys], *rectOps)
+   assert checkFaces(polys, faces)
+   # the same faces as one overlay of all polygons
+   one = tbx_geom.overlayFaces(polys, [rectBbox([r for p in polys for r in p])] * len(polys), *rectOps)
+   assert sorted(sorted(ids) for f, ids in faces) == sorted(sorted(ids) for f, ids in one)
+
+
+def test_eraseGeoms():
+   occ = [[(0.0, 0.0, 10.0, 10.0)], [(20.0, 0.0, 30.0, 10.0)], [(50.0, 0.0, 60.0, 10.0)]]
+   erase = {101: ([(5.0, 0.0, 12.0, 10.0)], (5.0, 0.0, 12.0, 10.0)),
+            102: ([(0.0, 0.0, 5.0, 10.0)], (0.0, 0.0, 5.0, 10.0)),
+            103: ([(25.0, 20.0, 35.0, 30.0)], (25.0, 20.0, 35.0, 30.0))}
+   pairs = ([0, 0, 1], [101, 102, 103])
+   out = tbx_geom.eraseGeoms(occ, [rectBbox(p) for p in occ], pairs, erase, *rectOps[1:])
+   # occurrence 0 is erased entirely (in two steps), 1 is a candidate which is not changed, and 2 has no candidates
+   assert out == {0: None, 1: occ[1]}
@@ -0,0 +1,51 @@
+def test_grpFieldName(gdb):
+   from tbx_helper import grpFieldName
+   assert grpFieldName('sdm_grpid', '500 Meters') == 'sdm_grpid_500'
+   assert grpFieldName('sdm_grpid', '2 Kilometers') == 'sdm_grpid_2000'
+   assert grpFieldName('sdm_grpid', '1000 Kilometers', workspace=gdb) == 'sdm_grpid_1000000'
+   assert grpFieldName('sdm_grpid', '25 Centimeters') == 'sdm_grpid_0_25'
+   assert grpFieldName('sdm_grpid', '1.5 Miles') == 'sdm_grpid_2414_016'
+   assert grpFieldName('sdm_grpid', '500', metersPerUnit=0.3048) == 'sdm_grpid_152_4'
+
+
+def test_capPoints_weights(gdb):
+   import numpy as np
+   from tbx_helper import capPoints
+   # two edges, one cut by a dam at 50; one point not snapped
+   edge = np.array([0, 0, 0, 0, 0, 0, -1, 1, 1])
+   offset = np.array([0., 10., 20., 30., 60., 70., 0., 5., 6.])
+   keep, weight = capPoints(edge, offset, 25.0, {0: np.array([50.])})
+   assert keep.tolist() == [0, 2, 3, 4, 5, 7, 8]
+   assert weight.tolist() == [2, 1, 1, 1, 1, 1, 1]
+   keep, weight = capPoints(edge, offset, 100.0)
+   assert keep.tolist() == [0, 5, 7, 8]
+   assert weight.tolist() == [5, 1, 1, 1]
+   assert weight.sum() == (edge >= 0).sum()
+   keep, weight = capPoints(np.array([-1, -1]), np.array([0., 0.]), 10.0)
+   assert keep.tolist() == [0] and weight.tolist() == [2]
+
+
+def test_polySnapPoints_groups(gdb):
+   # dropping points which cannot change groups keeps every polygon-catchment piece, the network groups, and each
+   # polygon's point count by group (which decides its group, see polyGroups)
+   import arcpy
+   import tbx_bench as b
+   from tbx_helper import polySnapPoints
+   occ = b.makeOccurrences(150, overlap=0.0, size=(20.0, 600.0))
+   polys = b.loadOccurrences(gdb + '/occ', occ)
+   ext = max([max([max(x, y) for x, y in r[0]]) for r in occ['rings']])
+   ids, rings, lines = b.makeCatchments(ext)
+   cats = b.loadPolygons(gdb + '/cats', ids, rings)
+   flowlines = b.loadLines(gdb + '/flowlines', ids, lines)
+   dams = b.loadPoints(gdb + '/dams', b.makeNetworkPoints(lines, len(lines) // 4, noise=0.0, seed=2))
+   out = []
+   for maxGap in [None, 500.0 / 2 - 2]:
+      pts = polySnapPoints(polys, cats, flowlines, gdb + '/pts', 30.0, 100.0, maxGap, dams)
+      pieces = set([r for r in arcpy.da.SearchCursor(pts, ['SF_ID', 'NHDPlusID'])])
+      out.append((pieces, arcpy.GetCount_management(pts)[0]) + b.pointGroups(pts, flowlines, dams, 500.0, 100.0))
+   assert len(set([a[0] for a in out[1][0]])) == 150
+   assert out[0][0] == out[1][0]
+   assert int(out[1][1]) < int(out[0][1])
+   assert out[0][2] == out[1][2]
+   assert out[0][3] == out[1][3]
+   assert any(len(c) > 1 for c in out[1][3].values())
@@ -0,0 +1,52 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import tbx_network
+from tbx_bench import makeNetwork, makeNetworkPoints, networkBrute, snapOld
+
+
+def lGraph():
+   # two 1000 m flowlines meeting at (1000, 0); the second has a bend
+   return tbx_network.FlowGraph.fromLines([11, 12], [[(0, 0), (1000, 0)], [(1000, 0), (1000, 600), (1000, 1000)]])
+
+
+def test_snap():
+   graph = lGraph()
+   edge, offset = graph.snap([(100, 5), (995, 800), (500, 500), (1000, 0)], 10.0)
+   assert edge.tolist()[:3] == [0, 1, -1]
+   assert np.allclose(offset[:2], [100.0, 800.0])
+   # a point on a shared end node snaps to one of its edges
+   assert (edge[3], offset[3]) in [(0, 1000.0), (1, 0.0)]
+   edge, offset = graph.snap(np.empty((0, 2)), 10.0)
+   assert len(edge) == 0 and len(offset) == 0
+
+
+def test_snap_reference():
+   ids, lines = makeNetwork(300)
+   graph = tbx_network.FlowGraph.fromLines(ids, lines)
+   pts = makeNetworkPoints(lines, 1000, noise=10.0)
+   old, new = snapOld(graph, pts, 20.0), graph.snap(pts, 20.0)
+   assert np.array_equal(old[0], new[0])
+   assert np.allclose(old[1], new[1])
+
+
+def test_networkClusters():
+   graph = lGraph()
+   # network distance between the first two occurrences is 900 + 500; the third is not on the network
+   occEdge, occOffset = [0, 1, -1], [100.0, 500.0, 0.0]
+   assert tbx_network.networkClusters(graph, occEdge, occOffset, 1400.0) == [1, 1, None]
+   assert tbx_network.networkClusters(graph, occEdge, occOffset, 1399.0) == [1, 2, None]
+   # a dam between them
+   assert tbx_network.networkClusters(graph, occEdge, occOffset, 5000.0, [0], [500.0]) == [1, 2, None]
+   assert tbx_network.networkClusters(graph, occEdge, occOffset, 5000.0, [-1], [0.0]) == [1, 1, None]
+
+
+def test_networkClusters_reference():
+   ids, lines = makeNetwork(500)
+   graph = tbx_network.FlowGraph.fromLines(ids, lines)
+   occEdge, occOffset = graph.snap(makeNetworkPoints(lines, 150), 20.0)
+   cutEdge, cutOffset = graph.snap(makeNetworkPoints(lines, 15, noise=0.0, seed=2), 2.1)
+   for d in [500.0, 2000.0]:
+      assert tbx_network.networkClusters(graph, occEdge, occOffset, d, cutEdge, cutOffset) == \
+         networkBrute(graph, occEdge, occOffset, d, cutEdge, cutOffset)
@@ -0,0 +1,65 @@
+# Round trips of tables through pandas (fc2df, df2tab).
+import datetime
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+
+def makeTable(gdb, rows):
+   import arcpy
+   t = gdb + '/nulls'
+   arcpy.CreateTable_management(gdb, 'nulls')
+   arcpy.AddFields_management(t, [['cnt', 'LONG'], ['val', 'DOUBLE'], ['name', 'TEXT', 'name', 20],
+                                  ['obsdate', 'DATE']])
+   with arcpy.da.InsertCursor(t, ['cnt', 'val', 'name', 'obsdate']) as ic:
+      for r in rows:
+         ic.insertRow(r)
+   return t
+
+
+rows = [(1, 1.5, 'a', datetime.datetime(2001, 2, 3, 4, 5, 6)),
+        (None, 2.5, 'b', datetime.datetime(1950, 1, 1)),
+        (3, None, 'c', None),
+        (-4, 4.5, None, datetime.datetime(2020, 12, 31, 23, 59, 59))]
+flds = ['cnt', 'val', 'name', 'obsdate']
+
+
+def test_fc2df_keeps_types_and_nulls(gdb):
+   from tbx_helper import fc2df
+   df = fc2df(makeTable(gdb, rows), flds, skip_nulls=False)
+   assert str(df['cnt'].dtype) == 'Int32'
+   assert str(df['val'].dtype) == 'Float64'
+   assert df['name'].dtype == 'string'
+   assert df['obsdate'].dtype.kind == 'M'
+   assert df['cnt'].isna().tolist() == [False, True, False, False]
+   assert df['val'].isna().tolist() == [False, False, True, False]
+   assert df['name'].isna().tolist() == [False, False, False, True]
+   assert df['obsdate'].isna().tolist() == [False, False, True, False]
+
+
+def test_fc2df_skip_nulls(gdb):
+   from tbx_helper import fc2df
+   df = fc2df(makeTable(gdb, rows), flds, chunkSize=2)
+   assert df['cnt'].tolist() == [1]
+
+
+def test_fc2df_empty_keeps_types(gdb):
+   from tbx_helper import fc2df
+   df = fc2df(makeTable(gdb, []), flds)
+   assert len(df) == 0
+   assert df['cnt'].dtype.kind == 'i'
+   assert df['val'].dtype.kind == 'f'
+   assert df['name'].dtype == 'string'
+   assert df['obsdate'].dtype.kind == 'M'
+
+
+@pytest.mark.parametrize('chunkSize', [2, 100])
+def test_round_trip(gdb, chunkSize):
+   import arcpy
+   from tbx_helper import fc2df, df2tab
+   df = fc2df(makeTable(gdb, rows), flds, skip_nulls=False, chunkSize=chunkSize)
+   out = df2tab(df, gdb + '/back', chunkSize=chunkSize)
+   types = dict([(f.name, f.type) for f in arcpy.ListFields(out)])
+   assert [types[f] for f in flds] == ['SmallInteger', 'Double', 'String', 'Date']
+   assert [tuple(r) for r in arcpy.da.SearchCursor(out, flds)] == rows